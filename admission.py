@@ -0,0 +1,217 @@
+"""Shared, bounded execution of pipeline work for all sessions.
+
+Streamlit runs every session's script on its own thread, so without a limit a
+few sessions editing large images can keep every core busy and stall the
+rest. The app instead hands its pipeline work to one :class:`FairExecutor`
+with as many worker threads as the host has cores:
+
+* Work is submitted to a :class:`Lane`; each session has one for its editing
+  stages and one for its full-resolution renders. A lane runs at most one
+  task at a time and keeps at most one more waiting. Submitting while a task
+  waits replaces it, because only the newest parameters matter.
+* Lanes with waiting work take turns for free workers in the order they
+  queued it, interactive lanes first, so no session can hold more than one
+  worker per lane.
+* Background lanes, used for renders, may occupy all workers but one, so
+  interactive stages always find a worker. On a single core, the pool keeps
+  a second thread for interactive lanes; it shares the core with a render
+  rather than waiting for it to finish.
+
+Set ``IMAGE_WORKDESK_PIPELINE_WORKERS`` to change the number of workers.
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, NamedTuple, Optional
+import weakref
+
+import metrics
+
+
+PIPELINE_WORKERS_ENV = "IMAGE_WORKDESK_PIPELINE_WORKERS"
+
+_QUEUE_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_pipeline_queue_wait_seconds",
+    "Time pipeline tasks waited for a worker, by lane (interactive or background).",
+    ["lane"],
+)
+_TASKS = metrics.REGISTRY.counter(
+    "imageworkdesk_pipeline_tasks_total",
+    "Pipeline tasks by outcome (run, replaced by newer work, or cancelled).",
+    ["outcome"],
+)
+_WAITING_LANES = metrics.REGISTRY.gauge(
+    "imageworkdesk_pipeline_waiting_lanes", "Lanes with a task waiting for a worker."
+)
+_BUSY_WORKERS = metrics.REGISTRY.gauge(
+    "imageworkdesk_pipeline_busy_workers", "Pipeline workers running a task."
+)
+
+
+class PipelineStats(NamedTuple):
+    workers: int
+    busy: int
+    waiting: int
+
+
+class _Task:
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        self.future: Future = Future()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.monotonic()
+
+
+class Lane(Executor):
+    """Tasks from one source, run one at a time on a :class:`FairExecutor`."""
+
+    def __init__(self, executor: "FairExecutor", background: bool) -> None:
+        self._executor = executor
+        self.background = background
+        # Guarded by the executor's lock.
+        self._running = False
+        self._waiting: Optional[_Task] = None
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        """Queue ``fn(*args, **kwargs)``, replacing this lane's waiting task.
+
+        The replaced task's future is cancelled.
+        """
+
+        return self._executor._submit(self, _Task(fn, args, kwargs))
+
+
+class FairExecutor:
+    """A fixed pool of worker threads shared fairly between lanes.
+
+    ``max_background`` bounds the workers that background lanes may occupy
+    at once; by default it leaves one worker for interactive lanes. The pool
+    runs at least one thread more than ``max_background``, even if that is
+    more than ``max_workers``.
+    """
+
+    def __init__(self, max_workers: int, max_background: Optional[int] = None) -> None:
+        if max_workers < 1:
+            raise ValueError("A pipeline executor needs at least one worker.")
+        self._max_background = (
+            max(1, max_workers - 1) if max_background is None else max_background
+        )
+        self._max_workers = max(max_workers, self._max_background + 1)
+        self._condition = threading.Condition()
+        self._ready: Deque[Lane] = deque()
+        self._busy = 0
+        self._background_busy = 0
+        self._started = False
+
+        executor = weakref.ref(self)
+
+        def stat(field: str) -> Callable[[], float]:
+            def read() -> float:
+                current = executor()
+                return 0.0 if current is None else getattr(current.stats(), field)
+
+            return read
+
+        _WAITING_LANES.set_function(stat("waiting"))
+        _BUSY_WORKERS.set_function(stat("busy"))
+
+    @classmethod
+    def from_environment(cls) -> "FairExecutor":
+        workers = int(os.environ.get(PIPELINE_WORKERS_ENV) or 0)
+        return cls(workers if workers > 0 else os.cpu_count() or 1)
+
+    def lane(self, background: bool = False) -> Lane:
+        return Lane(self, background)
+
+    def stats(self) -> PipelineStats:
+        with self._condition:
+            return PipelineStats(self._max_workers, self._busy, len(self._ready))
+
+    def _submit(self, lane: Lane, task: _Task) -> Future:
+        with self._condition:
+            if not self._started:
+                self._start_workers_locked()
+            replaced, lane._waiting = lane._waiting, task
+            if replaced is None and not lane._running:
+                self._ready.append(lane)
+                self._condition.notify_all()
+        if replaced is not None and replaced.future.cancel():
+            _TASKS.inc(outcome="replaced")
+        return task.future
+
+    def _start_workers_locked(self) -> None:
+        self._started = True
+        for number in range(self._max_workers):
+            threading.Thread(
+                target=self._work,
+                name="image-pipeline-{}".format(number + 1),
+                daemon=True,
+            ).start()
+
+    def _next_lane_locked(self) -> Optional[Lane]:
+        chosen = None
+        for index, lane in enumerate(self._ready):
+            if not lane.background:
+                chosen = index
+                break
+            if chosen is None and self._background_busy < self._max_background:
+                chosen = index
+        if chosen is None:
+            return None
+        lane = self._ready[chosen]
+        del self._ready[chosen]
+        return lane
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                lane = self._next_lane_locked()
+                while lane is None:
+                    self._condition.wait()
+                    lane = self._next_lane_locked()
+                task, lane._waiting = lane._waiting, None
+                lane._running = True
+                self._busy += 1
+                self._background_busy += lane.background
+            assert task is not None
+            _QUEUE_WAIT_SECONDS.observe(
+                time.monotonic() - task.queued_at,
+                lane="background" if lane.background else "interactive",
+            )
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    _TASKS.inc(outcome="run")
+                    try:
+                        result = task.fn(*task.args, **task.kwargs)
+                    except BaseException as exc:
+                        task.future.set_exception(exc)
+                    else:
+                        task.future.set_result(result)
+                else:
+                    _TASKS.inc(outcome="cancelled")
+            finally:
+                with self._condition:
+                    lane._running = False
+                    self._busy -= 1
+                    self._background_busy -= lane.background
+                    if lane._waiting is not None:
+                        self._ready.append(lane)
+                    self._condition.notify_all()
+
+
+_SHARED_LOCK = threading.Lock()
+_SHARED: Optional[FairExecutor] = None
+
+
+def shared_executor() -> FairExecutor:
+    """The process-wide executor configured by the environment."""
+
+    global _SHARED
+    with _SHARED_LOCK:
+        if _SHARED is None:
+            _SHARED = FairExecutor.from_environment()
+        return _SHARED
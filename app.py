@@ -1,16 +1,103 @@
 import contextlib
+from concurrent.futures import TimeoutError as FutureTimeout
+import functools
+import hashlib
+from pathlib import Path
+import tempfile
+import time
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from urllib.parse import urlsplit
+import weakref
 
 import numpy as np
 import streamlit as st
 from PIL import Image, ImageEnhance, ImageOps
-from rembg import remove
-from st_social_media_links import SocialMediaIcons
-from streamlit_cropper import st_cropper
-from streamlit_image_comparison import image_comparison
 
-from remote_image import ImageFetchError, fetch_image_from_url
+from admission import Lane, shared_executor
+from batch import BatchRecipe, process_batch, zip_stream
+import metrics
+from pipeline import (
+    COLOUR_ENHANCERS,
+    CROPPER_MAX_SIDE,
+    EditSettings,
+    StageCache,
+    VariantParams,
+    apply_tone,
+    array_digest,
+    crop_box,
+    decode_source,
+    has_colour,
+    preview_image,
+    remove_background,
+    render_variants,
+    sample_variants,
+    variant_proxy,
+)
+from remote_image import (
+    BackgroundFetch,
+    FetchCancelled,
+    FetchOverloaded,
+    ImageConnectionError,
+    ImageDownloadError,
+    ImageFetchError,
+    ImageHostUnavailable,
+    ImageTimeout,
+    ImageTooLarge,
+    InvalidImageData,
+    InvalidImageURL,
+    UnsafeImageURL,
+    fetch_image_from_url,
+    fetch_images_from_urls,
+    run_in_background,
+)
+from render_jobs import RenderJob, RenderQueue
+
+_rerun_started = time.perf_counter()
 
 VERSION = "1.0.3"
+MAX_BATCH_URLS = 20
+GALLERY_COLUMNS = 4
+THUMBNAIL_SIZE = (256, 256)
+LOAD_PROGRESS_SECONDS = 0.25
+VARIANT_COUNT = 12
+MAX_VARIANTS = 24
+SETTINGS_FRAGMENT = "edit_settings"
+RENDER_POLL_SECONDS = 0.5
+OFFLOAD_POLL_SECONDS = 0.1
+# Streamlit holds a download in memory while it is served, so the archive is
+# capped; images that do not fit are left out and reported.
+MAX_BATCH_ARCHIVE_BYTES = 256 * 1024 * 1024
+
+_FETCH_ERROR_MESSAGES = (
+    (InvalidImageURL, "Invalid URL."),
+    (UnsafeImageURL, "The URL points to a location that is not allowed."),
+    (ImageTooLarge, "The image is too large."),
+    (InvalidImageData, "The response is not a supported image."),
+    (
+        ImageHostUnavailable,
+        "The image host is not responding. Loading was skipped; try again shortly.",
+    ),
+    (ImageConnectionError, "The image host could not be reached."),
+    (ImageTimeout, "The image host took too long to respond."),
+    (FetchOverloaded, "Too many images are loading right now; try again shortly."),
+    (ImageDownloadError, "The image could not be downloaded."),
+)
+
+_RERUN_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_app_rerun_seconds",
+    "Wall time of one Streamlit script run, from first line to last.",
+)
+metrics.start_exporters_from_environment()
 
 
 # ---------- UTILS ----------
@@ -33,15 +120,671 @@ def _reset(key: str) -> None:
         ] = 0
     else:
         st.session_state[key] = 100
+    if key == "all":
+        # The checkboxes and sliders belong to stages above the results.
+        st.rerun(SETTINGS_FRAGMENT)
+
+
+def _fetch_error_message(error: ImageFetchError) -> str:
+    for error_type, message in _FETCH_ERROR_MESSAGES:
+        if isinstance(error, error_type):
+            return message
+    return "The URL could not be loaded as a safe, supported image."
+
+
+class _SessionLoad:
+    """A background URL load that is cancelled once its session is discarded."""
+
+    def __init__(self, url: str, load: BackgroundFetch) -> None:
+        self.url = url
+        self.load = load
+        weakref.finalize(self, load.cancel)
+
+
+def _cancel_remote_load() -> None:
+    pending = st.session_state.pop("remote_image_load", None)
+    if pending is not None:
+        pending.load.cancel()
+
+
+def _remote_load_progress() -> None:
+    pending = st.session_state.get("remote_image_load")
+    if pending is None:
+        return
+    if pending.load.done():
+        st.rerun()
+    received, total = pending.load.progress()
+    if total:
+        st.progress(
+            min(received / total, 1.0),
+            text=f"Downloaded {received // 1024} of {total // 1024} KiB",
+        )
+    else:
+        st.progress(0.0, text=f"Downloaded {received // 1024} KiB")
+    st.button("Cancel", key="cancel_remote_image", on_click=_cancel_remote_load)
+
+
+def _load_gallery(
+    urls: List[str], completed: List[int]
+) -> Tuple[List[Tuple[str, Image.Image]], List[Tuple[str, str]]]:
+    # Runs in the background; ``completed`` counts the URLs done so far.
+    loaded, failures = {}, []
+    for result in fetch_images_from_urls(urls, max_side=max(THUMBNAIL_SIZE)):
+        if result.error is None:
+            # Images are decoded at thumbnail size and only thumbnails are
+            # kept; a picked image is fetched again at full size, normally
+            # from the fetch cache.
+            thumbnail = result.image
+            thumbnail.thumbnail(THUMBNAIL_SIZE)
+            loaded[result.index] = (result.url, thumbnail)
+        else:
+            failures.append(
+                (result.index, result.url, _fetch_error_message(result.error))
+            )
+        completed[0] += 1
+    return (
+        [loaded[index] for index in sorted(loaded)],
+        [(failed_url, message) for _index, failed_url, message in sorted(failures)],
+    )
+
+
+class _GalleryLoad(_SessionLoad):
+    """A background load of the URL gallery, counting the URLs done."""
+
+    def __init__(self, urls: List[str]) -> None:
+        self.urls = urls
+        self.completed = [0]
+        super().__init__(
+            "\n".join(urls),
+            run_in_background(functools.partial(_load_gallery, urls, self.completed)),
+        )
+
+
+def _cancel_gallery_load() -> None:
+    pending = st.session_state.pop("remote_gallery_load", None)
+    if pending is not None:
+        pending.load.cancel()
+
+
+def _gallery_load_progress() -> None:
+    pending = st.session_state.get("remote_gallery_load")
+    if pending is None:
+        return
+    if pending.load.done():
+        st.rerun()
+    total = len(pending.urls)
+    st.progress(
+        pending.completed[0] / total,
+        text=f"Loaded {pending.completed[0]} of {total} URLs",
+    )
+    st.button("Cancel", key="cancel_remote_images", on_click=_cancel_gallery_load)
+
+
+def _pick_gallery_image(index: int) -> None:
+    st.session_state["remote_gallery_choice"] = index
+
+
+def _url_image_name(image_url: str) -> str:
+    parts = urlsplit(image_url)
+    return Path(parts.path).name or parts.hostname or "image"
+
+
+def _apply_variant(variant: VariantParams) -> None:
+    st.session_state["mirror"] = variant.mirror
+    st.session_state["rotate_slider"] = variant.rotate
+    st.session_state["brightness_slider"] = variant.brightness
+    st.session_state["saturation_slider"] = variant.saturation
+    st.session_state["contrast_slider"] = variant.contrast
+    st.session_state["sharpness_slider"] = variant.sharpness
+    st.rerun(SETTINGS_FRAGMENT)
 
 
 def _randomize() -> None:
-    st.session_state["mirror"] = np.random.choice([0, 1])
-    st.session_state["rotate_slider"] = np.random.randint(0, 360)
-    st.session_state["brightness_slider"] = np.random.randint(0, 1000)
-    st.session_state["saturation_slider"] = np.random.randint(0, 1000)
-    st.session_state["contrast_slider"] = np.random.randint(0, 1000)
-    st.session_state["sharpness_slider"] = np.random.randint(0, 1000)
+    _apply_variant(sample_variants(1)[0])
+
+
+# ---------- EDITING STAGES ----------
+# Each stage is a fragment that draws its panel and then calls the next stage,
+# so a widget change reruns its own stage and everything after it, but not the
+# stages before it or the rest of the page. Stage outputs are kept in a
+# per-session StageCache, so reruns with unchanged inputs do not recompute.
+# The stages edit a downscaled preview; the results stage hands the settings
+# they collected to a background render of the full-resolution image.
+class _BatchSource(NamedTuple):
+    """One image for a batch: ``read`` returns its bytes or decoded image."""
+
+    name: str
+    key: str
+    read: Callable[[], Any]
+
+
+class _EditContext(NamedTuple):
+    source: np.ndarray
+    source_size: Tuple[int, int]
+    variant_base: Image.Image
+    variant_key: str
+    flag: bool
+    render_source: Image.Image
+    settings: EditSettings
+    crop: Optional[Tuple[float, float, float, float]]
+
+
+_ENHANCEMENTS = (
+    ("brightness_slider", "💡 Brightness", "brightness 💡", ImageEnhance.Brightness),
+    ("saturation_slider", "Saturation", "saturation", ImageEnhance.Color),
+    ("contrast_slider", "Contrast", "contrast", ImageEnhance.Contrast),
+    ("sharpness_slider", "Sharpness", "sharpness", ImageEnhance.Sharpness),
+)
+
+
+def _pipeline_lane() -> Lane:
+    if "pipeline_lane" not in st.session_state:
+        st.session_state["pipeline_lane"] = shared_executor().lane()
+    return st.session_state["pipeline_lane"]
+
+
+def _offload(compute: Callable[[], Any]) -> Any:
+    """Run ``compute`` on the session's pipeline lane and wait for its result.
+
+    While the work is queued or running, a caption says which, and each
+    update lets a newer rerun interrupt the wait; the rerun's own work then
+    replaces this work if it has not started yet.
+    """
+
+    future = _pipeline_lane().submit(compute)
+    try:
+        return future.result(OFFLOAD_POLL_SECONDS)
+    except FutureTimeout:
+        pass
+    status = st.empty()
+    try:
+        while True:
+            status.caption(
+                "⚙️ Processing..."
+                if future.running()
+                else "⏳ Waiting for a free worker..."
+            )
+            try:
+                return future.result(OFFLOAD_POLL_SECONDS)
+            except FutureTimeout:
+                pass
+    finally:
+        status.empty()
+
+
+def _stage_cache() -> StageCache:
+    if "stage_cache" not in st.session_state:
+        st.session_state["stage_cache"] = StageCache(_offload)
+    return st.session_state["stage_cache"]
+
+
+def _render_queue() -> RenderQueue:
+    if "render_queue" not in st.session_state:
+        st.session_state["render_queue"] = RenderQueue()
+    return st.session_state["render_queue"]
+
+
+def _crop_stage(img_arr: np.ndarray, source_key: str) -> None:
+    from streamlit_cropper import st_cropper
+
+    st.text("Crop image ✂️")
+    # The cropper only needs a display-sized copy; the box it returns is
+    # scaled back to the source, which is cropped only if the crop is used.
+    _proxy_key, proxy = _stage_cache().run(
+        "cropper",
+        source_key,
+        CROPPER_MAX_SIDE,
+        lambda: preview_image(Image.fromarray(img_arr), CROPPER_MAX_SIDE),
+    )
+    box = crop_box(
+        st_cropper(proxy, return_type="box", should_resize_image=False),
+        proxy.size,
+        (img_arr.shape[1], img_arr.shape[0]),
+    )
+    left, top, right, bottom = box
+    st.text(f"Cropped width = {right - left}px and height = {bottom - top}px")
+    st.fragment(_settings_stage, key=SETTINGS_FRAGMENT)(img_arr, source_key, box)
+
+
+def _apply_settings(
+    source: Image.Image, remove_bg: bool, mirror: bool, tone: Optional[str]
+) -> Tuple[Image.Image, Image.Image]:
+    image = preview_image(source)
+    if remove_bg:
+        # Masking the source itself lets the full-resolution render reuse it.
+        image = remove_background(image, mask_source=source)
+    # Toning before mirroring leaves one channel for every later step.
+    toned = apply_tone(image, tone)
+    variant_base = toned if tone == "Grayscale" else image
+    if mirror:
+        toned = ImageOps.mirror(toned)
+    return toned, variant_base
+
+
+def _crop_source(
+    img_arr: np.ndarray, box: Optional[Tuple[int, int, int, int]]
+) -> Image.Image:
+    if box is None:
+        return Image.fromarray(img_arr)
+    left, top, right, bottom = box
+    return Image.fromarray(img_arr[top:bottom, left:right])
+
+
+def _crop_fractions(
+    box: Tuple[int, int, int, int], shape: Tuple[int, ...]
+) -> Tuple[float, float, float, float]:
+    left, top, right, bottom = box
+    height, width = shape[:2]
+    return left / width, top / height, right / width, bottom / height
+
+
+def _settings_stage(
+    img_arr: np.ndarray, source_key: str, box: Tuple[int, int, int, int]
+) -> None:
+    with st.container():
+        lcol, rcol = st.columns(2)
+        use_crop = lcol.checkbox(
+            label="Use cropped Image?",
+            help="Select to use the cropped image in further operations",
+            key="crop",
+        )
+
+        # ---------- REMOVE BACKGROUND ----------
+        remove_bg = lcol.checkbox(
+            label="Remove background?",
+            help="Select to remove background from the image",
+            key="bg",
+        )
+
+        # ---------- MIRROR ----------
+        mirror = lcol.checkbox(
+            label="Mirror image? 🪞",
+            help="Select to mirror the image",
+            key="mirror",
+        )
+
+        # ---------- GRAYSCALE / B&W ----------
+        tone = None
+        if lcol.checkbox(
+            "Convert to grayscale / black & white? 🔲",
+            key="gray_bw",
+            help="Select to convert image to grayscale or black and white",
+        ):
+            tone = lcol.radio(
+                label="Grayscale or B&W",
+                options=("Grayscale", "Black & White"),
+            )
+            if tone == "Black & White":
+                lcol.warning(
+                    "Some operations not available for black and white images."
+                )
+
+        crop_key = box if use_crop else None
+        _source_key, source = _stage_cache().run(
+            "crop", source_key, crop_key, lambda: _crop_source(img_arr, crop_key)
+        )
+        settings_key, (image, variant_base) = _stage_cache().run(
+            "settings",
+            source_key,
+            (crop_key, remove_bg, mirror, tone),
+            lambda: _apply_settings(source, remove_bg, mirror, tone),
+        )
+        rcol.image(
+            image,
+            use_column_width="auto",
+        )
+
+        if lcol.button(
+            "↩️ Reset",
+            on_click=_reset,
+            use_container_width=True,
+            kwargs={"key": "checkboxes"},
+        ):
+            lcol.success("Image reset to original!")
+
+    variant_key = hashlib.sha256(
+        repr((source_key, crop_key, remove_bg, tone)).encode("utf-8")
+    ).hexdigest()
+    _preview_key, preview = _stage_cache().run(
+        "preview",
+        source_key,
+        None,
+        lambda: np.asarray(preview_image(Image.fromarray(img_arr))),
+    )
+    context = _EditContext(
+        preview,
+        (img_arr.shape[1], img_arr.shape[0]),
+        variant_base,
+        variant_key,
+        tone != "Black & White",
+        source,
+        EditSettings(remove_bg, mirror, tone),
+        None if crop_key is None else _crop_fractions(crop_key, img_arr.shape),
+    )
+    st.fragment(_rotate_stage)(image, settings_key, context)
+
+
+def _rotate_stage(image: Image.Image, input_key: str, context: _EditContext) -> None:
+    with st.expander("🔁 Rotate", expanded=True):
+        lcol, rcol = st.columns(2)
+        if "rotate_slider" not in st.session_state:
+            st.session_state["rotate_slider"] = 0
+        degrees = lcol.slider(
+            "Drag slider to rotate image clockwise 🔁",
+            min_value=0,
+            max_value=360,
+            value=st.session_state["rotate_slider"],
+            key="rotate_slider",
+        )
+        rotate_key, rotated_img = _stage_cache().run(
+            "rotate", input_key, degrees, lambda: image.rotate(360 - degrees)
+        )
+        rcol.image(
+            rotated_img,
+            use_column_width="auto",
+            caption=f"Rotated by {degrees} degrees clockwise",
+        )
+        if lcol.button(
+            "↩️ Reset Rotation",
+            on_click=_reset,
+            use_container_width=True,
+            kwargs={"key": "rotate_slider"},
+        ):
+            lcol.success("Rotation reset to original!")
+
+    context = context._replace(settings=context.settings._replace(rotate=degrees))
+    if context.flag:
+        _next_enhancement(0, rotated_img, rotate_key, context)
+    else:
+        st.fragment(_results_stage)(rotated_img, context)
+
+
+def _next_enhancement(
+    index: int, image: Image.Image, input_key: str, context: _EditContext
+) -> None:
+    # Colour-only enhancements leave grayscale images unchanged, so their
+    # panels are skipped and they keep their neutral factor.
+    while index < len(_ENHANCEMENTS):
+        if _ENHANCEMENTS[index][3] not in COLOUR_ENHANCERS or has_colour(image):
+            st.fragment(_enhancement_stage)(index, image, input_key, context)
+            return
+        enhancements = context.settings.enhancements + (100,)
+        context = context._replace(
+            settings=context.settings._replace(enhancements=enhancements)
+        )
+        index += 1
+    st.fragment(_results_stage)(image, context)
+
+
+def _enhancement_stage(
+    index: int, image: Image.Image, input_key: str, context: _EditContext
+) -> None:
+    key, title, noun, enhancer = _ENHANCEMENTS[index]
+    name = key.split("_")[0].capitalize()
+    with st.expander(title, expanded=True):
+        lcol, rcol = st.columns(2)
+        if key not in st.session_state:
+            st.session_state[key] = 100
+        factor = lcol.slider(
+            f"Drag slider to change {noun}",
+            min_value=0,
+            max_value=1000,
+            value=st.session_state[key],
+            key=key,
+        )
+        stage_key, enhanced_img = _stage_cache().run(
+            key,
+            input_key,
+            factor,
+            lambda: enhancer(image).enhance(factor / 100),
+        )
+        rcol.image(
+            enhanced_img,
+            use_column_width="auto",
+            caption=f"{name}: {factor}%",
+        )
+        if lcol.button(
+            f"↩️ Reset {name}",
+            on_click=_reset,
+            use_container_width=True,
+            kwargs={"key": key},
+        ):
+            lcol.success(f"{name} reset to original!")
+
+    enhancements = context.settings.enhancements + (factor,)
+    context = context._replace(
+        settings=context.settings._replace(enhancements=enhancements)
+    )
+    _next_enhancement(index + 1, enhanced_img, stage_key, context)
+
+
+def _read_archive(archive: IO[bytes]) -> bytes:
+    archive.seek(0)
+    return archive.read()
+
+
+def _batch_members(
+    sources: Sequence[_BatchSource], recipe: BatchRecipe
+) -> Iterator[Tuple[str, bytes]]:
+    total = len(sources)
+    progress = st.progress(0.0, text=f"Processing {total} images...")
+    status = st.status(f"Processing {total} images...", expanded=True)
+    completed = failed = archived = 0
+
+    def report(message: str) -> None:
+        nonlocal completed
+        completed += 1
+        status.write(message)
+        progress.progress(
+            completed / total, text=f"Processed {completed} of {total} images"
+        )
+
+    def inputs() -> Iterator[Tuple[str, Any]]:
+        nonlocal failed
+        for source in sources:
+            try:
+                yield source.name, source.read()
+            except ImageFetchError as error:
+                failed += 1
+                report(f"❌ {source.name}: {_fetch_error_message(error)}")
+
+    # Closing the results cancels the renders still queued, also when a rerun
+    # or stop interrupts the loop.
+    with contextlib.closing(process_batch(inputs(), recipe)) as results:
+        for result in results:
+            if result.error is not None:
+                failed += 1
+                report(f"❌ {result.name}: {result.error}")
+            elif archived + len(result.png) > MAX_BATCH_ARCHIVE_BYTES:
+                left_out = total - completed
+                failed += left_out
+                limit = MAX_BATCH_ARCHIVE_BYTES // (1024 * 1024)
+                status.write(
+                    f"⚠️ The archive is limited to {limit} MB; "
+                    f"{left_out} images were left out."
+                )
+                break
+            else:
+                archived += len(result.png)
+                report(f"✅ {result.name}")
+                name = f"{result.index + 1:03d}_{Path(result.name).stem}.png"
+                yield name, result.png
+    progress.empty()
+    status.update(
+        label=f"Processed {total - failed} of {total} images",
+        state="error" if failed else "complete",
+        expanded=bool(failed),
+    )
+
+
+def _batch_section(context: _EditContext) -> None:
+    # Set by the main script from the uploads or the URL gallery.
+    sources = st.session_state.get("batch_sources") or []
+    if len(sources) < 2:
+        return
+    recipe = BatchRecipe(context.settings, context.crop)
+    batch_key = (tuple(source.key for source in sources), recipe)
+    with st.expander(f"📦 Apply these edits to all {len(sources)} images"):
+        if st.button(
+            "📦 Process all images", key="process_batch", use_container_width=True
+        ):
+            # The archive is written to a temporary file as results arrive,
+            # so the edited images are not all in memory while the batch runs.
+            previous = st.session_state.pop("batch_archive", None)
+            if previous is not None:
+                previous[1].close()
+            archive = tempfile.TemporaryFile()
+            for chunk in zip_stream(_batch_members(sources, recipe)):
+                archive.write(chunk)
+            st.session_state["batch_archive"] = (batch_key, archive)
+        finished = st.session_state.get("batch_archive")
+        if finished is not None and finished[0] == batch_key:
+            st.download_button(
+                "💾 Download all as ZIP",
+                data=lambda: _read_archive(finished[1]),
+                file_name="imageworkdesk.zip",
+                mime="application/zip",
+                use_container_width=True,
+            )
+
+
+def _download_button(png: Optional[bytes]) -> None:
+    st.download_button(
+        "💾 Download final image",
+        data=png or b"",
+        file_name="final_image.png",
+        mime="image/png",
+        disabled=png is None,
+        help="Rendering the full-resolution image..." if png is None else None,
+        use_container_width=True,
+    )
+
+
+def _render_progress(job: RenderJob) -> None:
+    if job.done():
+        st.rerun()
+    _download_button(None)
+
+
+def _results_stage(final_image: Image.Image, context: _EditContext) -> None:
+    from streamlit_image_comparison import image_comparison
+
+    img_arr, flag = context.source, context.flag
+    st.subheader("🪄 Results")
+
+    width, height = context.source_size
+    original_label = f"Original Image ({width} x {height})"
+    # Rotation keeps the size, so the final image is as large as its source.
+    width, height = context.render_source.size
+    final_label = f"Final Image ({width} x {height})"
+    image_comparison(
+        img1=img_arr,
+        img2=final_image,
+        label1=original_label,
+        label2=final_label,
+    )
+
+    lcol, rcol = st.columns(2)
+
+    lcol.image(
+        img_arr,
+        use_column_width="auto",
+        caption=original_label,
+    )
+
+    rcol.image(
+        final_image,
+        use_column_width="auto",
+        caption=final_label,
+    )
+
+    col1, col2, col3 = st.columns(3)
+
+    if col1.button(
+        "↩️ Reset All",
+        on_click=_reset,
+        use_container_width=True,
+        kwargs={"key": "all"},
+    ):
+        st.success(body="Image reset to original!", icon="↩️")
+
+    if col2.button(
+        "🔀 Surprise Me!",
+        on_click=_randomize,
+        use_container_width=True,
+    ):
+        st.success(body="Random image generated", icon="🔀")
+
+    job = _render_queue().request(
+        (context.variant_key, context.settings),
+        context.render_source,
+        context.settings,
+    )
+    with col3:
+        if not job.done():
+            st.fragment(_render_progress, run_every=RENDER_POLL_SECONDS)(job)
+        else:
+            try:
+                rendered = job.result()
+            except Exception:
+                st.error("The full-resolution image could not be rendered.")
+            else:
+                _download_button(rendered.png)
+
+    _batch_section(context)
+
+    # ---------- VARIANTS ----------
+    if flag:
+        with st.expander("🎲 Generate variants"):
+            variant_count = st.slider(
+                "Number of variants",
+                min_value=2,
+                max_value=MAX_VARIANTS,
+                value=VARIANT_COUNT,
+                key="variant_count",
+            )
+            if st.button(
+                "🎲 Generate variants",
+                key="generate_variants",
+                use_container_width=True,
+            ):
+                proxy = variant_proxy(context.variant_base)
+                variants = sample_variants(variant_count)
+                st.session_state["variant_grid"] = (
+                    context.variant_key,
+                    variants,
+                    _offload(lambda: render_variants(proxy, variants)),
+                )
+
+            grid = st.session_state.get("variant_grid")
+            # A different source, crop or background choice makes the previews
+            # stale; mirror and slider changes do not.
+            if grid is not None and grid[0] != context.variant_key:
+                del st.session_state["variant_grid"]
+                grid = None
+            if grid is not None:
+                st.caption("Pick a variant to apply its settings")
+                columns = st.columns(GALLERY_COLUMNS)
+                for index, (variant, preview) in enumerate(zip(grid[1], grid[2])):
+                    with columns[index % GALLERY_COLUMNS]:
+                        st.image(
+                            preview,
+                            caption=(
+                                f"{'🪞 ' if variant.mirror else ''}"
+                                f"{variant.rotate}° · B {variant.brightness}% · "
+                                f"S {variant.saturation}% · "
+                                f"C {variant.contrast}% · "
+                                f"Sh {variant.sharpness}%"
+                            ),
+                            use_column_width="auto",
+                        )
+                        st.button(
+                            "Use this",
+                            key=f"variant_pick_{index}",
+                            on_click=_apply_variant,
+                            kwargs={"variant": variant},
+                            use_container_width=True,
+                        )
 
 
 st.set_page_config(
@@ -63,7 +806,7 @@ st.title("🖼️ Welcome to Image WorkDesk!")
 with st.sidebar:
     with st.expander("Supported operations"):
         st.info(
-            "* Upload image, take one with your camera, or load from a URL\n"
+            "* Upload image, take one with your camera, or load from one or more URLs\n"
             "* Crop\n"
             "* Remove background\n"
             "* Mirror\n"
@@ -94,6 +837,10 @@ with st.sidebar:
         "https://x.com/intent/tweet?original_referer=http%3A%2F%2Flimageworkdesk.streamlit.app&ref_src=twsrc%5Etfw%7Ctwcamp%5Ebuttonembed%7Ctwterm%5Eshare%7Ctwgr%5E&text=Check%20out%20this%20cool%20Streamlit%20app%20%F0%9F%8E%88&url=https%3A%2F%2Fimageworkdesk.streamlit.app%2F",
     ]
 
+    # Imported here rather than at the top so the page header is sent before
+    # the import (which pulls in BeautifulSoup) runs on a cold start.
+    from st_social_media_links import SocialMediaIcons
+
     social_media_icons = SocialMediaIcons(
         social_media_links, colors=["lightgray"] * len(social_media_links)
     )
@@ -125,9 +872,11 @@ option = st.radio(
         "Upload an image ⬆️",
         "Take a photo with my camera 📷",
         "Load image from a URL 🌐",
+        "Load images from several URLs 🗂️",
     ),
     help="Uploaded images are deleted from the server when you\n* upload another image, or\n* clear the file uploader, or\n* close the browser tab",
 )
+batch_sources = []
 
 if option == "Take a photo with my camera 📷":
     upload_img = st.camera_input(
@@ -136,11 +885,28 @@ if option == "Take a photo with my camera 📷":
     mode = "camera"
 
 elif option == "Upload an image ⬆️":
-    upload_img = st.file_uploader(
-        label="Upload an image",
+    uploads = st.file_uploader(
+        label="Upload one or more images",
         type=["bmp", "jpg", "jpeg", "png", "svg"],
+        accept_multiple_files=True,
+        key="uploads",
+        help="Edits made to one image can then be applied to all of them.",
     )
     mode = "upload"
+    upload_img = None
+    batch_sources = [
+        _BatchSource(uploaded.name, uploaded.file_id, uploaded.getvalue)
+        for uploaded in uploads
+    ]
+    if len(uploads) > 1:
+        upload_img = st.selectbox(
+            "Image to edit",
+            uploads,
+            format_func=lambda uploaded: uploaded.name,
+            key="upload_choice",
+        )
+    elif uploads:
+        upload_img = uploads[0]
 
 elif option == "Load image from a URL 🌐":
     url = st.text_input(
@@ -148,6 +914,7 @@ elif option == "Load image from a URL 🌐":
         key="url",
         max_chars=2048,
         help="Only public HTTP(S) URLs for supported raster images are allowed.",
+        on_change=_cancel_remote_load,
     )
     mode = "url"
     upload_img = None
@@ -163,8 +930,26 @@ elif option == "Load image from a URL 🌐":
         type="primary",
         disabled=not url,
     ):
+        _cancel_remote_load()
+        st.session_state["remote_image_load"] = _SessionLoad(
+            url, run_in_background(lambda url=url: fetch_image_from_url(url))
+        )
+
+    pending = st.session_state.get("remote_image_load")
+    if pending is not None and pending.url != url:
+        _cancel_remote_load()
+    elif pending is not None and not pending.load.done():
+        st.fragment(_remote_load_progress, run_every=LOAD_PROGRESS_SECONDS)()
+    elif pending is not None:
+        del st.session_state["remote_image_load"]
         try:
-            downloaded_image = fetch_image_from_url(url)
+            downloaded_image = pending.load.result()
+        except FetchCancelled:
+            pass
+        except ImageHostUnavailable as error:
+            st.session_state.pop("remote_image_value", None)
+            st.session_state.pop("remote_image_url", None)
+            st.warning(_fetch_error_message(error), icon="⏳")
         except ImageFetchError:
             st.session_state.pop("remote_image_value", None)
             st.session_state.pop("remote_image_url", None)
@@ -176,12 +961,106 @@ elif option == "Load image from a URL 🌐":
     if st.session_state.get("remote_image_url") == url:
         upload_img = st.session_state.get("remote_image_value")
 
+elif option == "Load images from several URLs 🗂️":
+    urls_text = st.text_area(
+        "Image URLs",
+        key="batch_urls",
+        help=f"One public HTTP(S) image URL per line, up to {MAX_BATCH_URLS} URLs.",
+    )
+    urls = [line.strip() for line in urls_text.splitlines() if line.strip()]
+    if len(urls) > MAX_BATCH_URLS:
+        st.warning(f"Only the first {MAX_BATCH_URLS} URLs will be loaded.")
+        urls = urls[:MAX_BATCH_URLS]
+    mode = "url"
+    upload_img = None
+
+    if st.session_state.get("remote_gallery_urls") != urls:
+        for key in (
+            "remote_gallery",
+            "remote_gallery_errors",
+            "remote_gallery_choice",
+            "remote_gallery_image",
+            "remote_gallery_urls",
+        ):
+            st.session_state.pop(key, None)
+
+    if st.button(
+        "Load images",
+        key="load_remote_images",
+        type="primary",
+        disabled=not urls,
+    ):
+        _cancel_gallery_load()
+        st.session_state["remote_gallery_load"] = _GalleryLoad(urls)
+
+    pending = st.session_state.get("remote_gallery_load")
+    if pending is not None and pending.urls != urls:
+        _cancel_gallery_load()
+    elif pending is not None and not pending.load.done():
+        st.fragment(_gallery_load_progress, run_every=LOAD_PROGRESS_SECONDS)()
+    elif pending is not None:
+        del st.session_state["remote_gallery_load"]
+        try:
+            loaded, failures = pending.load.result()
+        except FetchCancelled:
+            pass
+        else:
+            st.session_state["remote_gallery"] = loaded
+            st.session_state["remote_gallery_errors"] = failures
+            st.session_state["remote_gallery_urls"] = urls
+            st.session_state.pop("remote_gallery_choice", None)
+            st.session_state.pop("remote_gallery_image", None)
+
+    for failed_url, message in st.session_state.get("remote_gallery_errors", []):
+        st.error(f"{failed_url}: {message}")
+
+    gallery = st.session_state.get("remote_gallery", [])
+    if gallery:
+        st.caption("Pick an image to edit")
+        choice = st.session_state.get("remote_gallery_choice")
+        columns = st.columns(GALLERY_COLUMNS)
+        for index, (image_url, thumbnail) in enumerate(gallery):
+            with columns[index % GALLERY_COLUMNS]:
+                st.image(thumbnail, caption=image_url, use_column_width="auto")
+                st.button(
+                    "✅ Selected" if index == choice else "Edit this image",
+                    key=f"gallery_pick_{index}",
+                    on_click=_pick_gallery_image,
+                    kwargs={"index": index},
+                    disabled=index == choice,
+                    use_container_width=True,
+                )
+        if choice is not None and choice < len(gallery):
+            chosen_url = gallery[choice][0]
+            chosen = st.session_state.get("remote_gallery_image")
+            if chosen is None or chosen[0] != chosen_url:
+                st.session_state.pop("remote_gallery_image", None)
+                try:
+                    with st.spinner("Loading the image..."):
+                        chosen = (chosen_url, fetch_image_from_url(chosen_url))
+                except ImageFetchError as error:
+                    st.error(f"{chosen_url}: {_fetch_error_message(error)}")
+                else:
+                    st.session_state["remote_gallery_image"] = chosen
+            if "remote_gallery_image" in st.session_state:
+                upload_img = st.session_state["remote_gallery_image"][1]
+        batch_sources = [
+            _BatchSource(
+                _url_image_name(image_url),
+                image_url,
+                functools.partial(fetch_image_from_url, image_url),
+            )
+            for image_url, _thumbnail in gallery
+        ]
+
+st.session_state["batch_sources"] = batch_sources
+
 with contextlib.suppress(NameError):
     if upload_img is not None:
         pil_img = (
             upload_img.convert("RGB")
             if mode == "url"
-            else Image.open(upload_img).convert("RGB")
+            else _offload(lambda: decode_source(upload_img.getvalue()))
         )
         img_arr = np.asarray(pil_img)
 
@@ -194,294 +1073,11 @@ with contextlib.suppress(NameError):
         st.caption("All changes are applied on top of the previous change.")
 
         # ---------- CROP ----------
-        st.text("Crop image ✂️")
-        cropped_img = st_cropper(Image.fromarray(img_arr), should_resize_image=True)
-        st.text(
-            f"Cropped width = {cropped_img.size[0]}px and height = {cropped_img.size[1]}px"
-        )
-
-        with st.container():
-            lcol, rcol = st.columns(2)
-            if lcol.checkbox(
-                label="Use cropped Image?",
-                help="Select to use the cropped image in further operations",
-                key="crop",
-            ):
-                image = cropped_img
-            else:
-                image = Image.fromarray(img_arr)
-
-            # ---------- REMOVE BACKGROUND ----------
-            if lcol.checkbox(
-                label="Remove background?",
-                help="Select to remove background from the image",
-                key="bg",
-            ):
-                image = remove(image)
-
-            # ---------- MIRROR ----------
-            if lcol.checkbox(
-                label="Mirror image? 🪞",
-                help="Select to mirror the image",
-                key="mirror",
-            ):
-                image = ImageOps.mirror(image)
-
-            # ---------- GRAYSCALE / B&W ----------
-            flag = True
-
-            if lcol.checkbox(
-                "Convert to grayscale / black & white? 🔲",
-                key="gray_bw",
-                help="Select to convert image to grayscale or black and white",
-            ):
-                mode = "L"
-                if (
-                    lcol.radio(
-                        label="Grayscale or B&W",
-                        options=("Grayscale", "Black & White"),
-                    )
-                    == "Grayscale"
-                ):
-                    image = image.convert(mode)
-                else:
-                    flag = False
-                    lcol.warning(
-                        "Some operations not available for black and white images."
-                    )
-                    thresh = np.array(image).mean()
-                    image = image.convert(mode).point(
-                        lambda x: 255 if x > thresh else 0, mode="1"
-                    )
-            else:
-                mode = "RGB"
-            rcol.image(
-                image,
-                use_column_width="auto",
-            )
-
-            if lcol.button(
-                "↩️ Reset",
-                on_click=_reset,
-                use_container_width=True,
-                kwargs={"key": "checkboxes"},
-            ):
-                lcol.success("Image reset to original!")
-
-        # ---------- OTHER OPERATIONS ----------
-        # ---------- 1ST ROW ----------
-        with st.container():
-            lcol, mcol, rcol = st.columns(3)
-
-            with lcol.expander("🔁 Rotate", expanded=True):
-                if "rotate_slider" not in st.session_state:
-                    st.session_state["rotate_slider"] = 0
-                degrees = st.slider(
-                    "Drag slider to rotate image clockwise 🔁",
-                    min_value=0,
-                    max_value=360,
-                    value=st.session_state["rotate_slider"],
-                    key="rotate_slider",
-                )
-                rotated_img = image.rotate(360 - degrees)
-                st.image(
-                    rotated_img,
-                    use_column_width="auto",
-                    caption=f"Rotated by {degrees} degrees clockwise",
-                )
-                if st.button(
-                    "↩️ Reset Rotation",
-                    on_click=_reset,
-                    use_container_width=True,
-                    kwargs={"key": "rotate_slider"},
-                ):
-                    st.success("Rotation reset to original!")
-
-            if flag:
-                with mcol.expander("💡 Brightness", expanded=True):
-                    if "brightness_slider" not in st.session_state:
-                        st.session_state["brightness_slider"] = 100
-                    brightness_factor = st.slider(
-                        "Drag slider to change brightness 💡",
-                        min_value=0,
-                        max_value=1000,
-                        value=st.session_state["brightness_slider"],
-                        key="brightness_slider",
-                    )
-                    brightness_img = np.asarray(
-                        ImageEnhance.Brightness(rotated_img).enhance(
-                            brightness_factor / 100
-                        )
-                    )
-                    st.image(
-                        brightness_img,
-                        use_column_width="auto",
-                        caption=f"Brightness: {brightness_factor}%",
-                    )
-                    if st.button(
-                        "↩️ Reset Brightness",
-                        on_click=_reset,
-                        use_container_width=True,
-                        kwargs={"key": "brightness_slider"},
-                    ):
-                        st.success("Brightness reset to original!")
-
-                with rcol.expander("Saturation", expanded=True):
-                    if "saturation_slider" not in st.session_state:
-                        st.session_state["saturation_slider"] = 100
-                    saturation_factor = st.slider(
-                        "Drag slider to change saturation",
-                        min_value=0,
-                        max_value=1000,
-                        value=st.session_state["saturation_slider"],
-                        key="saturation_slider",
-                    )
-                    saturation_img = np.asarray(
-                        ImageEnhance.Color(Image.fromarray(brightness_img)).enhance(
-                            saturation_factor / 100
-                        )
-                    )
-                    st.image(
-                        saturation_img,
-                        use_column_width="auto",
-                        caption=f"Saturation: {saturation_factor}%",
-                    )
-                    if st.button(
-                        "↩️ Reset Saturation",
-                        on_click=_reset,
-                        use_container_width=True,
-                        kwargs={"key": "saturation_slider"},
-                    ):
-                        rcol.success("Saturation reset to original!")
-
-                # ---------- 2ND ROW ----------
-                with st.container():
-                    lcol, mcol, rcol = st.columns(3)
-
-                    with lcol.expander("Contrast", expanded=True):
-                        if "contrast_slider" not in st.session_state:
-                            st.session_state["contrast_slider"] = 100
-                        contrast_factor = st.slider(
-                            "Drag slider to change contrast",
-                            min_value=0,
-                            max_value=1000,
-                            value=st.session_state["contrast_slider"],
-                            key="contrast_slider",
-                        )
-                        contrast_img = np.asarray(
-                            ImageEnhance.Contrast(
-                                Image.fromarray(saturation_img)
-                            ).enhance(contrast_factor / 100)
-                        )
-                        st.image(
-                            contrast_img,
-                            use_column_width="auto",
-                            caption=f"Contrast: {contrast_factor}%",
-                        )
-                        if st.button(
-                            "↩️ Reset Contrast",
-                            on_click=_reset,
-                            use_container_width=True,
-                            kwargs={"key": "contrast_slider"},
-                        ):
-                            st.success("Contrast reset to original!")
-
-                    with mcol.expander("Sharpness", expanded=True):
-                        if "sharpness_slider" not in st.session_state:
-                            st.session_state["sharpness_slider"] = 100
-                        sharpness_factor = st.slider(
-                            "Drag slider to change sharpness",
-                            min_value=0,
-                            max_value=1000,
-                            value=st.session_state["sharpness_slider"],
-                            key="sharpness_slider",
-                        )
-                        sharpness_img = np.asarray(
-                            ImageEnhance.Sharpness(
-                                Image.fromarray(contrast_img)
-                            ).enhance(sharpness_factor / 100)
-                        )
-                        st.image(
-                            sharpness_img,
-                            use_column_width="auto",
-                            caption=f"Sharpness: {sharpness_factor}%",
-                        )
-                        if st.button(
-                            "↩️ Reset Sharpness",
-                            on_click=_reset,
-                            use_container_width=True,
-                            kwargs={"key": "sharpness_slider"},
-                        ):
-                            st.success("Sharpness reset to original!")
-
-        # ---------- FINAL OPERATIONS ----------
-        st.subheader("🪄 Results")
-
-        try:
-            final_image = sharpness_img
-        except NameError:
-            final_image = rotated_img
-
-        image_comparison(
-            img1=img_arr,
-            img2=final_image,
-            label1=f"Original Image ({pil_img.size[0]} x {pil_img.size[1]})",
-            label2=(
-                f"Final Image ({final_image.shape[1]} x {final_image.shape[0]})"
-                if flag
-                else f"Final Image ({final_image.size[1]} x {final_image.size[0]})"
-            ),
-        )
-
-        lcol, rcol = st.columns(2)
-
-        lcol.image(
-            img_arr,
-            use_column_width="auto",
-            caption=f"Original Image ({pil_img.size[0]} x {pil_img.size[1]})",
-        )
-
-        rcol.image(
-            final_image,
-            use_column_width="auto",
-            caption=(
-                f"Final Image ({final_image.shape[1]} x {final_image.shape[0]})"
-                if flag
-                else f"Final Image ({final_image.size[1]} x {final_image.size[0]})"
-            ),
-        )
-
-        if flag:
-            Image.fromarray(final_image).save("final_image.png")
-        else:
-            final_image.save("final_image.png")
-
-        col1, col2, col3 = st.columns(3)
-
-        if col1.button(
-            "↩️ Reset All",
-            on_click=_reset,
-            use_container_width=True,
-            kwargs={"key": "all"},
-        ):
-            st.success(body="Image reset to original!", icon="↩️")
-
-        if col2.button(
-            "🔀 Surprise Me!",
-            on_click=_randomize,
-            use_container_width=True,
-        ):
-            st.success(body="Random image generated", icon="🔀")
-
-        with open("final_image.png", "rb") as file:
-            col3.download_button(
-                "💾 Download final image",
-                data=file,
-                mime="image/png",
-                use_container_width=True,
-            )
+        st.fragment(_crop_stage)(img_arr, array_digest(img_arr))
 
 st.success(
     "[Star the repo](https://github.com/SiddhantSadangi/imageworkdesk) to show your :heart:",
     icon="⭐",
 )
+
+_RERUN_SECONDS.observe(time.perf_counter() - _rerun_started)
@@ -0,0 +1,237 @@
+"""Apply one editing recipe to many uploaded images.
+
+:func:`process_batch` renders every upload on a bounded pool of worker
+processes and yields each result as soon as it is ready, with at most a few
+uploads per worker in flight, so a batch of hundreds of product shots keeps
+every core busy without queueing all of them at once.
+
+:func:`zip_stream` packs results into a ZIP archive as they arrive and yields
+the archive in chunks; only the member being written is held in memory.
+
+Set ``IMAGE_WORKDESK_BATCH_WORKERS`` to change the number of worker
+processes (by default, up to four, one per core).
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+import multiprocessing
+import os
+import threading
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+import zipfile
+
+from PIL import Image
+
+import metrics
+from pipeline import EditSettings, crop_box, encode_png, render_final
+
+
+BATCH_WORKERS_ENV = "IMAGE_WORKDESK_BATCH_WORKERS"
+DEFAULT_MAX_WORKERS = 4
+PENDING_PER_WORKER = 2
+
+_BATCH_IMAGES = metrics.REGISTRY.counter(
+    "imageworkdesk_batch_images_total",
+    "Images processed by batch edits, by outcome (ok or failed).",
+    ["outcome"],
+)
+
+
+class BatchRecipe(NamedTuple):
+    """The edits to apply to every image of a batch.
+
+    ``crop`` is ``(left, top, right, bottom)`` as fractions of each image's
+    width and height, so one crop fits images of any size.
+    """
+
+    settings: EditSettings
+    crop: Optional[Tuple[float, float, float, float]] = None
+
+
+class BatchResult(NamedTuple):
+    index: int
+    name: str
+    png: Optional[bytes]
+    error: Optional[str]
+
+
+def apply_crop(
+    image: Image.Image, crop: Optional[Tuple[float, float, float, float]]
+) -> Image.Image:
+    """Crop ``image`` to a :attr:`BatchRecipe.crop` given as fractions."""
+
+    if crop is None:
+        return image
+    left, top, right, bottom = crop
+    box = {"left": left, "top": top, "width": right - left, "height": bottom - top}
+    return image.crop(crop_box(box, (1, 1), image.size))
+
+
+def render_upload(data: Union[bytes, Image.Image], recipe: BatchRecipe) -> bytes:
+    """Decode one uploaded image, apply ``recipe`` and encode it as PNG.
+
+    ``data`` may also be an image that is already decoded, such as one
+    fetched from a URL.
+    """
+
+    if isinstance(data, Image.Image):
+        image = data.convert("RGB")
+    else:
+        with Image.open(BytesIO(data)) as source:
+            image = source.convert("RGB")
+    return encode_png(render_final(apply_crop(image, recipe.crop), recipe.settings))
+
+
+def _default_workers() -> int:
+    configured = int(os.environ.get(BATCH_WORKERS_ENV) or 0)
+    if configured > 0:
+        return configured
+    return min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+
+
+class _Pool:
+    # Workers are started with forkserver or spawn rather than fork, since the
+    # Streamlit server has threads running. A pool whose worker died is broken
+    # for good, so it is replaced on the next submission.
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._workers = 0
+
+    def size(self) -> int:
+        with self._lock:
+            if not self._workers:
+                self._workers = _default_workers()
+            return self._workers
+
+    def get(self) -> ProcessPoolExecutor:
+        workers = self.size()
+        with self._lock:
+            if self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(
+                        "forkserver" if "forkserver" in methods else "spawn"
+                    ),
+                )
+            return self._executor
+
+    def discard(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+_POOL = _Pool()
+
+
+def _submit(
+    data: Union[bytes, Image.Image], recipe: BatchRecipe
+) -> Tuple["Future[bytes]", ProcessPoolExecutor]:
+    executor = _POOL.get()
+    try:
+        return executor.submit(render_upload, data, recipe), executor
+    except BrokenProcessPool:
+        _POOL.discard(executor)
+        executor = _POOL.get()
+        return executor.submit(render_upload, data, recipe), executor
+
+
+def process_batch(
+    uploads: Iterable[Tuple[str, Union[bytes, Image.Image]]], recipe: BatchRecipe
+) -> Iterator[BatchResult]:
+    """Render every ``(name, data)`` upload, yielding results as they finish.
+
+    ``data`` is encoded image bytes or a decoded image (see
+    :func:`render_upload`). Results arrive in completion order; ``index`` is
+    the upload's position. A file that cannot be processed yields a result
+    with an ``error`` message instead of failing the batch. Closing the
+    generator cancels the renders that have not started yet.
+    """
+
+    pending: Dict["Future[bytes]", Tuple[int, str, ProcessPoolExecutor]] = {}
+    remaining = enumerate(uploads)
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < _POOL.size() * PENDING_PER_WORKER:
+                upload = next(remaining, None)
+                if upload is None:
+                    exhausted = True
+                else:
+                    index, (name, data) = upload
+                    future, executor = _submit(data, recipe)
+                    pending[future] = (index, name, executor)
+            if not pending:
+                return
+            done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name, executor = pending.pop(future)
+                try:
+                    png = future.result()
+                except BrokenProcessPool:
+                    _POOL.discard(executor)
+                    error = "A worker process stopped while processing the image."
+                except Exception as exc:
+                    error = str(exc) or type(exc).__name__
+                else:
+                    _BATCH_IMAGES.inc(outcome="ok")
+                    yield BatchResult(index, name, png, None)
+                    continue
+                _BATCH_IMAGES.inc(outcome="failed")
+                yield BatchResult(index, name, None, error)
+    finally:
+        # The generator is closed early when the archive is full or the script
+        # stops; its queued renders must not hold up the next batch.
+        for future in pending:
+            future.cancel()
+
+
+class _ChunkWriter:
+    # A write-only, unseekable file for ZipFile; it then writes each member
+    # with a data descriptor instead of seeking back to patch its header.
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def zip_stream(members: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Yield a ZIP archive of ``(name, data)`` members chunk by chunk.
+
+    Members are stored uncompressed, since PNG data is already compressed.
+    """
+
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+            yield writer.take()
+    yield writer.take()
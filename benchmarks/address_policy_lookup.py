@@ -0,0 +1,71 @@
+"""Measure AddressPolicy lookup cost as the number of rules grows.
+
+Run from the repository root::
+
+    python benchmarks/address_policy_lookup.py
+
+Each policy mixes random IPv4 and IPv6 prefixes of many lengths. A lookup is a
+single binary search over the compiled intervals, so its cost should grow only
+logarithmically, from a hundred rules to a few hundred thousand.
+"""
+
+import ipaddress
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import address_policy  # noqa: E402
+
+RULE_COUNTS = (100, 1_000, 10_000, 100_000, 300_000)
+LOOKUPS = 20_000
+
+
+def random_rules(count, generator):
+    rules = []
+    for index in range(count):
+        if index % 2:
+            network_class, bits, length = ipaddress.IPv4Network, 32, 8
+        else:
+            network_class, bits, length = ipaddress.IPv6Network, 128, 16
+        length = generator.randint(length, bits)
+        base = generator.getrandbits(length) << (bits - length)
+        action = "allow" if index % 7 == 0 else "deny"
+        rules.append(address_policy.Rule(action, network_class((base, length))))
+    return rules
+
+
+def main():
+    generator = random.Random(0)
+    addresses = [
+        ipaddress.IPv4Address(generator.getrandbits(32))
+        if index % 2
+        else ipaddress.IPv6Address(generator.getrandbits(128))
+        for index in range(LOOKUPS)
+    ]
+    print("{:>9}  {:>11}  {:>13}".format("rules", "compile s", "ns / lookup"))
+    for count in RULE_COUNTS:
+        rules = random_rules(count, generator)
+        compile_seconds = timeit.timeit(
+            lambda: address_policy.AddressPolicy(rules), number=1
+        )
+        policy = address_policy.AddressPolicy(rules)
+        decision = policy.decision
+        lookup_seconds = min(
+            timeit.repeat(
+                lambda: [decision(address) for address in addresses],
+                number=1,
+                repeat=5,
+            )
+        )
+        print(
+            "{:>9,}  {:>11.3f}  {:>13.0f}".format(
+                count, compile_seconds, lookup_seconds / LOOKUPS * 1e9
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
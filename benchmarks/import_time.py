@@ -0,0 +1,134 @@
+"""Report what importing the app's dependencies costs on a cold start.
+
+Run from the repository root::
+
+    python benchmarks/import_time.py [--top N]
+
+The top-level imports of ``app.py`` are imported in a fresh interpreter with
+``-X importtime``. Streamlit is imported first and left out of the figures,
+because the server has already imported it before the script runs. The
+table lists the slowest modules by cumulative time, and the total is what a
+new server process pays before it can render the first page.
+
+Each figure is the fastest of a few runs, with bytecode caching enabled, as
+it is on a deployed server.
+"""
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple, Sequence
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPOSITORY, "app.py")
+PRELOADED = ("streamlit",)
+RUNS = 3
+_MARKER = "--- app imports ---"
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+def app_imports(path: str = APP_PATH) -> List[str]:
+    """The modules imported at the top level of the script at ``path``."""
+
+    with open(path, encoding="utf-8") as script:
+        tree = ast.parse(script.read(), path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Parse the ``-X importtime`` lines of ``output``."""
+
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # The header line.
+        module = name.lstrip()
+        timings.append(
+            ImportTiming(
+                module,
+                (len(name) - len(module) - 1) // 2,
+                int(self_us),
+                int(cumulative_us),
+            )
+        )
+    return timings
+
+
+def measure(
+    modules: Sequence[str], preloaded: Sequence[str] = PRELOADED, runs: int = RUNS
+) -> List[ImportTiming]:
+    """Import ``modules`` in fresh interpreters after ``preloaded``.
+
+    Returns the timings of the run with the lowest total.
+    """
+
+    code = "\n".join(
+        ["import {}".format(module) for module in preloaded]
+        + ["import sys", "sys.stderr.write({!r})".format(_MARKER + "\n")]
+        + ["import {}".format(module) for module in modules]
+    )
+    environment = dict(os.environ)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    fastest: List[ImportTiming] = []
+    for _run in range(runs):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPOSITORY,
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        timings = parse_importtime(completed.stderr.split(_MARKER, 1)[1])
+        if not fastest or total_ms(timings) < total_ms(fastest):
+            fastest = timings
+    return fastest
+
+
+def total_ms(timings: Sequence[ImportTiming]) -> float:
+    return sum(timing.cumulative_us for timing in timings if timing.depth == 0) / 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=25, help="modules to list")
+    args = parser.parse_args()
+
+    timings = measure(app_imports())
+    print("{:<48}  {:>10}  {:>10}".format("module", "self ms", "total ms"))
+    for timing in sorted(timings, key=lambda timing: -timing.cumulative_us)[
+        : args.top
+    ]:
+        print(
+            "{:<48}  {:>10.1f}  {:>10.1f}".format(
+                "  " * timing.depth + timing.module,
+                timing.self_us / 1e3,
+                timing.cumulative_us / 1e3,
+            )
+        )
+    print(
+        "{} modules, {:.1f} ms after {}".format(
+            len(timings), total_ms(timings), ", ".join(PRELOADED)
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
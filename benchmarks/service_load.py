@@ -0,0 +1,139 @@
+"""Load-test the processing service and report throughput and latency.
+
+Run from the repository root::
+
+    python benchmarks/service_load.py [--url URL] [--clients N] [--requests N]
+
+Without ``--url``, a service is started in this process with the queue and
+worker settings taken from the environment. Each client keeps one connection
+open and posts the same random image with ``--query`` as the recipe. The
+report counts responses by status, including the ``429`` refusals of a
+saturated service, and gives latency percentiles for successful requests.
+"""
+
+import argparse
+from collections import Counter
+import http.client
+from io import BytesIO
+import math
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import service  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples, rank):
+    """The nearest-rank percentile of sorted ``samples``."""
+
+    return samples[max(0, math.ceil(rank / 100 * len(samples)) - 1)]
+
+
+def client(address, path, body, count, results):
+    connection = http.client.HTTPConnection(
+        *address, timeout=service.MAX_TIMEOUT_SECONDS
+    )
+    try:
+        for _request in range(count):
+            started = time.perf_counter()
+            try:
+                connection.request("POST", path, body, {"Content-Type": "image/png"})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if response.will_close:
+                    connection.close()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                status = "error"
+            results.append((status, time.perf_counter() - started))
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="service to test, for example http://host:8510")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="in total")
+    parser.add_argument("--size", type=int, default=1024, help="image side in pixels")
+    parser.add_argument("--query", default="tone=grayscale&rotate=90&contrast=150")
+    args = parser.parse_args()
+
+    running = None
+    if args.url is None:
+        running = service.ProcessingService()
+        address = (running.host, running.port)
+        print(
+            "Started a local service with {} workers".format(
+                running.jobs.stats().workers
+            )
+        )
+    else:
+        target = urlsplit(args.url)
+        address = (target.hostname, target.port or 80)
+    generator = np.random.default_rng(0)
+    output = BytesIO()
+    Image.fromarray(
+        generator.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    ).save(output, format="PNG")
+
+    results = []
+    shares = [
+        args.requests // args.clients + (index < args.requests % args.clients)
+        for index in range(args.clients)
+    ]
+    threads = [
+        threading.Thread(
+            target=client,
+            args=(address, "/process?" + args.query, output.getvalue(), share, results),
+        )
+        for share in shares
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if running is not None:
+        running.close()
+
+    statuses = Counter(status for status, _seconds in results)
+    latencies = sorted(seconds for status, seconds in results if status == 200)
+    print(
+        "{} requests from {} clients in {:.2f} s".format(
+            len(results), args.clients, elapsed
+        )
+    )
+    print(
+        "responses: {}".format(
+            ", ".join(
+                "{} x{}".format(status, count)
+                for status, count in sorted(statuses.items(), key=str)
+            )
+        )
+    )
+    print("throughput: {:.1f} images/s".format(len(latencies) / elapsed))
+    if latencies:
+        print(
+            "latency: {}".format(
+                ", ".join(
+                    "p{} {:.1f} ms".format(rank, percentile(latencies, rank) * 1e3)
+                    for rank in PERCENTILES
+                )
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare a batched variant grid with one full-resolution pipeline run.
+
+Run from the repository root::
+
+    python benchmarks/variant_grid.py
+
+The full-resolution figure runs the app's mirror, rotate and four enhancement
+steps once with Pillow, as a "Surprise Me" rerun does. The grid figures render
+that many variants of a downscaled proxy with :func:`pipeline.render_variants`,
+including the time to build the proxy.
+"""
+
+import os
+import sys
+import timeit
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline  # noqa: E402
+
+SOURCE_SIZE = (4000, 3000)
+VARIANT_COUNTS = (1, 6, 12, 24)
+
+
+def full_resolution(image, variant):
+    if variant.mirror:
+        image = ImageOps.mirror(image)
+    image = image.rotate(360 - variant.rotate)
+    image = ImageEnhance.Brightness(image).enhance(variant.brightness / 100)
+    image = ImageEnhance.Color(image).enhance(variant.saturation / 100)
+    image = ImageEnhance.Contrast(image).enhance(variant.contrast / 100)
+    return ImageEnhance.Sharpness(image).enhance(variant.sharpness / 100)
+
+
+def main():
+    generator = np.random.default_rng(0)
+    pixels = generator.integers(0, 256, SOURCE_SIZE[::-1] + (3,), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    variants = pipeline.sample_variants(max(VARIANT_COUNTS), generator)
+
+    full_seconds = min(
+        timeit.repeat(lambda: full_resolution(image, variants[0]), number=1, repeat=3)
+    )
+    print("{:<24}  {:>8}".format("run", "ms"))
+    print(
+        "{:<24}  {:>8.1f}".format(
+            "full resolution {}x{}".format(*SOURCE_SIZE), full_seconds * 1e3
+        )
+    )
+    for count in VARIANT_COUNTS:
+        seconds = min(
+            timeit.repeat(
+                lambda: pipeline.render_variants(
+                    pipeline.variant_proxy(image), variants[:count]
+                ),
+                number=1,
+                repeat=3,
+            )
+        )
+        print("{:<24}  {:>8.1f}".format("grid of {}".format(count), seconds * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""Resource-limited worker processes for untrusted image decoding.
+
+:class:`IsolatedPool` keeps a fixed number of pre-started worker processes.
+Each applies an address-space limit and a per-task CPU-time limit to itself, runs
+one function call at a time and hands the resulting array back through a
+:mod:`multiprocessing.shared_memory` block instead of pickling the pixels.
+
+Unlike :class:`concurrent.futures.ProcessPoolExecutor`, a worker that dies only
+fails the call it was running: the caller gets :class:`WorkerFailed` and the
+worker is replaced. Exceptions raised by the function itself, including
+``MemoryError`` when the address-space limit is hit, are re-raised in the
+caller.
+
+The caller names each call's shared-memory block before sending the call, so
+it can unlink the block when the worker dies or its reply is never read.
+
+Isolation is off by default; set ``IMAGE_WORKDESK_DECODE_WORKERS`` to a
+positive number of workers to enable it.
+"""
+
+import contextlib
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+import queue
+import secrets
+import signal
+import threading
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+import metrics
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None  # type: ignore[assignment]
+
+
+WORKERS_ENV = "IMAGE_WORKDESK_DECODE_WORKERS"
+MEMORY_LIMIT_ENV = "IMAGE_WORKDESK_DECODE_MEMORY_BYTES"
+DEFAULT_MEMORY_LIMIT_BYTES = 1024 * 1024 * 1024
+DEFAULT_CPU_SECONDS = 10
+DEFAULT_TIMEOUT_SECONDS = 30.0
+STARTUP_TIMEOUT_SECONDS = 60.0
+
+_RESOURCE_SIGNALS = frozenset(
+    {signal.SIGKILL, getattr(signal, "SIGXCPU", signal.SIGKILL)}
+)
+
+_WORKER_FAILURES = metrics.REGISTRY.counter(
+    "imageworkdesk_decode_worker_failures_total",
+    "Isolated decode calls that ended with the worker process dying.",
+    ["reason"],
+)
+
+
+class WorkerFailed(Exception):
+    """The worker process died or stopped responding, or none became free."""
+
+    def __init__(self, message: str, resource_exhausted: bool = False) -> None:
+        super().__init__(message)
+        self.resource_exhausted = resource_exhausted
+
+
+def _address_space_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            pages = int(statm.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def _limit_memory(memory_limit: int) -> None:
+    # Shared libraries already mapped by the worker count towards RLIMIT_AS,
+    # so the limit is headroom on top of the address space in use after start.
+    if resource is None or memory_limit <= 0:
+        return
+    _soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = (_address_space_bytes() or 0) + memory_limit
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(cpu_seconds: int) -> None:
+    # RLIMIT_CPU counts the lifetime of the process, so each task gets its
+    # budget on top of the CPU time used so far.
+    if resource is None or cpu_seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    limit = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def _share(array: np.ndarray, name: str) -> Any:
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(name, create=True, size=max(array.nbytes, 1))
+    # The caller attaches, copies and unlinks the block, or unlinks it by name
+    # if the reply never arrives, so the worker does not track it.
+    resource_tracker.unregister(block._name, "shared_memory")  # type: ignore
+    try:
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.shape, array.dtype.str
+    finally:
+        block.close()
+
+
+def _worker_main(
+    connection: Any, function: Callable[..., Any], memory_limit: int, cpu_seconds: int
+) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limit_memory(memory_limit)
+    connection.send(("ready", None))
+    while True:
+        try:
+            name, args = connection.recv()
+        except (EOFError, OSError):
+            return
+        _limit_cpu(cpu_seconds)
+        try:
+            result = function(*args)
+            if isinstance(result, tuple):
+                pixels, extra = result
+                reply = ("ok", (_share(np.asarray(pixels), name), True, extra))
+            else:
+                reply = ("ok", (_share(np.asarray(result), name), False, None))
+        except BaseException as exc:  # noqa: B902 - reported to the caller
+            reply = ("error", exc)
+        try:
+            connection.send(reply)
+        except Exception as exc:
+            connection.send(("failed", "{}: {}".format(type(exc).__name__, exc)))
+
+
+class _Worker:
+    def __init__(self, pool: "IsolatedPool") -> None:
+        self.connection, child = pool._context.Pipe()
+        self.process = pool._context.Process(
+            target=_worker_main,
+            args=(child, pool._function, pool._memory_limit, pool._cpu_seconds),
+            name="image-decode",
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.ready = False
+
+    def wait_ready(self, timeout: float) -> bool:
+        # A worker reports once it has started; its startup is not part of
+        # the first call's timeout.
+        if not self.ready and self.connection.poll(timeout):
+            self.ready = self.connection.recv() == ("ready", None)
+        return self.ready
+
+    def stop(self) -> None:
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(5)
+
+
+class IsolatedPool:
+    """Run ``function`` in resource-limited worker processes.
+
+    ``function`` must be importable by name in a fresh interpreter and return
+    something :func:`numpy.asarray` accepts, or a pair of that and a small
+    picklable value, which :meth:`run` then returns alongside the array.
+    Workers start on first use. ``timeout`` bounds the wait for a free worker
+    and for each reply; the startup of a new or replacement worker is waited
+    for separately, so it does not count against the call.
+    """
+
+    def __init__(
+        self,
+        function: Callable[..., Any],
+        workers: int,
+        memory_limit: int = DEFAULT_MEMORY_LIMIT_BYTES,
+        cpu_seconds: int = DEFAULT_CPU_SECONDS,
+        timeout: float = DEFAULT_TIMEOUT_SECONDS,
+    ) -> None:
+        if workers < 1:
+            raise ValueError("An isolated pool needs at least one worker.")
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+        self._function = function
+        self._workers = workers
+        self._memory_limit = memory_limit
+        self._cpu_seconds = cpu_seconds
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: "queue.LifoQueue[Optional[_Worker]]" = queue.LifoQueue()
+        self._all: "set[_Worker]" = set()
+        self._started = False
+        self._closed = False
+
+    @classmethod
+    def from_environment(
+        cls, function: Callable[..., Any]
+    ) -> Optional["IsolatedPool"]:
+        workers = int(os.environ.get(WORKERS_ENV) or 0)
+        if workers <= 0:
+            return None
+        return cls(
+            function,
+            workers,
+            memory_limit=int(
+                os.environ.get(MEMORY_LIMIT_ENV) or DEFAULT_MEMORY_LIMIT_BYTES
+            ),
+        )
+
+    def start(self) -> None:
+        """Start every worker now instead of on the first call."""
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The isolated pool has been closed.")
+            if self._started:
+                return
+            self._started = True
+            for _index in range(self._workers):
+                self._add_worker_locked()
+
+    def _add_worker_locked(self) -> None:
+        worker = _Worker(self)
+        self._all.add(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker: _Worker, block: str) -> None:
+        # Once the worker is dead, nothing can create the block any more, so
+        # unlinking it here cannot race with the worker.
+        worker.stop()
+        _discard(block)
+        with self._lock:
+            self._all.discard(worker)
+            if not self._closed:
+                self._add_worker_locked()
+
+    def run(self, *args: Any) -> Any:
+        """Call ``function(*args)`` in a worker and return its result as an array."""
+
+        self.start()
+        try:
+            worker = self._idle.get(timeout=self._timeout)
+        except queue.Empty:
+            raise WorkerFailed(
+                "No worker became free in time.", resource_exhausted=True
+            ) from None
+        if worker is None:
+            self._idle.put(worker)
+            raise RuntimeError("The isolated pool has been closed.")
+        block = "iwd_{}".format(secrets.token_hex(8))
+        try:
+            if not worker.wait_ready(STARTUP_TIMEOUT_SECONDS):
+                _WORKER_FAILURES.inc(reason="startup")
+                self._retire(worker, block)
+                raise WorkerFailed("The worker did not start in time.")
+            worker.connection.send((block, args))
+            if not worker.connection.poll(self._timeout):
+                _WORKER_FAILURES.inc(reason="timeout")
+                self._retire(worker, block)
+                raise WorkerFailed("The worker timed out.", resource_exhausted=True)
+            status, payload = worker.connection.recv()
+        except (EOFError, OSError) as exc:
+            worker.process.join(5)
+            exitcode = worker.process.exitcode
+            exhausted = exitcode is not None and -exitcode in _RESOURCE_SIGNALS
+            _WORKER_FAILURES.inc(reason="resources" if exhausted else "crash")
+            self._retire(worker, block)
+            raise WorkerFailed(
+                "The worker exited with code {}.".format(exitcode),
+                resource_exhausted=exhausted,
+            ) from exc
+        self._idle.put(worker)
+        if status == "error":
+            raise payload
+        if status == "failed":
+            # The block may exist if sending the reply is what failed.
+            _discard(block)
+            raise WorkerFailed(payload)
+        shared, paired, extra = payload
+        pixels = _collect(*shared)
+        return (pixels, extra) if paired else pixels
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._all = self._all, set()
+        for worker in workers:
+            worker.stop()
+        self._idle.put(None)
+
+
+def _collect(name: str, shape: Any, dtype: str) -> np.ndarray:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, np.dtype(dtype), buffer=block.buf).copy()
+    finally:
+        block.close()
+        with contextlib.suppress(FileNotFoundError):
+            block.unlink()
+
+
+def _discard(name: str) -> None:
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    with contextlib.suppress(FileNotFoundError):
+        block.unlink()
@@ -0,0 +1,313 @@
+"""Optional on-disk cache of content-addressed arrays.
+
+Each entry is a single file holding a small header followed by the raw bytes
+of one NumPy array, so reads are served by memory-mapping the payload rather
+than decoding it. The header records the dtype, shape, caller metadata and
+CRC-32 checksums; an entry whose header, length or checksum does not match is
+treated as corrupted and removed. Writes go to a temporary file that is then
+renamed into place, so readers in any process only ever see complete entries.
+The directory is kept under a byte budget by evicting the least recently used
+entries.
+
+The tier is enabled by pointing ``IMAGE_WORKDESK_CACHE_DIR`` at a writable
+directory; :func:`shared_disk_cache` returns ``None`` when it is unset.
+"""
+
+import contextlib
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+
+CACHE_DIR_ENV = "IMAGE_WORKDESK_CACHE_DIR"
+CACHE_MAX_BYTES_ENV = "IMAGE_WORKDESK_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+TOUCH_INTERVAL_SECONDS = 60.0
+
+_MAGIC = b"IWDC"
+_VERSION = 1
+_ALIGNMENT = 64
+_PREFIX = struct.Struct("<4sHHIQII")
+_SUFFIX = ".arr"
+_NAMESPACE_PATTERN = re.compile(r"[a-z][a-z0-9_]{0,31}")
+_KEY_PATTERN = re.compile(r"[0-9a-f]{16,128}")
+
+_CORRUPT_ENTRIES = metrics.REGISTRY.counter(
+    "imageworkdesk_disk_cache_corrupt_total",
+    "Disk cache entries discarded because they failed validation.",
+    ["namespace"],
+)
+_EVICTIONS = metrics.REGISTRY.counter(
+    "imageworkdesk_disk_cache_evictions_total",
+    "Disk cache entries removed to stay within the byte budget.",
+)
+
+
+class CorruptEntry(Exception):
+    """A cache file does not contain a valid, complete entry."""
+
+
+class CachedArray(NamedTuple):
+    array: np.ndarray
+    metadata: Dict[str, Any]
+
+
+def _encode_header(array: np.ndarray, metadata: Dict[str, Any]) -> bytes:
+    description = json.dumps(
+        {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "metadata": metadata,
+        },
+        separators=(",", ":"),
+        sort_keys=True,
+    ).encode("utf-8")
+    header_length = -(-(_PREFIX.size + len(description)) // _ALIGNMENT) * _ALIGNMENT
+    description = description.ljust(header_length - _PREFIX.size, b" ")
+    prefix = _PREFIX.pack(
+        _MAGIC,
+        _VERSION,
+        0,
+        header_length,
+        array.nbytes,
+        zlib.crc32(memoryview(array).cast("B")),
+        zlib.crc32(description),
+    )
+    return prefix + description
+
+
+def _decode_header(
+    entry_file: Any, file_size: int
+) -> Tuple[int, int, np.dtype, Tuple[int, ...], Dict[str, Any]]:
+    prefix = entry_file.read(_PREFIX.size)
+    if len(prefix) != _PREFIX.size:
+        raise CorruptEntry("truncated header")
+    (
+        magic,
+        version,
+        _flags,
+        header_length,
+        payload_length,
+        payload_crc,
+        header_crc,
+    ) = _PREFIX.unpack(prefix)
+    if (
+        magic != _MAGIC
+        or version != _VERSION
+        or header_length % _ALIGNMENT
+        or header_length < _PREFIX.size
+        or header_length + payload_length != file_size
+    ):
+        raise CorruptEntry("invalid header")
+    description = entry_file.read(header_length - _PREFIX.size)
+    if zlib.crc32(description) != header_crc:
+        raise CorruptEntry("header checksum mismatch")
+    try:
+        parsed = json.loads(description)
+        dtype = np.dtype(parsed["dtype"])
+        shape = tuple(int(size) for size in parsed["shape"])
+        metadata = dict(parsed["metadata"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise CorruptEntry("invalid header") from exc
+    if dtype.hasobject or int(np.prod(shape)) * dtype.itemsize != payload_length:
+        raise CorruptEntry("shape does not match payload")
+    return header_length, payload_crc, dtype, shape, metadata
+
+
+class DiskCache:
+    """Size-bounded directory of memory-mappable arrays keyed by content hash."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._verified: Dict[str, Tuple[int, int]] = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(size for _path, size, _mtime in self._entries())
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size
+
+    def _path(self, namespace: str, key: str) -> str:
+        if not _NAMESPACE_PATTERN.fullmatch(namespace):
+            raise ValueError("Invalid cache namespace: {!r}".format(namespace))
+        if not _KEY_PATTERN.fullmatch(key):
+            raise ValueError("Cache keys must be lowercase hex digests.")
+        return os.path.join(self.directory, namespace, key + _SUFFIX)
+
+    def get(self, namespace: str, key: str) -> Optional[CachedArray]:
+        """Return a read-only, memory-mapped entry, or ``None`` if absent."""
+
+        path = self._path(namespace, key)
+        try:
+            with open(path, "rb") as entry_file:
+                stat = os.fstat(entry_file.fileno())
+                header_length, payload_crc, dtype, shape, metadata = _decode_header(
+                    entry_file, stat.st_size
+                )
+            array = self._map(path, header_length, dtype, shape)
+            identity = (stat.st_mtime_ns, stat.st_size)
+            if self._verified.get(path) != identity:
+                if zlib.crc32(memoryview(array).cast("B")) != payload_crc:
+                    raise CorruptEntry("payload checksum mismatch")
+                self._verified[path] = identity
+        except FileNotFoundError:
+            metrics.record_cache_lookup("disk_" + namespace, False)
+            return None
+        except CorruptEntry:
+            _CORRUPT_ENTRIES.inc(namespace=namespace)
+            self._remove(path)
+            metrics.record_cache_lookup("disk_" + namespace, False)
+            return None
+        except OSError:
+            metrics.record_cache_lookup("disk_" + namespace, False)
+            return None
+
+        metrics.record_cache_lookup("disk_" + namespace, True)
+        if time.time() - stat.st_mtime > TOUCH_INTERVAL_SECONDS:
+            with contextlib.suppress(OSError):
+                os.utime(path)
+                self._verified[path] = (os.stat(path).st_mtime_ns, stat.st_size)
+        return CachedArray(array, metadata)
+
+    @staticmethod
+    def _map(
+        path: str, offset: int, dtype: np.dtype, shape: Tuple[int, ...]
+    ) -> np.ndarray:
+        if int(np.prod(shape)) == 0:
+            array = np.empty(shape, dtype=dtype)
+            array.flags.writeable = False
+            return array
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    def put(
+        self,
+        namespace: str,
+        key: str,
+        array: np.ndarray,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Atomically store an array; return ``False`` if it could not be written."""
+
+        path = self._path(namespace, key)
+        array = np.ascontiguousarray(array)
+        header = _encode_header(array, metadata or {})
+        size = len(header) + array.nbytes
+        if size > self.max_bytes:
+            return False
+        directory = os.path.dirname(path)
+        temporary_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=directory, prefix=".", suffix=".tmp"
+            )
+            with os.fdopen(descriptor, "wb") as entry_file:
+                entry_file.write(header)
+                entry_file.write(memoryview(array).cast("B"))
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temporary_path, path)
+            temporary_path = None
+        except OSError:
+            return False
+        finally:
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+
+        with self._lock:
+            self._size += size - replaced
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+        return True
+
+    def contains(self, namespace: str, key: str) -> bool:
+        return os.path.exists(self._path(namespace, key))
+
+    def discard(self, namespace: str, key: str) -> None:
+        self._remove(self._path(namespace, key))
+
+    def _remove(self, path: str) -> None:
+        try:
+            size = os.stat(path).st_size
+            os.unlink(path)
+        except OSError:
+            return
+        with self._lock:
+            self._size -= size
+            self._verified.pop(path, None)
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        entries = []
+        with contextlib.suppress(OSError):
+            for namespace in os.scandir(self.directory):
+                if not namespace.is_dir(follow_symlinks=False):
+                    continue
+                for entry in os.scandir(namespace.path):
+                    if entry.name.endswith(_SUFFIX) and not entry.name.startswith("."):
+                        with contextlib.suppress(OSError):
+                            stat = entry.stat(follow_symlinks=False)
+                            entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the directory fits its budget."""
+
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _path, size, _mtime in entries)
+        for path, size, _mtime in entries:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+                _EVICTIONS.inc()
+            total -= size
+            self._verified.pop(path, None)
+        with self._lock:
+            self._size = total
+
+    def clear(self) -> None:
+        for path, _size, _mtime in self._entries():
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+        with self._lock:
+            self._size = 0
+            self._verified.clear()
+
+
+_shared_lock = threading.Lock()
+_shared: Optional[DiskCache] = None
+
+
+def shared_disk_cache() -> Optional[DiskCache]:
+    """Return the process-wide cache configured by environment, if any."""
+
+    global _shared
+    directory = os.environ.get(CACHE_DIR_ENV)
+    if not directory:
+        return None
+    with _shared_lock:
+        if _shared is None or _shared.directory != os.path.abspath(directory):
+            try:
+                max_bytes = int(
+                    os.environ.get(CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES)
+                )
+                _shared = DiskCache(directory, max_bytes)
+            except (OSError, ValueError):
+                return None
+        return _shared
@@ -0,0 +1,617 @@
+"""Host-name resolution for remote image fetches.
+
+:class:`ResolverPool` runs blocking ``getaddrinfo`` calls on an elastic set of
+daemon threads. A lookup that times out cannot be interrupted, so a worker
+that has been busy for longer than ``stuck_after`` seconds is written off as
+stuck and a replacement may be started, up to a hard thread ceiling. Pending
+lookups wait in a bounded queue; when it is full, :meth:`ResolverPool.submit`
+raises :class:`ResolverSaturated` at once instead of queueing more work.
+
+:class:`UDPResolver` is an optional pure-Python stub resolver that sends A and
+AAAA queries to one recursive DNS server. Its lookups need no thread of their
+own and cancelling one closes its socket. Queries advertise an EDNS0 payload
+size, and an answer that is still truncated is asked for again over TCP.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+import contextlib
+import ipaddress
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+import weakref
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import metrics
+
+
+DEFAULT_MIN_WORKERS = 1
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_IDLE_SECONDS = 30.0
+DEFAULT_STUCK_SECONDS = 10.0
+UDP_TIMEOUT_SECONDS = 3.0
+UDP_RETRY_SECONDS = 1.0
+MAX_DNS_MESSAGE_BYTES = 4_096
+EDNS_PAYLOAD_BYTES = 1_232
+MAX_CNAME_CHAIN = 8
+
+MAX_WORKERS_ENV = "IMAGE_WORKDESK_DNS_MAX_WORKERS"
+MAX_QUEUE_ENV = "IMAGE_WORKDESK_DNS_MAX_QUEUE"
+DNS_SERVER_ENV = "IMAGE_WORKDESK_DNS_SERVER"
+
+_QUERY_TYPES = {1: socket.AF_INET, 28: socket.AF_INET6}
+_RCODE_NXDOMAIN = 3
+_TYPE_OPT = 41
+
+_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "imageworkdesk_dns_queue_depth", "Lookups waiting for a resolver thread.", ["pool"]
+)
+_IN_FLIGHT = metrics.REGISTRY.gauge(
+    "imageworkdesk_dns_in_flight", "Lookups currently running.", ["pool"]
+)
+_STUCK_WORKERS = metrics.REGISTRY.gauge(
+    "imageworkdesk_dns_stuck_workers",
+    "Resolver threads busy for longer than the stuck threshold.",
+    ["pool"],
+)
+_WORKERS = metrics.REGISTRY.gauge(
+    "imageworkdesk_dns_workers", "Resolver threads alive.", ["pool"]
+)
+_REJECTED = metrics.REGISTRY.counter(
+    "imageworkdesk_dns_rejected_total",
+    "Lookups rejected because the resolver queue was full.",
+    ["pool"],
+)
+
+
+class ResolverSaturated(RuntimeError):
+    """The resolver queue is full; the lookup was not started."""
+
+
+class DNSServerFailure(socket.gaierror):
+    """The DNS server answered with an error such as SERVFAIL or REFUSED."""
+
+
+class DNSTruncated(ValueError):
+    """The answer did not fit in a UDP response; ask again over TCP."""
+
+
+class ResolverStats(NamedTuple):
+    workers: int
+    idle: int
+    in_flight: int
+    stuck: int
+    queued: int
+
+
+class ResolverPool:
+    """Elastic, bounded pool of threads for blocking resolver calls.
+
+    Provides the ``submit`` method of :class:`concurrent.futures.Executor`.
+    Healthy workers are capped at ``max_workers``; stuck workers are not
+    counted against that cap, but the pool never runs more than
+    ``2 * max_workers`` threads in total. Workers above ``min_workers`` exit
+    after ``idle_timeout`` seconds without work.
+    """
+
+    def __init__(
+        self,
+        min_workers: int = DEFAULT_MIN_WORKERS,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        idle_timeout: float = DEFAULT_IDLE_SECONDS,
+        stuck_after: float = DEFAULT_STUCK_SECONDS,
+        name: str = "image-dns",
+    ) -> None:
+        if max_workers < 1 or min_workers < 0 or min_workers > max_workers:
+            raise ValueError("Invalid resolver pool size.")
+        self.name = name
+        self._min_workers = min_workers
+        self._max_workers = max_workers
+        self._max_threads = 2 * max_workers
+        self._max_queue = max_queue
+        self._idle_timeout = idle_timeout
+        self._stuck_after = stuck_after
+        self._condition = threading.Condition()
+        self._queue: Deque[Tuple[Future, Callable[..., Any], tuple, dict]] = deque()
+        self._busy_since: Dict[threading.Thread, Optional[float]] = {}
+        self._idle = 0
+        self._shutdown = False
+        self._thread_count = 0
+
+        pool = weakref.ref(self)
+
+        def stat(field: str) -> Callable[[], float]:
+            def read() -> float:
+                current = pool()
+                return 0.0 if current is None else getattr(current.stats(), field)
+
+            return read
+
+        _QUEUE_DEPTH.set_function(stat("queued"), pool=name)
+        _IN_FLIGHT.set_function(stat("in_flight"), pool=name)
+        _STUCK_WORKERS.set_function(stat("stuck"), pool=name)
+        _WORKERS.set_function(stat("workers"), pool=name)
+
+    @classmethod
+    def from_environment(cls) -> "ResolverPool":
+        return cls(
+            max_workers=int(os.environ.get(MAX_WORKERS_ENV, DEFAULT_MAX_WORKERS)),
+            max_queue=int(os.environ.get(MAX_QUEUE_ENV, DEFAULT_MAX_QUEUE)),
+        )
+
+    def stats(self) -> ResolverStats:
+        with self._condition:
+            now = time.monotonic()
+            busy = [since for since in self._busy_since.values() if since is not None]
+            stuck = sum(now - since >= self._stuck_after for since in busy)
+            return ResolverStats(
+                workers=len(self._busy_since),
+                idle=self._idle,
+                in_flight=len(busy),
+                stuck=stuck,
+                queued=len(self._queue),
+            )
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("The resolver pool has been shut down.")
+            if len(self._queue) >= self._max_queue:
+                _REJECTED.inc(pool=self.name)
+                raise ResolverSaturated("Too many host-name lookups are pending.")
+            self._queue.append((future, fn, args, kwargs))
+            if self._idle < len(self._queue) and self._can_grow_locked():
+                self._start_worker_locked()
+            else:
+                self._condition.notify()
+        return future
+
+    def _can_grow_locked(self) -> bool:
+        if len(self._busy_since) >= self._max_threads:
+            return False
+        now = time.monotonic()
+        healthy = sum(
+            since is None or now - since < self._stuck_after
+            for since in self._busy_since.values()
+        )
+        return healthy < self._max_workers
+
+    def _start_worker_locked(self) -> None:
+        self._thread_count += 1
+        worker = threading.Thread(
+            target=self._work,
+            name="{}-{}".format(self.name, self._thread_count),
+            daemon=True,
+        )
+        self._busy_since[worker] = None
+        worker.start()
+
+    def _work(self) -> None:
+        me = threading.current_thread()
+        while True:
+            with self._condition:
+                self._idle += 1
+                try:
+                    while not self._queue and not self._shutdown:
+                        notified = self._condition.wait(self._idle_timeout)
+                        if (
+                            not notified
+                            and not self._queue
+                            and len(self._busy_since) > self._min_workers
+                        ):
+                            del self._busy_since[me]
+                            return
+                    if not self._queue:
+                        del self._busy_since[me]
+                        return
+                    future, fn, args, kwargs = self._queue.popleft()
+                finally:
+                    self._idle -= 1
+                self._busy_since[me] = time.monotonic()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException as exc:
+                        future.set_exception(exc)
+                    else:
+                        future.set_result(result)
+            finally:
+                with self._condition:
+                    self._busy_since[me] = None
+
+    def shutdown(self) -> None:
+        """Stop accepting work and let idle workers exit; queued work still runs."""
+
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+
+def _encode_name(hostname: str) -> bytes:
+    encoded = bytearray()
+    for label in hostname.rstrip(".").split("."):
+        raw = label.encode("ascii")
+        if not 0 < len(raw) < 64:
+            raise UnicodeError("Invalid DNS label.")
+        encoded.append(len(raw))
+        encoded.extend(raw)
+    encoded.append(0)
+    if len(encoded) > 255:
+        raise UnicodeError("DNS name is too long.")
+    return bytes(encoded)
+
+
+def build_query(query_id: int, hostname: str, query_type: int) -> bytes:
+    """Encode a recursive query for one name and record type.
+
+    An EDNS0 OPT record offers ``EDNS_PAYLOAD_BYTES`` for the UDP response,
+    so that answers over the classic 512 bytes are not truncated.
+    """
+
+    return (
+        struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 1)
+        + _encode_name(hostname)
+        + struct.pack("!HH", query_type, 1)
+        + b"\0"
+        + struct.pack("!HHIH", _TYPE_OPT, EDNS_PAYLOAD_BYTES, 0, 0)
+    )
+
+
+def _read_name(message: bytes, offset: int) -> Tuple[str, int]:
+    labels: List[str] = []
+    end: Optional[int] = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise ValueError("Truncated DNS name.")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(message) or jumps > 16:
+                raise ValueError("Invalid DNS name pointer.")
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            jumps += 1
+            continue
+        if length & 0xC0:
+            raise ValueError("Invalid DNS label.")
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset : offset + length].decode("ascii").lower())
+        offset += length
+    return ".".join(labels), offset if end is None else end
+
+
+def parse_response(
+    message: bytes, query_id: int, hostname: str, query_type: int
+) -> List[str]:
+    """Return the addresses of ``query_type`` that answer ``hostname``.
+
+    CNAME records in the answer section are followed from the queried name.
+    Raises :class:`socket.gaierror` for NXDOMAIN, :class:`DNSServerFailure`
+    for other error codes, :class:`DNSTruncated` for a truncated response and
+    :class:`ValueError` for a response that does not belong to the query or
+    cannot be parsed.
+    """
+
+    if len(message) < 12:
+        raise ValueError("Truncated DNS header.")
+    response_id, flags, questions, answers, _authority, _additional = struct.unpack(
+        "!HHHHHH", message[:12]
+    )
+    if response_id != query_id or not flags & 0x8000 or questions != 1:
+        raise ValueError("Unexpected DNS response.")
+    question_name, offset = _read_name(message, 12)
+    expected_name = hostname.rstrip(".").lower()
+    if question_name != expected_name or message[offset : offset + 4] != struct.pack(
+        "!HH", query_type, 1
+    ):
+        raise ValueError("DNS response does not match the question.")
+    if flags & 0x0200:
+        raise DNSTruncated("Truncated DNS response.")
+    offset += 4
+    rcode = flags & 0x000F
+    if rcode == _RCODE_NXDOMAIN:
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    if rcode:
+        raise DNSServerFailure(
+            socket.EAI_AGAIN, "DNS server failure (rcode {}).".format(rcode)
+        )
+
+    records: List[Tuple[str, int, bytes]] = []
+    for _index in range(answers):
+        name, offset = _read_name(message, offset)
+        if offset + 10 > len(message):
+            raise ValueError("Truncated DNS record.")
+        record_type, record_class, _ttl, length = struct.unpack(
+            "!HHIH", message[offset : offset + 10]
+        )
+        offset += 10
+        if offset + length > len(message):
+            raise ValueError("Truncated DNS record.")
+        if record_class == 1:
+            if record_type == 5:
+                target, _end = _read_name(message, offset)
+                records.append((name, record_type, target.encode("ascii")))
+            else:
+                records.append((name, record_type, message[offset : offset + length]))
+        offset += length
+
+    names = {expected_name}
+    for _step in range(MAX_CNAME_CHAIN):
+        aliases = {
+            data.decode("ascii")
+            for name, record_type, data in records
+            if record_type == 5 and name in names
+        }
+        if aliases <= names:
+            break
+        names |= aliases
+
+    size = 4 if query_type == 1 else 16
+    return [
+        str(ipaddress.ip_address(data))
+        for name, record_type, data in records
+        if record_type == query_type and name in names and len(data) == size
+    ]
+
+
+class _UDPLookup(Future):
+    def __init__(
+        self, resolver: "UDPResolver", hostname: str, port: int, deadline: float
+    ) -> None:
+        super().__init__()
+        self.resolver = resolver
+        self.hostname = hostname
+        self.port = port
+        self.deadline = deadline
+        self.next_retry = 0.0
+        self.sock: Optional[socket.socket] = None
+        self.queries: Dict[int, int] = {}
+        self.over_tcp: List[int] = []
+        self.addresses: Dict[int, List[str]] = {}
+        self.error: Optional[BaseException] = None
+
+    def cancel(self) -> bool:
+        cancelled = super().cancel()
+        if cancelled:
+            self.resolver._discard(self)
+        return cancelled
+
+
+class UDPResolver:
+    """Minimal stub resolver that sends A and AAAA queries over UDP.
+
+    Provides a ``lookup(hostname, port)`` method returning a future whose
+    result has the shape of :func:`socket.getaddrinfo` output for TCP stream
+    sockets. All lookups share one selector thread; cancelling a lookup closes
+    its socket immediately. A query whose UDP answer is truncated is repeated
+    over TCP on a short-lived thread of its own.
+    """
+
+    def __init__(
+        self,
+        server: Tuple[str, int],
+        timeout: float = UDP_TIMEOUT_SECONDS,
+        retry_interval: float = UDP_RETRY_SECONDS,
+    ) -> None:
+        self.server = server
+        self._family = (
+            socket.AF_INET6
+            if ipaddress.ip_address(server[0]).version == 6
+            else socket.AF_INET
+        )
+        self._timeout = timeout
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._lookups: Dict[socket.socket, _UDPLookup] = {}
+        self._discarded: List[_UDPLookup] = []
+        self._waker, self._wakee = socket.socketpair()
+        self._wakee.setblocking(False)
+        self._selector.register(self._wakee, selectors.EVENT_READ)
+        self._thread = threading.Thread(
+            target=self._run, name="image-dns-udp", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def from_environment(cls) -> Optional["UDPResolver"]:
+        server = os.environ.get(DNS_SERVER_ENV)
+        if not server:
+            return None
+        host, _separator, port = server.rpartition(":")
+        if not host or "]" in port or (host.count(":") and not host.startswith("[")):
+            host, port = server, "53"
+        return cls((host.strip("[]"), int(port)))
+
+    def lookup(self, hostname: str, port: int) -> Future:
+        lookup = _UDPLookup(
+            self, hostname, port, time.monotonic() + self._timeout
+        )
+        lookup_socket = socket.socket(self._family, socket.SOCK_DGRAM)
+        try:
+            lookup_socket.setblocking(False)
+            lookup_socket.connect(self.server)
+            lookup.sock = lookup_socket
+            for query_type in _QUERY_TYPES:
+                lookup.queries[query_type] = int.from_bytes(os.urandom(2), "big")
+            self._send(lookup)
+        except BaseException:
+            lookup_socket.close()
+            raise
+        with self._lock:
+            self._lookups[lookup_socket] = lookup
+            self._selector.register(lookup_socket, selectors.EVENT_READ)
+        self._wake()
+        return lookup
+
+    def _send(self, lookup: _UDPLookup) -> None:
+        assert lookup.sock is not None
+        for query_type, query_id in lookup.queries.items():
+            if query_type not in lookup.addresses and query_type not in lookup.over_tcp:
+                with contextlib.suppress(BlockingIOError, InterruptedError):
+                    lookup.sock.send(build_query(query_id, lookup.hostname, query_type))
+        lookup.next_retry = time.monotonic() + self._retry_interval
+
+    def _wake(self) -> None:
+        try:
+            self._waker.send(b"\0")
+        except OSError:
+            pass
+
+    def _discard(self, lookup: _UDPLookup) -> None:
+        with self._lock:
+            self._discarded.append(lookup)
+        self._wake()
+
+    def _close_locked(self, lookup: _UDPLookup) -> None:
+        lookup_socket = lookup.sock
+        if lookup_socket is None or self._lookups.pop(lookup_socket, None) is None:
+            return
+        self._selector.unregister(lookup_socket)
+        lookup_socket.close()
+
+    def _finish(self, lookup: _UDPLookup) -> None:
+        with self._lock:
+            self._close_locked(lookup)
+        answers = [
+            (
+                _QUERY_TYPES[query_type],
+                socket.SOCK_STREAM,
+                socket.IPPROTO_TCP,
+                "",
+                (address, lookup.port)
+                if query_type == 1
+                else (address, lookup.port, 0, 0),
+            )
+            for query_type in sorted(lookup.addresses, reverse=True)
+            for address in lookup.addresses[query_type]
+        ]
+        if lookup.done():
+            return
+        if answers:
+            lookup.set_result(answers)
+        elif lookup.error is not None:
+            lookup.set_exception(lookup.error)
+        elif len(lookup.addresses) == len(_QUERY_TYPES):
+            lookup.set_exception(
+                socket.gaierror(socket.EAI_NONAME, "No address associated")
+            )
+        else:
+            lookup.set_exception(socket.timeout("DNS lookup timed out"))
+
+    def _receive(self, lookup: _UDPLookup) -> None:
+        assert lookup.sock is not None
+        while True:
+            try:
+                message = lookup.sock.recv(MAX_DNS_MESSAGE_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                lookup.error = exc
+                return
+            for query_type, query_id in lookup.queries.items():
+                if query_type in lookup.addresses or query_type in lookup.over_tcp:
+                    continue
+                try:
+                    addresses = parse_response(
+                        message, query_id, lookup.hostname, query_type
+                    )
+                except socket.gaierror as exc:
+                    lookup.error = exc
+                    lookup.addresses[query_type] = []
+                except DNSTruncated:
+                    lookup.over_tcp.append(query_type)
+                    threading.Thread(
+                        target=self._query_over_tcp,
+                        args=(lookup, query_type),
+                        name="image-dns-tcp",
+                        daemon=True,
+                    ).start()
+                except (ValueError, UnicodeError):
+                    continue
+                else:
+                    lookup.addresses[query_type] = addresses
+
+    def _query_over_tcp(self, lookup: _UDPLookup, query_type: int) -> None:
+        query_id = lookup.queries[query_type]
+        query = build_query(query_id, lookup.hostname, query_type)
+        try:
+            timeout = lookup.deadline - time.monotonic()
+            if timeout <= 0:
+                raise socket.timeout("DNS lookup timed out")
+            with socket.create_connection(self.server, timeout) as connection:
+                connection.sendall(struct.pack("!H", len(query)) + query)
+                (length,) = struct.unpack("!H", _receive_exactly(connection, 2))
+                message = _receive_exactly(connection, length)
+            addresses = parse_response(
+                message, query_id, lookup.hostname, query_type
+            )
+        except socket.gaierror as exc:
+            lookup.error = exc
+            addresses = []
+        except (OSError, ValueError, UnicodeError) as exc:
+            lookup.error = exc
+            self._wake()
+            return
+        lookup.addresses[query_type] = addresses
+        self._wake()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                discarded, self._discarded = self._discarded, []
+                for lookup in discarded:
+                    self._close_locked(lookup)
+                pending = list(self._lookups.values())
+            now = time.monotonic()
+            timeout = None
+            for lookup in pending:
+                if lookup.done() or lookup.deadline <= now or _answered(lookup):
+                    self._finish(lookup)
+                    continue
+                if lookup.next_retry <= now:
+                    self._send(lookup)
+                wait = min(lookup.deadline, lookup.next_retry) - now
+                timeout = wait if timeout is None else min(timeout, wait)
+            for key, _events in self._selector.select(timeout):
+                if key.fileobj is self._wakee:
+                    with contextlib.suppress(BlockingIOError, InterruptedError):
+                        while self._wakee.recv(512):
+                            pass
+                    continue
+                with self._lock:
+                    lookup = self._lookups.get(key.fileobj)  # type: ignore[arg-type]
+                if lookup is None:
+                    continue
+                self._receive(lookup)
+                if _answered(lookup):
+                    self._finish(lookup)
+
+
+def _answered(lookup: _UDPLookup) -> bool:
+    # Every query type has its answer, or the lookup failed for good.
+    return len(lookup.addresses) == len(_QUERY_TYPES) or (
+        lookup.error is not None and not isinstance(lookup.error, socket.gaierror)
+    )
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise ValueError("Truncated DNS response over TCP.")
+        data.extend(chunk)
+    return bytes(data)
+
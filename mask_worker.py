@@ -0,0 +1,485 @@
+"""Background-removal worker shared by every app process on a host.
+
+Run one per host::
+
+    python mask_worker.py --socket /run/imageworkdesk/masks.sock
+
+The worker loads the rembg model once and computes masks for any process
+that connects to its Unix socket. Pixels and masks are exchanged through a
+:mod:`multiprocessing.shared_memory` block owned by the client, so the socket
+only carries small JSON messages. Requests that arrive while the model is
+busy, or within a few milliseconds of each other, are run through the model
+as one batch. Inference runs on one thread at a time with a fixed number of
+onnxruntime intra-op threads (``--threads``, by default one per core), so
+concurrent sessions no longer oversubscribe the CPU.
+
+Set ``IMAGE_WORKDESK_MASK_SOCKET`` to the socket path in the app's environment
+to use the worker. :func:`pipeline.background_mask` then asks the worker
+instead of running rembg in-process. It runs rembg in-process only while the
+worker cannot be reached, and tries the worker again after a few seconds; a
+worker that is reachable but too slow to answer fails the request instead.
+
+``IMAGE_WORKDESK_MASK_MODEL`` names the rembg model, for the worker and the
+app alike; cached masks are kept per model.
+"""
+
+import argparse
+import contextlib
+import json
+from multiprocessing import connection as mp_connection
+from multiprocessing import resource_tracker, shared_memory
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+import metrics
+
+
+MASK_SOCKET_ENV = "IMAGE_WORKDESK_MASK_SOCKET"
+MASK_MODEL_ENV = "IMAGE_WORKDESK_MASK_MODEL"
+DEFAULT_MODEL = "u2net"
+MAX_BATCH = 8
+BATCH_WINDOW_SECONDS = 0.005
+REQUEST_TIMEOUT_SECONDS = 60.0
+RETRY_AFTER_SECONDS = 5.0
+MAX_IDLE_CONNECTIONS = 4
+MAX_MESSAGE_BYTES = 4_096
+MAX_PIXELS = 50_000_000
+
+_MASK_REQUESTS = metrics.REGISTRY.counter(
+    "imageworkdesk_mask_worker_requests_total",
+    "Mask requests sent to the shared worker, by outcome "
+    "(ok, failed, timeout or unavailable).",
+    ["outcome"],
+)
+_BATCH_SIZE = metrics.REGISTRY.histogram(
+    "imageworkdesk_mask_batch_size",
+    "Images per model run in the shared mask worker.",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+_BATCH_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_mask_batch_seconds",
+    "Time the shared mask worker spent on one batch.",
+)
+
+Predictor = Callable[[Sequence[Image.Image]], List[np.ndarray]]
+
+
+class MaskWorkerUnavailable(Exception):
+    """The mask worker could not be reached."""
+
+
+class MaskWorkerError(Exception):
+    """The mask worker could not compute the mask, or not in time."""
+
+
+def model_name() -> str:
+    """The rembg model that computes masks, from ``IMAGE_WORKDESK_MASK_MODEL``."""
+
+    return os.environ.get(MASK_MODEL_ENV) or DEFAULT_MODEL
+
+
+def _block_size(width: int, height: int) -> int:
+    # RGB pixels followed by the 8-bit mask.
+    return width * height * 4
+
+
+class MaskClient:
+    """Requests masks from a :class:`MaskServer`, reusing idle connections.
+
+    Once the worker could not be reached, requests fail as unavailable
+    without trying to connect for ``RETRY_AFTER_SECONDS``.
+    """
+
+    def __init__(
+        self, address: str, timeout: float = REQUEST_TIMEOUT_SECONDS
+    ) -> None:
+        self.address = address
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: List[mp_connection.Connection] = []
+        self._retry_at = 0.0
+
+    @classmethod
+    def from_environment(cls) -> Optional["MaskClient"]:
+        address = os.environ.get(MASK_SOCKET_ENV)
+        return cls(address) if address else None
+
+    def mask(self, image: Image.Image) -> np.ndarray:
+        """The 8-bit foreground mask of ``image``, computed by the worker."""
+
+        pixels = np.asarray(image.convert("RGB"))
+        height, width = pixels.shape[:2]
+        block = shared_memory.SharedMemory(
+            create=True, size=_block_size(width, height)
+        )
+        try:
+            np.ndarray(pixels.shape, np.uint8, buffer=block.buf)[...] = pixels
+            reply = self._call(
+                {
+                    "block": block.name,
+                    "width": width,
+                    "height": height,
+                    "pid": os.getpid(),
+                }
+            )
+            if "error" in reply:
+                _MASK_REQUESTS.inc(outcome="failed")
+                raise MaskWorkerError(reply["error"])
+            _MASK_REQUESTS.inc(outcome="ok")
+            return np.ndarray(
+                (height, width), np.uint8, buffer=block.buf, offset=pixels.nbytes
+            ).copy()
+        finally:
+            block.close()
+            block.unlink()
+
+    def _call(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        unavailable = MaskWorkerUnavailable(
+            "The mask worker at {} is unavailable.".format(self.address)
+        )
+        with self._lock:
+            if time.monotonic() < self._retry_at:
+                _MASK_REQUESTS.inc(outcome="unavailable")
+                raise unavailable
+            connection = self._idle.pop() if self._idle else None
+        try:
+            if connection is None:
+                connection = mp_connection.Client(self.address, family="AF_UNIX")
+            connection.send_bytes(json.dumps(request).encode("utf-8"))
+            answered = connection.poll(self._timeout)
+            if answered:
+                reply = json.loads(connection.recv_bytes(MAX_MESSAGE_BYTES))
+        except (EOFError, OSError, ValueError) as exc:
+            _MASK_REQUESTS.inc(outcome="unavailable")
+            if connection is not None:
+                connection.close()
+            with self._lock:
+                self._retry_at = time.monotonic() + RETRY_AFTER_SECONDS
+            raise unavailable from exc
+        if not answered:
+            # The worker is up but busy; loading the model here as well would
+            # only add to the load, so the request fails instead.
+            _MASK_REQUESTS.inc(outcome="timeout")
+            connection.close()
+            raise MaskWorkerError("The mask worker did not answer in time.")
+        with self._lock:
+            if len(self._idle) < MAX_IDLE_CONNECTIONS:
+                self._idle.append(connection)
+                connection = None
+        if connection is not None:
+            connection.close()
+        return reply
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+_CLIENT_LOCK = threading.Lock()
+_CLIENTS: Dict[str, MaskClient] = {}
+
+
+def shared_client() -> Optional[MaskClient]:
+    """The process-wide client for ``IMAGE_WORKDESK_MASK_SOCKET``, if it is set."""
+
+    address = os.environ.get(MASK_SOCKET_ENV)
+    if not address:
+        return None
+    with _CLIENT_LOCK:
+        client = _CLIENTS.get(address)
+        if client is None:
+            client = _CLIENTS[address] = MaskClient(address)
+        return client
+
+
+class _Request:
+    def __init__(self, pixels: np.ndarray, mask: np.ndarray) -> None:
+        self.pixels = pixels
+        self.mask = mask
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+
+class MaskServer:
+    """Computes masks for clients of a Unix socket, in batches.
+
+    ``predict`` receives up to ``max_batch`` images and returns their masks.
+    It is only ever called from one thread.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        predict: Predictor,
+        max_batch: int = MAX_BATCH,
+        batch_window: float = BATCH_WINDOW_SECONDS,
+    ) -> None:
+        self.address = address
+        self._predict = predict
+        self._max_batch = max_batch
+        self._batch_window = batch_window
+        self._requests: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._closed = threading.Event()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(address)  # Left behind by a worker that did not exit cleanly.
+        # Only processes of the same user may connect: the socket carries the
+        # names of shared memory blocks that the worker writes into.
+        umask = os.umask(0o177)
+        try:
+            self._listener = mp_connection.Listener(address, family="AF_UNIX")
+        finally:
+            os.umask(umask)
+        self._batcher = threading.Thread(
+            target=self._run_batches, name="mask-batcher", daemon=True
+        )
+        self._batcher.start()
+
+    def serve_forever(self) -> None:
+        while True:
+            try:
+                client = self._listener.accept()
+            except OSError:
+                if self._closed.is_set():
+                    return
+                raise
+            if self._closed.is_set():
+                client.close()
+                return
+            threading.Thread(
+                target=self._serve_client, args=(client,), daemon=True
+            ).start()
+
+    def close(self) -> None:
+        """Stop accepting clients and remove the socket."""
+
+        self._closed.set()
+        # Closing the listener does not interrupt a blocked accept(), so a
+        # connection of our own wakes serve_forever() to notice the flag.
+        with contextlib.suppress(OSError):
+            mp_connection.Client(self.address, family="AF_UNIX").close()
+        self._listener.close()
+        self._requests.put(None)
+
+    def _serve_client(self, client: mp_connection.Connection) -> None:
+        with client:
+            while True:
+                try:
+                    message = client.recv_bytes(MAX_MESSAGE_BYTES)
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = self._handle(json.loads(message))
+                except (KeyError, TypeError, ValueError) as exc:
+                    reply = {"error": "Invalid request: {}".format(exc)}
+                try:
+                    client.send_bytes(json.dumps(reply).encode("utf-8"))
+                except OSError:
+                    return
+
+    def _handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        width, height = int(message["width"]), int(message["height"])
+        if not (0 < width and 0 < height and width * height <= MAX_PIXELS):
+            raise ValueError("the image size is out of range")
+        block = shared_memory.SharedMemory(str(message["block"]))
+        if message.get("pid") != os.getpid():
+            # The client created the block and unlinks it; the worker's
+            # resource tracker must not remove it when the worker exits. A
+            # client in this process shares the tracker's registration.
+            resource_tracker.unregister(block._name, "shared_memory")  # type: ignore
+        try:
+            if block.size < _block_size(width, height):
+                raise ValueError("the shared memory block is too small")
+            request = _Request(
+                np.ndarray((height, width, 3), np.uint8, buffer=block.buf),
+                np.ndarray(
+                    (height, width),
+                    np.uint8,
+                    buffer=block.buf,
+                    offset=width * height * 3,
+                ),
+            )
+            self._requests.put(request)
+            request.done.wait()
+            # Release the views of the block so that it can be closed.
+            request.pixels = request.mask = None  # type: ignore[assignment]
+        finally:
+            block.close()
+        if request.error is not None:
+            return {"error": request.error}
+        return {"ok": True}
+
+    def _next_batch(self) -> List[_Request]:
+        first = self._requests.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self._batch_window
+        while len(batch) < self._max_batch:
+            try:
+                request = self._requests.get(
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run_batches(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            _BATCH_SIZE.observe(len(batch))
+            try:
+                with _BATCH_SECONDS.time():
+                    masks = self._predict(
+                        [Image.fromarray(request.pixels) for request in batch]
+                    )
+                for request, mask in zip(batch, masks):
+                    request.mask[...] = mask
+            except Exception as exc:
+                for request in batch:
+                    request.error = str(exc) or type(exc).__name__
+            finally:
+                for request in batch:
+                    request.done.set()
+
+
+class _Captured(Exception):
+    pass
+
+
+class _ModelProxy:
+    # Stands in for a rembg session's onnxruntime session during predict():
+    # without outputs it records the model input and stops predict(); with
+    # outputs it returns them for the first run, so predict() post-processes
+    # this image's share of a batched run.
+    def __init__(self, model: Any, outputs: Optional[List[np.ndarray]] = None):
+        self._model = model
+        self._outputs = outputs
+        self.feed: Optional[Dict[str, np.ndarray]] = None
+
+    def run(self, output_names: Any, feed: Dict[str, np.ndarray], *args: Any) -> Any:
+        if self._outputs is None:
+            self.feed = feed
+            raise _Captured()
+        outputs, self._outputs = self._outputs, None
+        return outputs
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._model, name)
+
+
+def session_predictor(session: Any) -> Predictor:
+    """Batch a rembg session's model runs when its input has a dynamic batch size.
+
+    The session's own ``predict`` prepares each image's input and
+    post-processes its output, so masks match running the images one by one.
+    """
+
+    model = session.inner_session
+
+    def mask(image: Image.Image) -> np.ndarray:
+        return np.asarray(session.predict(image)[0].convert("L"))
+
+    def replay(image: Image.Image, proxy: _ModelProxy) -> None:
+        session.inner_session = proxy
+        try:
+            session.predict(image)
+        except _Captured:
+            pass
+        finally:
+            session.inner_session = model
+
+    inputs = model.get_inputs()
+    if len(inputs) != 1 or not inputs[0].shape or isinstance(inputs[0].shape[0], int):
+        return lambda images: [mask(image) for image in images]
+    name = inputs[0].name
+
+    def predict(images: Sequence[Image.Image]) -> List[np.ndarray]:
+        if len(images) == 1:
+            return [mask(images[0])]
+        feeds = []
+        for image in images:
+            proxy = _ModelProxy(model)
+            replay(image, proxy)
+            if proxy.feed is None or list(proxy.feed) != [name]:
+                return [mask(image) for image in images]
+            feeds.append(proxy.feed[name])
+        if len({feed.shape for feed in feeds}) != 1:
+            return [mask(image) for image in images]
+        outputs = model.run(None, {name: np.concatenate(feeds)})
+        masks = []
+        for index, image in enumerate(images):
+            proxy = _ModelProxy(
+                model, [output[index : index + 1] for output in outputs]
+            )
+            session.inner_session = proxy
+            try:
+                masks.append(mask(image))
+            finally:
+                session.inner_session = model
+        return masks
+
+    return predict
+
+
+def rembg_predictor(model: str, threads: int) -> Predictor:
+    """Load a rembg model for :class:`MaskServer` on ``threads`` intra-op threads."""
+
+    import onnxruntime
+    from rembg import new_session
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return session_predictor(new_session(model, sess_opts=options))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get(MASK_SOCKET_ENV),
+        required=MASK_SOCKET_ENV not in os.environ,
+        help="Unix socket path (default: ${})".format(MASK_SOCKET_ENV),
+    )
+    parser.add_argument(
+        "--model",
+        default=model_name(),
+        help="rembg model name (default: ${} or {})".format(
+            MASK_MODEL_ENV, DEFAULT_MODEL
+        ),
+    )
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--metrics-port", type=int, help="serve /metrics here")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None:
+        metrics.REGISTRY.serve(port=args.metrics_port)
+    server = MaskServer(
+        args.socket, rembg_predictor(args.model, args.threads), args.max_batch
+    )
+    print("Serving masks on {}".format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""Process-wide counters, gauges and histograms with Prometheus text exposition.
+
+Metrics are registered once per process and are safe to update from any
+thread, including Streamlit script threads. Each labelled series has its own
+small lock, so updates never contend on a registry-wide lock. The registry
+can be rendered as Prometheus text, written atomically to a file, or served
+from a local HTTP endpoint.
+"""
+
+from bisect import bisect_left
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+BYTE_BUCKETS = tuple(float(1024 * 4**power) for power in range(9))
+METRICS_PORT_ENV = "IMAGE_WORKDESK_METRICS_PORT"
+METRICS_FILE_ENV = "IMAGE_WORKDESK_METRICS_FILE"
+TEXTFILE_INTERVAL_SECONDS = 15.0
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, _escape_label_value(value))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._children_lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                "{} expects labels {}".format(self.name, list(self.labelnames))
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _child(self, labels: Dict[str, object]) -> object:
+        key = self._label_values(labels)
+        child = self._children.get(key)
+        if child is None:
+            with self._children_lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def _series(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._children_lock:
+            return sorted(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [
+            "# HELP {} {}".format(
+                self.name,
+                self.documentation.replace("\\", "\\\\").replace("\n", "\\n"),
+            ),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        return [
+            "{}{} {}".format(
+                self.name,
+                _format_labels(self.labelnames, values),
+                _format_value(child.value),  # type: ignore[attr-defined]
+            )
+            for values, child in self._series()
+        ]
+
+
+class _Value:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._value = 0.0
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = float(value)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        self._child(labels).inc(amount)  # type: ignore[attr-defined]
+
+    def value(self, **labels: object) -> float:
+        return self._child(labels).value  # type: ignore[attr-defined]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or is read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float, **labels: object) -> None:
+        self._child(labels).set(value)  # type: ignore[attr-defined]
+
+    def inc(self, amount: float = 1.0, **labels: object) -> None:
+        self._child(labels).inc(amount)  # type: ignore[attr-defined]
+
+    def dec(self, amount: float = 1.0, **labels: object) -> None:
+        self._child(labels).inc(-amount)  # type: ignore[attr-defined]
+
+    def set_function(self, function: Callable[[], float], **labels: object) -> None:
+        with self._children_lock:
+            self._functions[self._label_values(labels)] = function
+
+    def value(self, **labels: object) -> float:
+        key = self._label_values(labels)
+        function = self._functions.get(key)
+        if function is not None:
+            return float(function())
+        return self._child(labels).value  # type: ignore[attr-defined]
+
+    def _render_samples(self) -> List[str]:
+        lines = super()._render_samples()
+        with self._children_lock:
+            functions = sorted(self._functions.items())
+        for values, function in functions:
+            try:
+                value = float(function())
+            except Exception:
+                continue
+            lines.append(
+                "{}{} {}".format(
+                    self.name,
+                    _format_labels(self.labelnames, values),
+                    _format_value(value),
+                )
+            )
+        return lines
+
+
+class _HistogramValue:
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        bounds = tuple(sorted(float(bound) for bound in buckets))
+        if not bounds or any(math.isinf(bound) for bound in bounds):
+            raise ValueError("Histogram buckets must be finite and non-empty.")
+        self.buckets = bounds
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float, **labels: object) -> None:
+        self._child(labels).observe(value)  # type: ignore[attr-defined]
+
+    @contextlib.contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        child = self._child(labels)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - started)  # type: ignore[attr-defined]
+
+    def snapshot(self, **labels: object) -> Tuple[List[int], float]:
+        return self._child(labels).snapshot()  # type: ignore[attr-defined]
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        for values, child in self._series():
+            counts, total = child.snapshot()  # type: ignore[attr-defined]
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        _format_labels(
+                            self.labelnames + ("le",),
+                            values + (_format_value(bound),),
+                        ),
+                        _format_value(cumulative),
+                    )
+                )
+            labels = _format_labels(self.labelnames, values)
+            lines.append("{}_sum{} {}".format(self.name, labels, _format_value(total)))
+            lines.append(
+                "{}_count{} {}".format(self.name, labels, _format_value(cumulative))
+            )
+        return lines
+
+
+_M = TypeVar("_M", bound=_Metric)
+
+
+class MetricsRegistry:
+    """Named collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _M) -> _M:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric) or (
+            existing.labelnames != metric.labelnames
+        ):
+            raise ValueError("Metric {} is already registered.".format(metric.name))
+        return existing  # type: ignore[return-value]
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Atomically replace ``path`` with the current exposition text."""
+
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=directory, prefix=".metrics-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(descriptor, "w", encoding="utf-8") as output:
+                output.write(self.render())
+            os.replace(temporary_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temporary_path)
+            raise
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0) -> "MetricsServer":
+        """Serve ``/metrics`` from a daemon thread and return the running server."""
+
+        return MetricsServer(self, host, port)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    server: "_MetricsHTTPServer"
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] not in {"/", "/metrics"}:
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args: object) -> None:
+        return None
+
+
+class _MetricsHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], registry: MetricsRegistry) -> None:
+        super().__init__(address, _MetricsHandler)
+        self.registry = registry
+
+
+class MetricsServer:
+    """Tiny HTTP endpoint exposing a registry in Prometheus text format."""
+
+    def __init__(self, registry: MetricsRegistry, host: str, port: int) -> None:
+        self._server = _MetricsHTTPServer((host, port), registry)
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.5},
+            name="metrics-http",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class TextfileWriter:
+    """Rewrite a metrics file periodically from a daemon thread."""
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        path: str,
+        interval: float = TEXTFILE_INTERVAL_SECONDS,
+    ) -> None:
+        self._registry = registry
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="metrics-textfile", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with contextlib.suppress(OSError):
+                self._registry.write_textfile(self._path)
+            if self._stopped.wait(self._interval):
+                return
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self._registry.write_textfile(self._path)
+
+
+REGISTRY = MetricsRegistry()
+_exporters_lock = threading.Lock()
+_exporters: Dict[str, object] = {}
+
+
+def start_exporters_from_environment(
+    registry: MetricsRegistry = REGISTRY,
+) -> Dict[str, object]:
+    """Start the HTTP endpoint and/or textfile writer configured by environment.
+
+    ``IMAGE_WORKDESK_METRICS_PORT`` serves ``/metrics`` on localhost and
+    ``IMAGE_WORKDESK_METRICS_FILE`` rewrites a textfile periodically. Repeated
+    calls, such as one per Streamlit rerun, start each exporter only once.
+    """
+
+    with _exporters_lock:
+        port = os.environ.get(METRICS_PORT_ENV)
+        if port and "server" not in _exporters:
+            _exporters["server"] = registry.serve(port=int(port))
+        path = os.environ.get(METRICS_FILE_ENV)
+        if path and "textfile" not in _exporters:
+            _exporters["textfile"] = TextfileWriter(registry, path)
+        return dict(_exporters)
+
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "imageworkdesk_cache_lookups_total",
+    "Cache lookups by cache name and result (hit or miss).",
+    ["cache", "result"],
+)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,488 @@
+"""Cached, content-addressed stages of the image-editing pipeline.
+
+Decoding an upload and computing a background-removal mask are the two stages
+that are expensive to repeat on every Streamlit rerun. Both are keyed by a
+SHA-256 digest of their input and kept in a small in-process LRU and, when
+configured, in the on-disk tier from :mod:`disk_cache`, so their results
+survive restarts and are shared between processes. Masks are computed by the
+host's shared :mod:`mask_worker` when one is configured.
+
+:class:`StageCache` keeps the output of each later editing step per session,
+so a rerun only recomputes the steps whose inputs changed.
+
+:func:`render_variants` previews many random edits at once: it applies the
+app's mirror, rotate and enhancement steps to a stack of copies of one
+downscaled proxy in a single vectorized pass.
+
+:func:`render_steps` applies a full set of :class:`EditSettings` to an image
+one step at a time, for renders that run outside the interactive stages.
+"""
+
+from collections import OrderedDict
+import hashlib
+import math
+from io import BytesIO
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+import disk_cache
+import mask_worker
+import metrics
+
+
+SOURCE_CACHE_ENTRIES = 8
+MASK_CACHE_ENTRIES = 16
+VARIANT_PROXY_SIDE = 256
+PREVIEW_MAX_SIDE = 1024
+CROPPER_MAX_SIDE = 700
+VARIANT_CHUNK_BYTES = 64 * 1024 * 1024
+
+_REMBG_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_rembg_seconds",
+    "Time spent removing image backgrounds with rembg.",
+)
+
+
+class _ArrayLRU:
+    def __init__(self, max_entries: int, name: str) -> None:
+        self._max_entries = max_entries
+        self._name = name
+        self._lock = threading.Lock()
+        self._arrays: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            array = self._arrays.get(key)
+            if array is not None:
+                self._arrays.move_to_end(key)
+        metrics.record_cache_lookup(self._name, array is not None)
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        with self._lock:
+            self._arrays[key] = array
+            self._arrays.move_to_end(key)
+            while len(self._arrays) > self._max_entries:
+                self._arrays.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._arrays.clear()
+
+
+_SOURCES = _ArrayLRU(SOURCE_CACHE_ENTRIES, "sources")
+_MASKS = _ArrayLRU(MASK_CACHE_ENTRIES, "masks")
+
+
+def array_digest(array: np.ndarray) -> str:
+    """Content hash of an array's dtype, shape and pixels."""
+
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(
+        "{}:{}".format(array.dtype.str, array.shape).encode("ascii")
+    )
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+
+def _cached_array(
+    memory: _ArrayLRU,
+    namespace: str,
+    key: str,
+    compute: Callable[[], np.ndarray],
+) -> np.ndarray:
+    array = memory.get(key)
+    if array is not None:
+        return array
+    cache = disk_cache.shared_disk_cache()
+    stored = None if cache is None else cache.get(namespace, key)
+    if stored is not None:
+        array = stored.array
+    else:
+        array = np.ascontiguousarray(compute())
+        array.flags.writeable = False
+        if cache is not None:
+            cache.put(namespace, key, array)
+    memory.put(key, array)
+    return array
+
+
+def _call(compute: Callable[[], Any]) -> Any:
+    return compute()
+
+
+class StageCache:
+    """The last output of each editing stage, reused while its inputs match.
+
+    A stage's key combines its input's key with its own parameters, so that
+    changing one parameter recomputes that stage and the stages after it and
+    leaves the ones before it alone. One cache belongs to one session.
+
+    Misses are computed by ``execute(compute)``, which by default calls
+    ``compute`` on the calling thread.
+    """
+
+    def __init__(
+        self, execute: Optional[Callable[[Callable[[], Any]], Any]] = None
+    ) -> None:
+        self._execute = _call if execute is None else execute
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[str, Any]] = {}
+
+    def run(
+        self,
+        stage: str,
+        input_key: str,
+        params: Hashable,
+        compute: Callable[[], Any],
+    ) -> Tuple[str, Any]:
+        """Return ``(key, output)`` for ``stage``, calling ``compute`` on a miss."""
+
+        key = hashlib.sha256(
+            repr((input_key, stage, params)).encode("utf-8")
+        ).hexdigest()
+        with self._lock:
+            entry = self._entries.get(stage)
+        hit = entry is not None and entry[0] == key
+        metrics.record_cache_lookup("stages", hit)
+        if hit:
+            return key, entry[1]
+        output = self._execute(compute)
+        with self._lock:
+            self._entries[stage] = (key, output)
+        return key, output
+
+
+def decode_source(data: bytes) -> Image.Image:
+    """Decode uploaded or captured image bytes to RGB, reusing earlier decodes."""
+
+    def decode() -> np.ndarray:
+        with Image.open(BytesIO(data)) as source:
+            return np.asarray(source.convert("RGB"))
+
+    key = hashlib.sha256(data).hexdigest()
+    return Image.fromarray(_cached_array(_SOURCES, "sources", key, decode))
+
+
+def _rembg_mask(image: Image.Image, model: str) -> np.ndarray:
+    worker = mask_worker.shared_client()
+    if worker is not None:
+        try:
+            with _REMBG_SECONDS.time():
+                return worker.mask(image)
+        except mask_worker.MaskWorkerUnavailable:
+            pass  # Load the model here until the worker is back.
+
+    from rembg import new_session, remove
+
+    with _REMBG_SECONDS.time():
+        mask = remove(image, only_mask=True, session=new_session(model))
+        return np.asarray(mask.convert("L"))
+
+
+def background_mask(image: Image.Image) -> np.ndarray:
+    """Return rembg's foreground mask for ``image`` as an 8-bit array.
+
+    Masks are cached per model, see :func:`mask_worker.model_name`.
+    """
+
+    model = mask_worker.model_name()
+    key = hashlib.sha256(
+        "{}:{}".format(model, array_digest(np.asarray(image))).encode("ascii")
+    ).hexdigest()
+    return _cached_array(_MASKS, "masks", key, lambda: _rembg_mask(image, model))
+
+
+def remove_background(
+    image: Image.Image, mask_source: Optional[Image.Image] = None
+) -> Image.Image:
+    """Cut the foreground out of ``image`` using its cached mask.
+
+    ``mask_source`` is an image that ``image`` was scaled from, such as the
+    full-resolution source of a preview. Its mask is computed and cached
+    instead and scaled to ``image``, so that the preview and the final render
+    share one rembg run.
+    """
+
+    mask = Image.fromarray(
+        background_mask(image if mask_source is None else mask_source)
+    )
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+    foreground = image.convert("RGBA")
+    return Image.composite(
+        foreground, Image.new("RGBA", foreground.size, (0, 0, 0, 0)), mask
+    )
+
+
+ENHANCERS = (
+    ImageEnhance.Brightness,
+    ImageEnhance.Color,
+    ImageEnhance.Contrast,
+    ImageEnhance.Sharpness,
+)
+# Enhancers that only change colour and leave single-channel images as they are.
+COLOUR_ENHANCERS = frozenset({ImageEnhance.Color})
+
+
+class EditSettings(NamedTuple):
+    """The editing steps to apply to a source image, in the app's order.
+
+    ``enhancements`` holds the brightness, saturation, contrast and sharpness
+    percentages that apply; black and white images have none.
+    """
+
+    remove_bg: bool
+    mirror: bool
+    tone: Optional[str]
+    rotate: int = 0
+    enhancements: Tuple[int, ...] = ()
+
+
+def has_colour(image: Image.Image) -> bool:
+    """Whether ``image`` has colour channels, as opposed to one grey channel."""
+
+    return len(image.getbands()) >= 3
+
+
+def apply_tone(image: Image.Image, tone: Optional[str]) -> Image.Image:
+    """Convert ``image`` to ``"Grayscale"`` or ``"Black & White"``."""
+
+    if tone == "Grayscale":
+        return image.convert("L")
+    if tone == "Black & White":
+        thresh = np.array(image).mean()
+        return image.convert("L").point(lambda x: 255 if x > thresh else 0, mode="1")
+    return image
+
+
+def render_steps(image: Image.Image, settings: EditSettings) -> Iterator[Image.Image]:
+    """Apply ``settings`` to ``image``, yielding the result of each step.
+
+    The tone is applied as early as it can be, so that grayscale and black and
+    white images go through the later steps with one channel, and colour-only
+    enhancements are skipped for them.
+    """
+
+    if settings.remove_bg:
+        image = remove_background(image)
+        yield image
+    if settings.tone:
+        image = apply_tone(image, settings.tone)
+        yield image
+    if settings.mirror:
+        image = ImageOps.mirror(image)
+        yield image
+    image = image.rotate(360 - settings.rotate)
+    yield image
+    for enhancer, factor in zip(ENHANCERS, settings.enhancements):
+        if enhancer in COLOUR_ENHANCERS and not has_colour(image):
+            continue
+        image = enhancer(image).enhance(factor / 100)
+        yield image
+
+
+def render_final(image: Image.Image, settings: EditSettings) -> Image.Image:
+    for rendered in render_steps(image, settings):
+        pass
+    return rendered
+
+
+def preview_image(image: Image.Image, max_side: int = PREVIEW_MAX_SIDE) -> Image.Image:
+    """A copy of ``image`` that fits in ``max_side`` pixels, for interactive edits."""
+
+    preview = image.copy()
+    preview.thumbnail((max_side, max_side))
+    return preview
+
+
+def crop_box(
+    box: Dict[str, float], proxy_size: Tuple[int, int], size: Tuple[int, int]
+) -> Tuple[int, int, int, int]:
+    """Scale a box drawn on a proxy to ``(left, top, right, bottom)`` in ``size``.
+
+    ``box`` has the ``left``, ``top``, ``width`` and ``height`` keys that
+    ``st_cropper`` returns. The result is clamped to the image and is at least
+    one pixel wide and high.
+    """
+
+    scale_x, scale_y = size[0] / proxy_size[0], size[1] / proxy_size[1]
+    left = min(max(round(box["left"] * scale_x), 0), size[0] - 1)
+    top = min(max(round(box["top"] * scale_y), 0), size[1] - 1)
+    right = min(max(round((box["left"] + box["width"]) * scale_x), left + 1), size[0])
+    bottom = min(max(round((box["top"] + box["height"]) * scale_y), top + 1), size[1])
+    return left, top, right, bottom
+
+
+def encode_png(image: Image.Image) -> bytes:
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+class VariantParams(NamedTuple):
+    """Slider and checkbox values for one variant, as stored in the session."""
+
+    mirror: bool
+    rotate: int
+    brightness: int
+    saturation: int
+    contrast: int
+    sharpness: int
+
+
+def sample_variants(
+    count: int, rng: Optional[np.random.Generator] = None
+) -> List[VariantParams]:
+    """Draw ``count`` random parameter sets from the sliders' ranges."""
+
+    rng = np.random.default_rng() if rng is None else rng
+    mirror = rng.integers(0, 2, count)
+    rotate = rng.integers(0, 360, count)
+    factors = rng.integers(0, 1000, (count, 4))
+    return [
+        VariantParams(bool(mirror[index]), int(rotate[index]), *map(int, row))
+        for index, row in enumerate(factors)
+    ]
+
+
+def variant_proxy(image: Image.Image, max_side: int = VARIANT_PROXY_SIDE) -> np.ndarray:
+    """Downscale ``image`` for previews, as RGB or, with transparency, RGBA."""
+
+    proxy = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    proxy.thumbnail((max_side, max_side))
+    return np.asarray(proxy)
+
+
+def _truncate(values: np.ndarray) -> None:
+    # Image.blend computes in single precision and truncates to 8 bits.
+    np.clip(values, 0, 255, out=values)
+    np.floor(values, out=values)
+
+
+def _blend(degenerate: np.ndarray, values: np.ndarray, factors: np.ndarray) -> None:
+    values -= degenerate
+    values *= factors
+    values += degenerate
+    _truncate(values)
+
+
+def _luma(rgb: np.ndarray) -> np.ndarray:
+    # Pillow's integer RGB-to-L conversion; exact in float32 for 8-bit input.
+    weighted = rgb @ np.array([19595, 38470, 7471], dtype=np.float32)
+    return np.floor((weighted + 32768) / 65536)[..., None]
+
+
+def _smooth(rgb: np.ndarray) -> np.ndarray:
+    # ImageFilter.SMOOTH: a rounded 3x3 kernel with weight 5 in the centre and
+    # 1 elsewhere, leaving the outermost rows and columns unchanged.
+    smoothed = rgb.copy()
+    if rgb.shape[1] < 3 or rgb.shape[2] < 3:
+        return smoothed
+    height, width = rgb.shape[1:3]
+    total = 4 * rgb[:, 1:-1, 1:-1]
+    for row in range(3):
+        for column in range(3):
+            total += rgb[:, row : row + height - 2, column : column + width - 2]
+    smoothed[:, 1:-1, 1:-1] = np.floor(total / 13 + 0.5)
+    return smoothed
+
+
+def _fixed(value: float) -> int:
+    return math.floor(value * 65536.0 + 0.5)
+
+
+def _rotation_sources(
+    variants: Sequence[VariantParams], height: int, width: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Source pixel of every output pixel for Image.rotate(360 - degrees) after
+    # the optional mirror. Pillow builds the same affine matrix and evaluates
+    # it for nearest-neighbour sampling in 16.16 fixed point, so this matches
+    # it pixel for pixel.
+    coefficients = []
+    for variant in variants:
+        angle = -math.radians((360 - variant.rotate) % 360)
+        cos, sin = round(math.cos(angle), 15), round(math.sin(angle), 15)
+        offset_x = cos * -(width / 2.0) + sin * -(height / 2.0) + width / 2.0
+        offset_y = -sin * -(width / 2.0) + cos * -(height / 2.0) + height / 2.0
+        coefficients.append(
+            [
+                _fixed(cos),
+                _fixed(sin),
+                _fixed(offset_x + cos * 0.5 + sin * 0.5),
+                _fixed(-sin),
+                _fixed(cos),
+                _fixed(offset_y - sin * 0.5 + cos * 0.5),
+            ]
+        )
+    matrix = np.array(coefficients, dtype=np.int64)[:, :, None, None]
+    y, x = np.mgrid[0:height, 0:width].astype(np.int64)
+    source_x = (matrix[:, 0] * x + matrix[:, 1] * y + matrix[:, 2]) >> 16
+    source_y = (matrix[:, 3] * x + matrix[:, 4] * y + matrix[:, 5]) >> 16
+    mirrored = np.array([variant.mirror for variant in variants])[:, None, None]
+    source_x = np.where(mirrored, width - 1 - source_x, source_x)
+    return source_y, source_x
+
+
+def _render_chunk(proxy: np.ndarray, variants: Sequence[VariantParams]) -> np.ndarray:
+    height, width = proxy.shape[:2]
+    source_y, source_x = _rotation_sources(variants, height, width)
+    inside = (
+        (source_x >= 0) & (source_x < width) & (source_y >= 0) & (source_y < height)
+    )
+    stack = proxy[
+        np.clip(source_y, 0, height - 1), np.clip(source_x, 0, width - 1)
+    ].astype(np.float32)
+    stack[~inside] = 0
+
+    def factors(field: str) -> np.ndarray:
+        values = [getattr(variant, field) / 100 for variant in variants]
+        return np.array(values, dtype=np.float32)[:, None, None, None]
+
+    # Every enhancer leaves the alpha channel unchanged.
+    rgb = stack[..., :3]
+    rgb *= factors("brightness")
+    _truncate(rgb)
+    _blend(_luma(rgb), rgb, factors("saturation"))
+    mean = np.floor(_luma(rgb).mean(axis=(1, 2, 3), dtype=np.float64) + 0.5)
+    _blend(mean.astype(np.float32)[:, None, None, None], rgb, factors("contrast"))
+    _blend(_smooth(rgb), rgb, factors("sharpness"))
+    return stack.astype(np.uint8)
+
+
+def render_variants(
+    proxy: np.ndarray,
+    variants: Sequence[VariantParams],
+    max_bytes: int = VARIANT_CHUNK_BYTES,
+) -> np.ndarray:
+    """Apply each parameter set to ``proxy`` and return an N x H x W x C stack.
+
+    The result matches running the app's Pillow steps on the proxy one variant
+    at a time. Variants are processed in chunks whose working arrays stay
+    within about ``max_bytes``.
+    """
+
+    height, width, channels = proxy.shape
+    # Coordinate maps in float64 and intp, plus a few float32 image stacks.
+    per_variant = height * width * (6 * 8 + 4 * channels * 4)
+    chunk = max(1, max_bytes // max(per_variant, 1))
+    output = np.empty((len(variants), height, width, channels), dtype=np.uint8)
+    for start in range(0, len(variants), chunk):
+        output[start : start + chunk] = _render_chunk(
+            proxy, variants[start : start + chunk]
+        )
+    return output
@@ -5,22 +5,64 @@ the exact validated socket address while the original hostname remains in the
 HTTP Host header and, for HTTPS, in SNI and certificate verification.
 """
 
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import asyncio
+from collections import OrderedDict, deque
+import contextlib
+from contextvars import ContextVar
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    CancelledError as FutureCancelled,
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError as FutureTimeout,
+    wait as wait_for_futures,
+)
+import email.utils
+import errno
+import functools
+import hashlib
 from io import BytesIO
 import http.client
 import io
 import ipaddress
+import os
+import select
+import selectors
 import socket
 import ssl
+import threading
 import time
-from typing import Any, List, NamedTuple, Optional, Tuple
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 from urllib.parse import quote, urljoin, urlsplit, urlunsplit
 import warnings
+import weakref
 
+import numpy as np
 from PIL import Image, UnidentifiedImageError
 
+import address_policy
+import decode_pool
+import disk_cache
+import dns_resolver
+import metrics
+
 
 CONNECT_TIMEOUT_SECONDS = 3.0
+CONNECTION_ATTEMPT_DELAY_SECONDS = 0.25
 DNS_TIMEOUT_SECONDS = 3.0
 READ_TIMEOUT_SECONDS = 5.0
 TOTAL_TIMEOUT_SECONDS = 10.0
@@ -30,6 +72,24 @@ MAX_IMAGE_PIXELS = 25_000_000
 MAX_IMAGE_DIMENSION = 10_000
 MAX_URL_LENGTH = 2_048
 READ_CHUNK_BYTES = 64 * 1024
+POOL_MAX_IDLE_CONNECTIONS = 16
+POOL_MAX_IDLE_PER_HOST = 4
+POOL_IDLE_TIMEOUT_SECONDS = 30.0
+MAX_DRAIN_BYTES = 64 * 1024
+MAX_RESPONSE_HEAD_BYTES = 64 * 1024
+ASYNC_MAX_CONCURRENT_FETCHES = 64
+ASYNC_MAX_CONCURRENT_PER_HOST = 6
+BATCH_MAX_WORKERS = 8
+BATCH_MAX_PER_HOST = 2
+BACKGROUND_MAX_WORKERS = 16
+CANCEL_CHECK_SECONDS = 0.1
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_OPEN_SECONDS = 30.0
+CIRCUIT_MAX_HOSTS = 1_024
+NEGATIVE_CACHE_TTL_SECONDS = 60.0
+NEGATIVE_CACHE_MAX_ENTRIES = 1_024
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DECODED_CACHE_MAX_BYTES = 256 * 1024 * 1024
 
 _REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
 _MIME_TO_FORMAT = {
@@ -43,12 +103,47 @@ _MIME_TO_FORMAT = {
     "image/x-ms-bmp": "BMP",
 }
 _ALLOWED_FORMATS = frozenset(_MIME_TO_FORMAT.values())
-_SNI_CONTEXT = ssl.create_default_context()
+# Loading the system CA certificates takes tens of milliseconds, so the TLS
+# context is created on the first HTTPS connection rather than at import.
+_SNI_CONTEXT: Optional[ssl.SSLContext] = None
+_SNI_CONTEXT_LOCK = threading.Lock()
+_TLS_SESSION_LIMIT = 256
+_STALE_CONNECTION_ERRORS = (
+    BrokenPipeError,
+    ConnectionResetError,
+    http.client.RemoteDisconnected,
+)
 
-_BLOCKED_PLATFORM_ADDRESSES = frozenset(
-    {ipaddress.ip_address("168.63.129.16")}
+_ADDRESS_POLICY = address_policy.AddressPolicy.from_environment()
+_DNS_EXECUTOR = dns_resolver.ResolverPool.from_environment()
+_UDP_RESOLVER = dns_resolver.UDPResolver.from_environment()
+_BATCH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=BATCH_MAX_WORKERS, thread_name_prefix="image-batch"
 )
-_DNS_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image-dns")
+_BACKGROUND_EXECUTOR = ThreadPoolExecutor(
+    max_workers=BACKGROUND_MAX_WORKERS, thread_name_prefix="image-background"
+)
+_T = TypeVar("_T")
+
+_FETCHES = metrics.REGISTRY.counter(
+    "imageworkdesk_remote_fetches_total",
+    "Remote image fetches by outcome (ok or the ImageFetchError subclass).",
+    ["outcome"],
+)
+_FETCH_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_remote_fetch_seconds",
+    "Wall time of remote image fetches, including redirects and decoding.",
+    ["outcome"],
+)
+_DOWNLOADED_BYTES = metrics.REGISTRY.counter(
+    "imageworkdesk_remote_downloaded_bytes_total",
+    "Response body bytes received from image hosts.",
+)
+_DECODE_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_image_decode_seconds",
+    "Time spent validating and decoding downloaded images.",
+)
+
 
 class ImageFetchError(Exception):
     """Base class for controlled remote-image failures."""
@@ -66,6 +161,26 @@ class ImageDownloadError(ImageFetchError):
     """The remote server could not provide a usable response."""
 
 
+class ImageConnectionError(ImageDownloadError):
+    """The image host could not be reached or the connection to it failed."""
+
+
+class ImageTimeout(ImageDownloadError):
+    """The image request ran out of time, for example on a slow download."""
+
+
+class FetchOverloaded(ImageDownloadError):
+    """Too many lookups were pending here, so the image host was not asked."""
+
+
+class ImageHostUnavailable(ImageDownloadError):
+    """Recent requests to the image host failed, so this one was not attempted."""
+
+
+class FetchCancelled(ImageFetchError):
+    """The caller cancelled a background fetch before it finished."""
+
+
 class ImageTooLarge(ImageFetchError):
     """The response body or decoded image exceeds an application limit."""
 
@@ -91,6 +206,839 @@ class _Endpoint(NamedTuple):
     address_text: str
 
 
+class BatchFetchResult(NamedTuple):
+    """Outcome of one URL in :func:`fetch_images_from_urls`."""
+
+    index: int
+    url: str
+    image: Optional[Image.Image]
+    error: Optional[ImageFetchError]
+
+
+class TraceEvent(NamedTuple):
+    name: str
+    timestamp: float
+    fields: Dict[str, Any]
+
+
+class FetchTrace:
+    """Per-phase timing for one :func:`fetch_image_from_url` call.
+
+    Events carry ``time.monotonic()`` timestamps. ``on_event`` is called with
+    each :class:`TraceEvent` as it is recorded and ``on_finish`` with the span
+    from :meth:`as_span` when the fetch returns or fails. A call that joins an
+    identical in-flight fetch records only that it waited.
+    """
+
+    def __init__(
+        self,
+        on_event: Optional[Callable[[TraceEvent], None]] = None,
+        on_finish: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        self.events: List[TraceEvent] = []
+        self._on_event = on_event
+        self._on_finish = on_finish
+
+    def record(self, name: str, **fields: Any) -> None:
+        event = TraceEvent(name, time.monotonic(), fields)
+        self.events.append(event)
+        if self._on_event is not None:
+            self._on_event(event)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.record("fetch.end", error=None if error is None else type(error).__name__)
+        if self._on_finish is not None:
+            self._on_finish(self.as_span())
+
+    def as_span(self) -> Dict[str, Any]:
+        if not self.events:
+            return {"name": "fetch_image_from_url", "events": []}
+        start = self.events[0].timestamp
+        end = self.events[-1].timestamp
+        endpoint = None
+        for event in self.events:
+            if event.name == "connection":
+                endpoint = event.fields.get("address")
+        return {
+            "name": "fetch_image_from_url",
+            "url": self.events[0].fields.get("url"),
+            "start": start,
+            "duration": end - start,
+            "endpoint": endpoint,
+            "redirects": sum(event.name == "redirect" for event in self.events),
+            "bytes": sum(
+                event.fields.get("bytes", 0)
+                for event in self.events
+                if event.name == "body.chunk"
+            ),
+            "error": self.events[-1].fields.get("error")
+            if self.events[-1].name == "fetch.end"
+            else None,
+            "events": [
+                dict(event.fields, name=event.name, offset=event.timestamp - start)
+                for event in self.events
+            ],
+        }
+
+
+_ACTIVE_TRACE: ContextVar[Optional[FetchTrace]] = ContextVar(
+    "image_fetch_trace", default=None
+)
+
+
+class FetchProgress(NamedTuple):
+    """Body bytes received so far and the declared ``Content-Length``, if any."""
+
+    received: int
+    total: Optional[int]
+
+
+class BackgroundFetch:
+    """Handle for an operation started with :func:`run_in_background`.
+
+    :meth:`progress` reports the image body bytes read so far. :meth:`cancel`
+    is cooperative: the fetch stops at its next check, and the socket it is
+    reading from is shut down so a blocked read returns at once. Parallel
+    fetches started by :func:`fetch_images_from_urls` each get a child handle,
+    which is cancelled with this one.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._children: "set[BackgroundFetch]" = set()
+        self._socket: Optional[socket.socket] = None
+        self._progress = FetchProgress(0, None)
+        self._future: "Future[Any]" = Future()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def progress(self) -> FetchProgress:
+        return self._progress
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """Return the operation's result or raise :class:`FetchCancelled`."""
+
+        try:
+            return self._future.result(timeout)
+        except FutureCancelled:
+            raise FetchCancelled("The image request was cancelled.") from None
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self._future.cancel()
+        with self._lock:
+            children = list(self._children)
+        for child in children:
+            child.cancel()
+        with self._lock:
+            # Held while shutting down so the socket cannot be detached and
+            # handed to another fetch through the connection pool meanwhile.
+            # SSLSocket.shutdown would also drop its TLS state under a reader
+            # in another thread, so the plain socket method is used for it.
+            if self._socket is None:
+                return
+            shutdown = self._socket.shutdown
+            if isinstance(self._socket, ssl.SSLSocket):
+                shutdown = functools.partial(socket.socket.shutdown, self._socket)
+            with contextlib.suppress(OSError):
+                shutdown(socket.SHUT_RDWR)
+
+    def _run_child(self, operation: Callable[[], _T]) -> _T:
+        # A child added after cancel() took its snapshot still sees the flag,
+        # since it is set first.
+        child = BackgroundFetch()
+        with self._lock:
+            self._children.add(child)
+        try:
+            if self.cancelled:
+                child.cancel()
+            with cancellable_fetches(child):
+                return operation()
+        finally:
+            with self._lock:
+                self._children.discard(child)
+
+    def _attach(self, connected_socket: socket.socket) -> None:
+        with self._lock:
+            self._socket = connected_socket
+
+    def _detach(self) -> None:
+        with self._lock:
+            self._socket = None
+
+    def _begin_body(self, total: Optional[int]) -> None:
+        self._progress = FetchProgress(0, total)
+
+    def _advance(self, count: int) -> None:
+        received, total = self._progress
+        self._progress = FetchProgress(received + count, total)
+
+
+_ACTIVE_FETCH: ContextVar[Optional[BackgroundFetch]] = ContextVar(
+    "image_background_fetch", default=None
+)
+
+
+def _check_cancelled() -> None:
+    handle = _ACTIVE_FETCH.get()
+    if handle is not None and handle.cancelled:
+        raise FetchCancelled("The image request was cancelled.")
+
+
+def run_in_background(operation: Callable[[], _T]) -> BackgroundFetch:
+    """Run ``operation`` on a background thread and return its handle.
+
+    Fetches made by ``operation`` report progress to the handle and stop when
+    it is cancelled; any :class:`ImageFetchError` they raise after that is
+    replaced by :class:`FetchCancelled`.
+    """
+
+    handle = BackgroundFetch()
+
+    def run() -> _T:
+        with cancellable_fetches(handle):
+            return operation()
+
+    handle._future = _BACKGROUND_EXECUTOR.submit(run)
+    return handle
+
+
+@contextlib.contextmanager
+def cancellable_fetches(handle: BackgroundFetch) -> Iterator[None]:
+    """Report fetches made in this block to ``handle`` and stop them with it.
+
+    This is how :func:`run_in_background` runs its operation; use it directly
+    to cancel fetches that run on a thread of your own.
+    """
+
+    token = _ACTIVE_FETCH.set(handle)
+    try:
+        _check_cancelled()
+        yield
+    except ImageFetchError:
+        _check_cancelled()
+        raise
+    finally:
+        _ACTIVE_FETCH.reset(token)
+
+
+def _trace(name: str, **fields: Any) -> None:
+    trace = _ACTIVE_TRACE.get()
+    if trace is not None:
+        trace.record(name, **fields)
+
+
+def _error_name(error: BaseException) -> str:
+    return type(error).__name__
+
+
+class _Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class _SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution.
+
+    The first caller runs the operation in its own thread. Later callers wait
+    for that result, each bounded by its own deadline.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[Any, _Flight] = {}
+
+    def do(self, key: Any, operation: Callable[[], _T], deadline: float) -> _T:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if leader:
+            metrics.record_cache_lookup(self._name, False)
+            try:
+                flight.result = operation()
+            except BaseException as exc:
+                flight.error = exc
+                raise
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+            return flight.result
+
+        metrics.record_cache_lookup(self._name, True)
+        _trace("fetch.coalesced")
+        # Waiters poll so that a cancelled background fetch stops waiting.
+        while not flight.done.wait(
+            min(_remaining_time(deadline), CANCEL_CHECK_SECONDS)
+        ):
+            _check_cancelled()
+            if time.monotonic() >= deadline:
+                raise ImageTimeout("The image request timed out.")
+        if isinstance(flight.error, FetchCancelled):
+            # Only the leader's caller gave up; this one still wants the image.
+            _check_cancelled()
+            return self.do(key, operation, deadline)
+        if flight.error is not None:
+            _raise_shared_error(flight.error)
+        return flight.result
+
+
+def _raise_shared_error(error: BaseException) -> None:
+    # Exception objects are not shared across threads; each waiter raises its
+    # own instance chained to the leader's failure.
+    if isinstance(error, ImageFetchError):
+        raise type(error)(*error.args) from error
+    raise ImageDownloadError("The image request failed.") from error
+
+
+class _SharedLookups:
+    """Share one pending resolver future between concurrent identical lookups."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._lookups: Dict[Any, List[Any]] = {}
+
+    def join(self, key: Any, submit: Callable[[], "Future[Any]"]) -> "Future[Any]":
+        with self._lock:
+            entry = self._lookups.get(key)
+            if entry is None:
+                entry = self._lookups[key] = [submit(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def leave(self, key: Any, future: "Future[Any]", cancel: bool) -> None:
+        with self._lock:
+            entry = self._lookups.get(key)
+            if entry is None or entry[0] is not future:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._lookups[key]
+        if cancel:
+            future.cancel()
+
+
+_FETCH_FLIGHTS = _SingleFlight("fetch_flight")
+_DNS_LOOKUPS = _SharedLookups()
+
+
+class _Circuit:
+    def __init__(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+
+
+class _CircuitBreaker:
+    """Per-host circuit breaker for connection failures.
+
+    After ``failure_threshold`` consecutive failures a host's circuit opens and
+    requests fail immediately with :class:`ImageHostUnavailable`. Once
+    ``open_seconds`` have passed, a single probe request is let through while
+    others keep failing fast; its outcome closes or reopens the circuit.
+
+    Timeouts and local overload say nothing about the host's health: they
+    neither count as failures nor close the circuit.
+    """
+
+    def __init__(
+        self, failure_threshold: int, open_seconds: float, max_hosts: int
+    ) -> None:
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._max_hosts = max_hosts
+        self._lock = threading.Lock()
+        self._circuits: "OrderedDict[str, _Circuit]" = OrderedDict()
+
+    def open_count(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            return sum(
+                circuit.open_until > now or circuit.probing
+                for circuit in self._circuits.values()
+            )
+
+    @contextlib.contextmanager
+    def guard(self, hostname: str) -> Iterator[None]:
+        probe = self._admit(hostname)
+        try:
+            yield
+        except (FetchCancelled, FetchOverloaded, ImageTimeout):
+            self._release(hostname, probe)
+            raise
+        except ImageConnectionError:
+            self._record(hostname, probe, failed=True)
+            raise
+        except ImageFetchError:
+            self._record(hostname, probe, failed=False)
+            raise
+        except BaseException:
+            self._release(hostname, probe)
+            raise
+        self._record(hostname, probe, failed=False)
+
+    def _admit(self, hostname: str) -> bool:
+        with self._lock:
+            circuit = self._circuits.get(hostname)
+            if circuit is None or circuit.failures < self._failure_threshold:
+                return False
+            if circuit.probing or circuit.open_until > time.monotonic():
+                _trace("circuit.rejected", hostname=hostname)
+                raise ImageHostUnavailable(
+                    "The image host is temporarily unavailable."
+                )
+            circuit.probing = True
+        _trace("circuit.probe", hostname=hostname)
+        return True
+
+    def _record(self, hostname: str, probe: bool, failed: bool) -> None:
+        with self._lock:
+            circuit = self._circuits.get(hostname)
+            if not failed:
+                if circuit is not None and (probe or not circuit.probing):
+                    del self._circuits[hostname]
+                return
+            if circuit is None:
+                circuit = self._circuits[hostname] = _Circuit()
+                while len(self._circuits) > self._max_hosts:
+                    self._circuits.popitem(last=False)
+            self._circuits.move_to_end(hostname)
+            if probe:
+                circuit.probing = False
+            elif circuit.probing:
+                return
+            circuit.failures += 1
+            if circuit.failures >= self._failure_threshold:
+                circuit.open_until = time.monotonic() + self._open_seconds
+
+    def _release(self, hostname: str, probe: bool) -> None:
+        if not probe:
+            return
+        with self._lock:
+            circuit = self._circuits.get(hostname)
+            if circuit is not None:
+                circuit.probing = False
+
+    def clear(self) -> None:
+        with self._lock:
+            self._circuits.clear()
+
+
+class _NegativeCache:
+    """Remember deterministic failures for a URL for a short time."""
+
+    def __init__(self, ttl: float, max_entries: int) -> None:
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._failures: "OrderedDict[str, Tuple[float, ImageFetchError]]" = (
+            OrderedDict()
+        )
+
+    def check(self, key: str) -> None:
+        with self._lock:
+            cached = self._failures.get(key)
+            if cached is not None and cached[0] <= time.monotonic():
+                del self._failures[key]
+                cached = None
+        metrics.record_cache_lookup("negative", cached is not None)
+        if cached is not None:
+            _trace("cache.negative", error=_error_name(cached[1]))
+            _raise_shared_error(cached[1])
+
+    def remember(self, key: str, error: ImageFetchError) -> None:
+        with self._lock:
+            self._failures[key] = (time.monotonic() + self._ttl, error)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self._max_entries:
+                self._failures.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._failures.clear()
+
+
+_CIRCUITS = _CircuitBreaker(
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_OPEN_SECONDS, CIRCUIT_MAX_HOSTS
+)
+_NEGATIVE_CACHE = _NegativeCache(
+    NEGATIVE_CACHE_TTL_SECONDS, NEGATIVE_CACHE_MAX_ENTRIES
+)
+_DETERMINISTIC_ERRORS = (InvalidImageData, ImageTooLarge)
+metrics.REGISTRY.gauge(
+    "imageworkdesk_remote_open_circuits",
+    "Image hosts whose circuit breaker is open or probing.",
+).set_function(_CIRCUITS.open_count)
+
+
+class _PoolKey(NamedTuple):
+    scheme: str
+    hostname: str
+    address_text: str
+
+
+class _StaleConnection(Exception):
+    """A reused keep-alive connection was closed by the server."""
+
+
+class _ConnectionPool:
+    """Bounded pool of idle keep-alive sockets.
+
+    Sockets are keyed by scheme, hostname and the peer address they were
+    verified against, so a socket is only reused for a target whose freshly
+    validated endpoints still include that peer.
+    """
+
+    def __init__(
+        self, max_idle: int, max_idle_per_key: int, idle_timeout: float
+    ) -> None:
+        self._max_idle = max_idle
+        self._max_idle_per_key = max_idle_per_key
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[_PoolKey, socket.socket, float]] = []
+
+    def acquire(self, keys: List[_PoolKey]) -> Optional[socket.socket]:
+        wanted = set(keys)
+        while True:
+            expired, candidate = [], None
+            with self._lock:
+                now = time.monotonic()
+                live = []
+                for entry in self._idle:
+                    (expired if entry[2] <= now else live).append(entry)
+                self._idle = live
+                for index in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[index][0] in wanted:
+                        candidate = self._idle.pop(index)[1]
+                        break
+            for _key, idle_socket, _expires in expired:
+                idle_socket.close()
+            if candidate is None or _socket_is_idle(candidate):
+                return candidate
+            candidate.close()
+
+    def release(self, key: _PoolKey, idle_socket: socket.socket) -> None:
+        evicted = []
+        with self._lock:
+            self._idle.append(
+                (key, idle_socket, time.monotonic() + self._idle_timeout)
+            )
+            same_key = [entry for entry in self._idle if entry[0] == key]
+            if len(same_key) > self._max_idle_per_key:
+                evicted.append(same_key[0])
+                self._idle.remove(same_key[0])
+            while len(self._idle) > self._max_idle:
+                evicted.append(self._idle.pop(0))
+        for _key, evicted_socket, _expires in evicted:
+            evicted_socket.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for _key, idle_socket, _expires in idle:
+            idle_socket.close()
+
+
+def _socket_is_idle(idle_socket: socket.socket) -> bool:
+    # An idle keep-alive socket has nothing to read; readable means the server
+    # closed it or sent unsolicited data.
+    try:
+        readable, _writable, _errored = select.select([idle_socket], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def _tls_session_for(hostname: str) -> Optional[ssl.SSLSession]:
+    with _TLS_SESSIONS_LOCK:
+        return _TLS_SESSIONS.get(hostname)
+
+
+def _remember_tls_session(hostname: str, connected_socket: socket.socket) -> None:
+    if not isinstance(connected_socket, ssl.SSLSocket):
+        return
+    session = connected_socket.session
+    if session is None:
+        return
+    with _TLS_SESSIONS_LOCK:
+        _TLS_SESSIONS[hostname] = session
+        _TLS_SESSIONS.move_to_end(hostname)
+        while len(_TLS_SESSIONS) > _TLS_SESSION_LIMIT:
+            _TLS_SESSIONS.popitem(last=False)
+
+
+_CONNECTION_POOL = _ConnectionPool(
+    POOL_MAX_IDLE_CONNECTIONS, POOL_MAX_IDLE_PER_HOST, POOL_IDLE_TIMEOUT_SECONDS
+)
+_TLS_SESSIONS: "OrderedDict[str, ssl.SSLSession]" = OrderedDict()
+_TLS_SESSIONS_LOCK = threading.Lock()
+
+
+def _sni_context() -> ssl.SSLContext:
+    global _SNI_CONTEXT
+    with _SNI_CONTEXT_LOCK:
+        if _SNI_CONTEXT is None:
+            _SNI_CONTEXT = ssl.create_default_context()
+        return _SNI_CONTEXT
+
+
+class _CachePolicy(NamedTuple):
+    storable: bool
+    lifetime: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class _Response(NamedTuple):
+    body: Optional[bytes]
+    redirect_location: Optional[str]
+    mime_type: Optional[str]
+    cache_policy: Optional[_CachePolicy] = None
+    not_modified: bool = False
+
+
+class _CacheEntry(NamedTuple):
+    digest: str
+    body: bytes
+    mime_type: str
+    fresh_until: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class _ResponseCache:
+    """Process-wide cache of image responses shared by every session.
+
+    Entries are keyed on the normalized URL and point at bodies stored once per
+    SHA-256 digest, so identical bytes served under several URLs are kept and
+    decoded once. Bodies and decoded images are evicted least recently used to
+    stay within their byte budgets.
+    """
+
+    def __init__(self, max_bytes: int, max_decoded_bytes: int) -> None:
+        self._max_bytes = max_bytes
+        self._max_decoded_bytes = max_decoded_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bodies: Dict[str, bytes] = {}
+        self._references: Dict[str, int] = {}
+        self._bytes = 0
+        self._decoded: "OrderedDict[Tuple[str, Optional[int]], Image.Image]" = (
+            OrderedDict()
+        )
+        self._decoded_bytes = 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: str) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(
+        self, key: str, body: bytes, mime_type: str, policy: _CachePolicy
+    ) -> Optional[_CacheEntry]:
+        if not policy.storable or len(body) > self._max_bytes:
+            self.discard(key)
+            return None
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            self._discard_locked(key)
+            if digest not in self._bodies:
+                self._bodies[digest] = body
+                self._bytes += len(body)
+            stored = self._bodies[digest]
+            self._references[digest] = self._references.get(digest, 0) + 1
+            entry = self._entries[key] = _CacheEntry(
+                digest,
+                stored,
+                mime_type,
+                time.monotonic() + policy.lifetime,
+                policy.etag,
+                policy.last_modified,
+            )
+            while self._bytes > self._max_bytes:
+                self._discard_locked(next(iter(self._entries)))
+        return entry
+
+    def refresh(
+        self, key: str, entry: _CacheEntry, policy: _CachePolicy
+    ) -> _CacheEntry:
+        """Extend a revalidated entry; it is still served once if now unstorable."""
+
+        refreshed = entry._replace(
+            fresh_until=time.monotonic() + policy.lifetime,
+            etag=policy.etag or entry.etag,
+            last_modified=policy.last_modified or entry.last_modified,
+        )
+        with self._lock:
+            if not policy.storable:
+                self._discard_locked(key)
+            elif self._entries.get(key) is entry:
+                self._entries[key] = refreshed
+                self._entries.move_to_end(key)
+        return refreshed
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            self._discard_locked(key)
+
+    def _discard_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._references[entry.digest] -= 1
+        if self._references[entry.digest] == 0:
+            del self._references[entry.digest]
+            self._bytes -= len(self._bodies.pop(entry.digest))
+            for decoded_key in [key for key in self._decoded if key[0] == entry.digest]:
+                self._decoded_bytes -= _decoded_size(self._decoded.pop(decoded_key))
+
+    def decoded(
+        self, digest: str, max_side: Optional[int] = None
+    ) -> Optional[Image.Image]:
+        with self._lock:
+            image = self._decoded.get((digest, max_side))
+            if image is not None:
+                self._decoded.move_to_end((digest, max_side))
+            return image
+
+    def remember_decoded(
+        self, digest: str, image: Image.Image, max_side: Optional[int] = None
+    ) -> None:
+        size = _decoded_size(image)
+        if size > self._max_decoded_bytes:
+            return
+        with self._lock:
+            key = (digest, max_side)
+            if digest not in self._references or key in self._decoded:
+                return
+            self._decoded[key] = image
+            self._decoded_bytes += size
+            while self._decoded_bytes > self._max_decoded_bytes:
+                _key, evicted = self._decoded.popitem(last=False)
+                self._decoded_bytes -= _decoded_size(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bodies.clear()
+            self._references.clear()
+            self._decoded.clear()
+            self._bytes = self._decoded_bytes = 0
+
+
+def _decoded_size(image: Image.Image) -> int:
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def _optional_cache_header(headers: Any, name: str) -> Tuple[bool, Optional[str]]:
+    values = headers.get_all(name, [])
+    if not values:
+        return True, None
+    if len(values) != 1 or not isinstance(values[0], str):
+        return False, None
+    return True, values[0].strip()
+
+
+def _cache_directives(headers: Any) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    for value in headers.get_all("Cache-Control", []):
+        for item in str(value).split(","):
+            name, separator, argument = item.strip().partition("=")
+            if name:
+                directives.setdefault(
+                    name.lower(), argument.strip('"') if separator else None
+                )
+    return directives
+
+
+def _delta_seconds(value: Optional[str]) -> Optional[float]:
+    if value is None or not value.isdigit():
+        return None
+    return float(value)
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _cache_policy(headers: Any) -> _CachePolicy:
+    """Apply shared-cache rules from RFC 9111 to an image response."""
+
+    headers_valid = True
+    values: Dict[str, Optional[str]] = {}
+    for name in ("Age", "Date", "ETag", "Expires", "Last-Modified", "Vary"):
+        valid, values[name] = _optional_cache_header(headers, name)
+        headers_valid = headers_valid and valid
+    directives = _cache_directives(headers)
+    etag, last_modified = values["ETag"], values["Last-Modified"]
+    if (
+        not headers_valid
+        or "no-store" in directives
+        or "private" in directives
+        or values["Vary"] == "*"
+    ):
+        return _CachePolicy(False, 0.0, etag, last_modified)
+
+    lifetime: Optional[float] = 0.0
+    if "no-cache" not in directives:
+        lifetime = _delta_seconds(directives.get("s-maxage"))
+        if lifetime is None:
+            lifetime = _delta_seconds(directives.get("max-age"))
+        if lifetime is None and values["Expires"] is not None:
+            expires = _http_date(values["Expires"])
+            date = _http_date(values["Date"]) or time.time()
+            lifetime = 0.0 if expires is None else expires - date
+    lifetime = max(0.0, (lifetime or 0.0) - (_delta_seconds(values["Age"]) or 0.0))
+    storable = lifetime > 0 or etag is not None or last_modified is not None
+    return _CachePolicy(storable, lifetime, etag, last_modified)
+
+
+def _conditional_headers(cached: Optional[_CacheEntry]) -> Dict[str, str]:
+    if cached is None:
+        return {}
+    headers = {}
+    if cached.etag is not None:
+        headers["If-None-Match"] = cached.etag
+    if cached.last_modified is not None:
+        headers["If-Modified-Since"] = cached.last_modified
+    return headers
+
+
+_RESPONSE_CACHE = _ResponseCache(RESPONSE_CACHE_MAX_BYTES, DECODED_CACHE_MAX_BYTES)
+metrics.REGISTRY.gauge(
+    "imageworkdesk_response_cache_bytes",
+    "Image response bytes held in the shared cache.",
+).set_function(lambda: _RESPONSE_CACHE.size_bytes)
+
+
 def _parse_target(url: str) -> _Target:
     if not isinstance(url, str) or not url or len(url) > MAX_URL_LENGTH:
         raise InvalidImageURL("Invalid URL.")
@@ -181,9 +1129,12 @@ def _parse_target(url: str) -> _Target:
 
 
 def _is_public_address(address: Any) -> bool:
-    if address in _BLOCKED_PLATFORM_ADDRESSES:
+    # An explicit rule overrides the built-in special-purpose checks, but the
+    # IPv4 addresses embedded in IPv6 ones are always checked on their own.
+    decision = _ADDRESS_POLICY.decision(address)
+    if decision is False:
         return False
-    if (
+    if decision is None and (
         not address.is_global
         or address.is_private
         or address.is_loopback
@@ -209,32 +1160,74 @@ def _is_public_address(address: Any) -> bool:
     return True
 
 
+def _start_lookup(target: _Target) -> "Future[Any]":
+    # The UDP resolver's lookups can be cancelled outright; getaddrinfo calls
+    # run on the elastic pool, which rejects work instead of queueing forever.
+    if _UDP_RESOLVER is not None:
+        try:
+            address = ipaddress.ip_address(target.hostname)
+        except ValueError:
+            return _UDP_RESOLVER.lookup(target.hostname, target.port)
+        # Address literals need no lookup; answer as getaddrinfo would.
+        family, socket_address = (
+            (socket.AF_INET, (str(address), target.port))
+            if address.version == 4
+            else (socket.AF_INET6, (str(address), target.port, 0, 0))
+        )
+        answers: "Future[Any]" = Future()
+        answers.set_result(
+            [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", socket_address)]
+        )
+        return answers
+    return _DNS_EXECUTOR.submit(
+        socket.getaddrinfo,
+        target.hostname,
+        target.port,
+        socket.AF_UNSPEC,
+        socket.SOCK_STREAM,
+        socket.IPPROTO_TCP,
+    )
+
+
 def _resolve_public_endpoints(
     target: _Target, deadline: Optional[float] = None
 ) -> Tuple[_Endpoint, ...]:
     if deadline is None:
         deadline = time.monotonic() + DNS_TIMEOUT_SECONDS
+    lookup_key = (target.hostname, target.port)
     future = None
+    timed_out = False
+    _trace("dns.start", hostname=target.hostname)
     try:
-        future = _DNS_EXECUTOR.submit(
-            socket.getaddrinfo,
-            target.hostname,
-            target.port,
-            socket.AF_UNSPEC,
-            socket.SOCK_STREAM,
-            socket.IPPROTO_TCP,
-        )
+        future = _DNS_LOOKUPS.join(lookup_key, lambda: _start_lookup(target))
         answers = future.result(
             timeout=min(DNS_TIMEOUT_SECONDS, _remaining_time(deadline))
         )
-    except FutureTimeout as exc:
-        if future is not None:
-            future.cancel()
-        raise ImageDownloadError("The image host lookup timed out.") from exc
+    except (FutureTimeout, FutureCancelled) as exc:
+        timed_out = True
+        _trace("dns.end", error=_error_name(exc))
+        raise ImageTimeout("The image host lookup timed out.") from exc
+    except socket.timeout as exc:
+        _trace("dns.end", error=_error_name(exc))
+        raise ImageTimeout("The image host lookup timed out.") from exc
+    except dns_resolver.ResolverSaturated as exc:
+        _trace("dns.end", error=_error_name(exc))
+        raise FetchOverloaded("Too many image host lookups are pending.") from exc
     except (OSError, RuntimeError, UnicodeError) as exc:
+        _trace("dns.end", error=_error_name(exc))
         raise ImageDownloadError("The image host could not be resolved.") from exc
+    finally:
+        if future is not None:
+            _DNS_LOOKUPS.leave(lookup_key, future, cancel=timed_out)
     _remaining_time(deadline)
+    endpoints = _validated_endpoints(target, answers)
+    _trace(
+        "dns.end", addresses=[endpoint.address_text for endpoint in endpoints]
+    )
+    return endpoints
 
+
+def _validated_endpoints(target: _Target, answers: Any) -> Tuple[_Endpoint, ...]:
     endpoints: List[_Endpoint] = []
     seen = set()
     for family, socket_type, protocol, _canonical_name, socket_address in answers:
@@ -289,7 +1282,7 @@ def _resolve_public_endpoints(
 def _remaining_time(deadline: float) -> float:
     remaining = deadline - time.monotonic()
     if remaining <= 0:
-        raise ImageDownloadError("The image request timed out.")
+        raise ImageTimeout("The image request timed out.")
     return remaining
 
 
@@ -399,6 +1392,52 @@ class _DeadlineSocket:
             self._close_underlying()
 
 
+def _verify_peer(target: _Target, endpoint: _Endpoint, peer: Any) -> None:
+    if not isinstance(peer, tuple) or len(peer) < 2 or peer[1] != target.port:
+        raise UnsafeImageURL("The connected peer address is invalid.")
+    peer_text = peer[0]
+    if not isinstance(peer_text, str) or "%" in peer_text:
+        raise UnsafeImageURL("The connected peer address is invalid.")
+    try:
+        peer_address = ipaddress.ip_address(peer_text)
+    except ValueError as exc:
+        raise UnsafeImageURL("The connected peer address is invalid.") from exc
+    expected_family = socket.AF_INET if peer_address.version == 4 else socket.AF_INET6
+    if expected_family != endpoint.family or str(peer_address) != endpoint.address_text:
+        raise UnsafeImageURL("The connected peer did not match the validated address.")
+
+
+def _finish_connection(
+    target: _Target,
+    endpoint: _Endpoint,
+    connected_socket: socket.socket,
+    deadline: float,
+) -> socket.socket:
+    try:
+        _set_socket_timeout(connected_socket, deadline, CONNECT_TIMEOUT_SECONDS)
+        _verify_peer(target, endpoint, connected_socket.getpeername())
+
+        if target.scheme == "https":
+            _set_socket_timeout(connected_socket, deadline, CONNECT_TIMEOUT_SECONDS)
+            wrap_options: Dict[str, Any] = {"server_hostname": target.hostname}
+            session = _tls_session_for(target.hostname)
+            if session is not None:
+                wrap_options["session"] = session
+            _trace("tls.start", resumable=session is not None)
+            connected_socket = _sni_context().wrap_socket(
+                connected_socket, **wrap_options
+            )
+            _trace(
+                "tls.end",
+                resumed=bool(getattr(connected_socket, "session_reused", False)),
+            )
+            _remember_tls_session(target.hostname, connected_socket)
+        return connected_socket
+    except Exception:
+        connected_socket.close()
+        raise
+
+
 def _connect_endpoint(
     target: _Target, endpoint: _Endpoint, deadline: float
 ) -> socket.socket:
@@ -407,55 +1446,138 @@ def _connect_endpoint(
         endpoint.socket_type,
         endpoint.protocol,
     )
+    _trace("connect.start", address=endpoint.address_text)
     try:
         _set_socket_timeout(connected_socket, deadline, CONNECT_TIMEOUT_SECONDS)
         connected_socket.connect(endpoint.socket_address)
-
-        peer = connected_socket.getpeername()
-        if not isinstance(peer, tuple) or len(peer) < 2 or peer[1] != target.port:
-            raise UnsafeImageURL("The connected peer address is invalid.")
-        peer_text = peer[0]
-        if not isinstance(peer_text, str) or "%" in peer_text:
-            raise UnsafeImageURL("The connected peer address is invalid.")
-        try:
-            peer_address = ipaddress.ip_address(peer_text)
-        except ValueError as exc:
-            raise UnsafeImageURL("The connected peer address is invalid.") from exc
-        expected_family = (
-            socket.AF_INET if peer_address.version == 4 else socket.AF_INET6
+    except Exception as exc:
+        _trace("connect.end", address=endpoint.address_text, error=_error_name(exc))
+        connected_socket.close()
+        raise
+    _trace("connect.end", address=endpoint.address_text)
+    return _finish_connection(target, endpoint, connected_socket, deadline)
+
+
+def _interleave_endpoints(endpoints: Tuple[_Endpoint, ...]) -> Tuple[_Endpoint, ...]:
+    first_family = endpoints[0].family
+    preferred = [endpoint for endpoint in endpoints if endpoint.family == first_family]
+    alternate = [endpoint for endpoint in endpoints if endpoint.family != first_family]
+    ordered: List[_Endpoint] = []
+    for index in range(max(len(preferred), len(alternate))):
+        ordered.extend(
+            group[index] for group in (preferred, alternate) if index < len(group)
         )
-        if (
-            expected_family != endpoint.family
-            or str(peer_address) != endpoint.address_text
-        ):
-            raise UnsafeImageURL(
-                "The connected peer did not match the validated address."
-            )
+    return tuple(ordered)
 
-        if target.scheme == "https":
-            _set_socket_timeout(connected_socket, deadline, CONNECT_TIMEOUT_SECONDS)
-            connected_socket = _SNI_CONTEXT.wrap_socket(
-                connected_socket,
-                server_hostname=target.hostname,
-            )
-        return connected_socket
+
+def _start_connect(endpoint: _Endpoint) -> socket.socket:
+    attempt = socket.socket(endpoint.family, endpoint.socket_type, endpoint.protocol)
+    try:
+        attempt.setblocking(False)
+        error = attempt.connect_ex(endpoint.socket_address)
+        if error not in {0, errno.EINPROGRESS, errno.EWOULDBLOCK}:
+            raise OSError(error, os.strerror(error))
     except Exception:
-        connected_socket.close()
+        attempt.close()
         raise
+    return attempt
 
 
-def _open_connected_socket(
+def _race_endpoints(
     target: _Target, endpoints: Tuple[_Endpoint, ...], deadline: float
 ) -> socket.socket:
+    """Race staggered connection attempts across address families (RFC 8305).
+
+    A new attempt starts every ``CONNECTION_ATTEMPT_DELAY_SECONDS`` or as soon
+    as the previous one fails. The first TCP connection that also passes peer
+    verification and TLS wins; every other attempt is closed immediately.
+    """
+
+    queued = list(_interleave_endpoints(endpoints))
+    pending: Dict[socket.socket, float] = {}
+    selector = selectors.DefaultSelector()
+    next_start = time.monotonic()
     last_error: Optional[BaseException] = None
-    for endpoint in endpoints:
-        try:
-            return _connect_endpoint(target, endpoint, deadline)
-        except UnsafeImageURL:
-            raise
-        except (OSError, ssl.SSLError) as exc:
-            last_error = exc
-    raise ImageDownloadError("The image host could not be reached.") from last_error
+    try:
+        while queued or pending:
+            _remaining_time(deadline)
+            now = time.monotonic()
+            if queued and (not pending or now >= next_start):
+                endpoint = queued.pop(0)
+                _trace("connect.start", address=endpoint.address_text)
+                try:
+                    attempt = _start_connect(endpoint)
+                except OSError as exc:
+                    _trace(
+                        "connect.end",
+                        address=endpoint.address_text,
+                        error=_error_name(exc),
+                    )
+                    last_error = exc
+                    continue
+                selector.register(attempt, selectors.EVENT_WRITE, endpoint)
+                pending[attempt] = min(now + CONNECT_TIMEOUT_SECONDS, deadline)
+                next_start = now + CONNECTION_ATTEMPT_DELAY_SECONDS
+                continue
+
+            wake_at = min(pending.values())
+            if queued:
+                wake_at = min(wake_at, next_start)
+            for key, _events in selector.select(max(0.0, wake_at - now)):
+                attempt = key.fileobj
+                selector.unregister(attempt)
+                del pending[attempt]
+                error = attempt.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error:
+                    attempt.close()
+                    last_error = OSError(error, os.strerror(error))
+                    _trace(
+                        "connect.end",
+                        address=key.data.address_text,
+                        error=_error_name(last_error),
+                    )
+                    next_start = time.monotonic()
+                    continue
+                _trace("connect.end", address=key.data.address_text)
+                try:
+                    return _finish_connection(target, key.data, attempt, deadline)
+                except UnsafeImageURL:
+                    raise
+                except (OSError, ssl.SSLError) as exc:
+                    last_error = exc
+                    next_start = time.monotonic()
+
+            now = time.monotonic()
+            for attempt, attempt_deadline in list(pending.items()):
+                if now >= attempt_deadline:
+                    timed_out = selector.get_key(attempt).data
+                    selector.unregister(attempt)
+                    del pending[attempt]
+                    attempt.close()
+                    last_error = socket.timeout("timed out")
+                    _trace(
+                        "connect.end",
+                        address=timed_out.address_text,
+                        error=_error_name(last_error),
+                    )
+    finally:
+        for attempt in pending:
+            attempt.close()
+        selector.close()
+    raise ImageConnectionError("The image host could not be reached.") from last_error
+
+
+def _open_connected_socket(
+    target: _Target, endpoints: Tuple[_Endpoint, ...], deadline: float
+) -> socket.socket:
+    if len(endpoints) > 1:
+        return _race_endpoints(target, endpoints, deadline)
+    try:
+        return _connect_endpoint(target, endpoints[0], deadline)
+    except UnsafeImageURL:
+        raise
+    except (OSError, ssl.SSLError) as exc:
+        raise ImageConnectionError("The image host could not be reached.") from exc
 
 
 def _single_header(headers: Any, name: str) -> Optional[str]:
@@ -467,31 +1589,29 @@ def _single_header(headers: Any, name: str) -> Optional[str]:
     return values[0]
 
 
-def _read_response_body(
-    response: http.client.HTTPResponse,
-    connected_socket: socket.socket,
-    deadline: float,
-) -> Tuple[bytes, str]:
-    content_type = _single_header(response.headers, "Content-Type") or ""
+def _body_framing(headers: Any) -> Tuple[str, Optional[int], bool]:
+    """Validate body headers; return the MIME type, declared length and chunking."""
+
+    content_type = _single_header(headers, "Content-Type") or ""
     mime_type = content_type.partition(";")[0].strip().lower()
     allowed_mime_types = set(_MIME_TO_FORMAT).union({"", "application/octet-stream"})
     if mime_type not in allowed_mime_types:
         raise InvalidImageData("The response is not a supported image type.")
 
     content_encoding = (
-        _single_header(response.headers, "Content-Encoding") or ""
+        _single_header(headers, "Content-Encoding") or ""
     ).strip().lower()
     if content_encoding not in {"", "identity"}:
         raise InvalidImageData("Encoded response bodies are not allowed.")
 
     transfer_encoding = (
-        _single_header(response.headers, "Transfer-Encoding") or ""
+        _single_header(headers, "Transfer-Encoding") or ""
     ).strip().lower()
     if transfer_encoding not in {"", "chunked"}:
         raise ImageDownloadError("The response uses an unsupported transfer encoding.")
 
     declared_length = None
-    content_length = _single_header(response.headers, "Content-Length")
+    content_length = _single_header(headers, "Content-Length")
     if transfer_encoding and content_length is not None:
         raise ImageDownloadError("The response has conflicting length headers.")
     if content_length is not None:
@@ -501,41 +1621,135 @@ def _read_response_body(
         declared_length = int(normalized_length)
         if declared_length > MAX_DOWNLOAD_BYTES:
             raise ImageTooLarge("The image download is too large.")
+    return mime_type, declared_length, transfer_encoding == "chunked"
+
+
+def _append_body_chunk(body: bytearray, chunk: Any) -> None:
+    if not isinstance(chunk, bytes):
+        raise ImageDownloadError("The response body is invalid.")
+    _DOWNLOADED_BYTES.inc(len(chunk))
+    if len(body) + len(chunk) > MAX_DOWNLOAD_BYTES:
+        raise ImageTooLarge("The image download is too large.")
+    try:
+        body.extend(chunk)
+    except MemoryError as exc:
+        raise ImageTooLarge("The image download is too large.") from exc
+
+
+def _finish_body(body: bytearray, declared_length: Optional[int]) -> bytes:
+    if declared_length is not None and len(body) != declared_length:
+        raise ImageDownloadError("The response body is incomplete.")
+    try:
+        return bytes(body)
+    except MemoryError as exc:
+        raise ImageTooLarge("The image download is too large.") from exc
+
+
+def _read_response_body(
+    response: http.client.HTTPResponse,
+    connected_socket: socket.socket,
+    deadline: float,
+) -> Tuple[bytes, str]:
+    mime_type, declared_length, _chunked = _body_framing(response.headers)
+    handle = _ACTIVE_FETCH.get()
+    if handle is not None:
+        handle._begin_body(declared_length)
 
     body = bytearray()
     while True:
         _set_socket_timeout(connected_socket, deadline, READ_TIMEOUT_SECONDS)
         chunk = response.read1(READ_CHUNK_BYTES)
+        # A cancelled read ends early, so a short body must not be mistaken
+        # for a complete or corrupt one.
+        _check_cancelled()
         _remaining_time(deadline)
         if not chunk:
             break
-        if not isinstance(chunk, bytes):
-            raise ImageDownloadError("The response body is invalid.")
-        if len(body) + len(chunk) > MAX_DOWNLOAD_BYTES:
-            raise ImageTooLarge("The image download is too large.")
-        try:
-            body.extend(chunk)
-        except MemoryError as exc:
-            raise ImageTooLarge("The image download is too large.") from exc
+        _append_body_chunk(body, chunk)
+        if handle is not None:
+            handle._advance(len(chunk))
+        _trace("body.chunk", bytes=len(chunk))
 
-    if declared_length is not None and len(body) != declared_length:
-        raise ImageDownloadError("The response body is incomplete.")
+    result = _finish_body(body, declared_length)
+    _trace("body.end", bytes=len(result))
+    return result, mime_type
+
+
+def _redirect_location(headers: Any) -> str:
+    location = _single_header(headers, "Location")
+    if not location:
+        raise ImageDownloadError("The redirect response has no destination.")
+    if (
+        len(location) > MAX_URL_LENGTH
+        or location != location.strip()
+        or "\\" in location
+        or any(ord(character) < 32 or ord(character) == 127 for character in location)
+    ):
+        raise InvalidImageURL("Invalid redirect URL.")
+    return location
+
+
+def _peer_pool_key(
+    target: _Target, connected_socket: socket.socket
+) -> Optional[_PoolKey]:
     try:
-        return bytes(body), mime_type
-    except MemoryError as exc:
-        raise ImageTooLarge("The image download is too large.") from exc
+        peer = connected_socket.getpeername()
+        address_text = str(ipaddress.ip_address(peer[0]))
+    except (OSError, TypeError, ValueError, IndexError):
+        return None
+    return _PoolKey(target.scheme, target.hostname, address_text)
 
 
-def _download_once(
-    target: _Target, deadline: float
-) -> Tuple[Optional[bytes], Optional[str], Optional[str]]:
-    endpoints = _resolve_public_endpoints(target, deadline)
-    _remaining_time(deadline)
-    connected_socket = _open_connected_socket(target, endpoints, deadline)
+def _drain_response(
+    response: http.client.HTTPResponse,
+    connected_socket: socket.socket,
+    deadline: float,
+) -> bool:
+    drained = 0
+    try:
+        while drained <= MAX_DRAIN_BYTES:
+            _set_socket_timeout(connected_socket, deadline, READ_TIMEOUT_SECONDS)
+            chunk = response.read1(READ_CHUNK_BYTES)
+            _remaining_time(deadline)
+            if not chunk:
+                return True
+            drained += len(chunk)
+    except (OSError, http.client.HTTPException, ValueError):
+        pass
+    return False
+
+
+def _response_allows_reuse(response: http.client.HTTPResponse) -> bool:
+    # read1() does not close a length-delimited response that was read exactly
+    # to its end, so a zero remaining length also counts as fully consumed.
+    return not response.will_close and (
+        response.isclosed() or response.length == 0
+    )
+
+
+def _exchange(
+    target: _Target,
+    connected_socket: socket.socket,
+    deadline: float,
+    reused: bool = False,
+    cached: Optional[_CacheEntry] = None,
+) -> _Response:
+    if _ACTIVE_TRACE.get() is not None:
+        pool_key = _peer_pool_key(target, connected_socket)
+        _trace(
+            "connection",
+            address=None if pool_key is None else pool_key.address_text,
+            reused=reused,
+        )
     deadline_socket = _DeadlineSocket(connected_socket, deadline)
     connection = None
     response = None
+    reusable = False
+    handle = _ACTIVE_FETCH.get()
+    if handle is not None:
+        handle._attach(connected_socket)
     try:
+        _check_cancelled()
         connection = http.client.HTTPConnection(
             target.hostname,
             target.port,
@@ -549,52 +1763,98 @@ def _download_once(
             headers={
                 "Accept": "image/png, image/jpeg, image/webp, image/gif, image/bmp",
                 "Accept-Encoding": "identity",
-                "Connection": "close",
+                "Connection": "keep-alive",
                 "Host": target.host_header,
                 "User-Agent": "ImageWorkdesk",
+                **_conditional_headers(cached),
             },
         )
+        _trace("request.sent")
         _set_socket_timeout(deadline_socket, deadline, READ_TIMEOUT_SECONDS)
         response = connection.getresponse()
         _remaining_time(deadline)
+        _trace("response.headers", status=response.status)
 
         if response.status in _REDIRECT_STATUSES:
-            location = _single_header(response.headers, "Location")
-            if not location:
-                raise ImageDownloadError("The redirect response has no destination.")
-            if (
-                len(location) > MAX_URL_LENGTH
-                or location != location.strip()
-                or "\\" in location
-                or any(
-                    ord(character) < 32 or ord(character) == 127
-                    for character in location
-                )
-            ):
-                raise InvalidImageURL("Invalid redirect URL.")
-            return None, location, None
+            location = _redirect_location(response.headers)
+            reusable = (
+                not response.will_close
+                and _drain_response(response, deadline_socket, deadline)
+                and _response_allows_reuse(response)
+            )
+            return _Response(None, location, None)
+        if response.status == 304 and cached is not None:
+            policy = _cache_policy(response.headers)
+            reusable = (
+                not response.will_close
+                and _drain_response(response, deadline_socket, deadline)
+                and _response_allows_reuse(response)
+            )
+            return _Response(None, None, None, policy, not_modified=True)
         if response.status != 200:
             raise ImageDownloadError(
                 "The image server returned an unsuccessful response."
             )
 
+        policy = _cache_policy(response.headers)
         body, mime_type = _read_response_body(response, deadline_socket, deadline)
-        return body, None, mime_type
+        reusable = _response_allows_reuse(response)
+        return _Response(body, None, mime_type, policy)
     except ImageFetchError:
+        _check_cancelled()
         raise
     except (OSError, ssl.SSLError, http.client.HTTPException, ValueError) as exc:
+        _check_cancelled()
+        if reused and response is None and isinstance(exc, _STALE_CONNECTION_ERRORS):
+            raise _StaleConnection() from exc
+        if isinstance(exc, socket.timeout):
+            raise ImageTimeout("The image host did not respond in time.") from exc
+        if isinstance(exc, OSError) and not isinstance(exc, ssl.SSLError):
+            raise ImageConnectionError("The image request failed.") from exc
         raise ImageDownloadError("The image request failed.") from exc
     finally:
+        if handle is not None:
+            handle._detach()
+            reusable = reusable and not handle.cancelled
+        pool_key = _peer_pool_key(target, connected_socket) if reusable else None
         try:
             if response is not None:
                 response.close()
         finally:
-            if connection is not None:
+            if pool_key is not None and connection is not None:
+                connection.sock = None
+                connection.close()
+                _remember_tls_session(target.hostname, connected_socket)
+                _CONNECTION_POOL.release(pool_key, connected_socket)
+            elif connection is not None:
                 connection.close()
             else:
                 deadline_socket.close()
 
 
+def _download_once(
+    target: _Target, deadline: float, cached: Optional[_CacheEntry] = None
+) -> _Response:
+    endpoints = _resolve_public_endpoints(target, deadline)
+    _remaining_time(deadline)
+    pooled_socket = _CONNECTION_POOL.acquire(
+        [
+            _PoolKey(target.scheme, target.hostname, endpoint.address_text)
+            for endpoint in endpoints
+        ]
+    )
+    metrics.record_cache_lookup("connection_pool", pooled_socket is not None)
+    if pooled_socket is not None:
+        try:
+            return _exchange(
+                target, pooled_socket, deadline, reused=True, cached=cached
+            )
+        except _StaleConnection:
+            pass
+    connected_socket = _open_connected_socket(target, endpoints, deadline)
+    return _exchange(target, connected_socket, deadline, cached=cached)
+
+
 def _validate_dimensions(image: Image.Image) -> None:
     width, height = image.size
     if (
@@ -607,7 +1867,54 @@ def _validate_dimensions(image: Image.Image) -> None:
         raise ImageTooLarge("The decoded image is too large.")
 
 
-def _decode_image(body: bytes, mime_type: str) -> Image.Image:
+def _decode_image(
+    body: bytes, mime_type: str, max_side: Optional[int] = None
+) -> Image.Image:
+    with _DECODE_SECONDS.time():
+        if _DECODE_POOL is None:
+            return _decode_image_body(body, mime_type, max_side)
+        return _decode_isolated(_DECODE_POOL, body, mime_type, max_side)
+
+
+def _decode_pixels(
+    body: bytes, mime_type: str, max_side: Optional[int]
+) -> Tuple[np.ndarray, Optional[Tuple[int, int]]]:
+    """Worker-side decode for :data:`_DECODE_POOL`; pixels travel separately."""
+
+    image = _decode_image_body(body, mime_type, max_side)
+    return np.asarray(image), image.info.get("original_size")
+
+
+def _decode_isolated(
+    pool: decode_pool.IsolatedPool,
+    body: bytes,
+    mime_type: str,
+    max_side: Optional[int],
+) -> Image.Image:
+    try:
+        pixels, original_size = pool.run(body, mime_type, max_side)
+    except MemoryError as exc:
+        raise ImageTooLarge("The decoded image is too large.") from exc
+    except decode_pool.WorkerFailed as exc:
+        if exc.resource_exhausted:
+            raise ImageTooLarge("The image is too expensive to decode.") from exc
+        raise InvalidImageData("The response is not a valid image.") from exc
+    if pixels.ndim != 3 or pixels.shape[2] != 3 or pixels.dtype != np.uint8:
+        raise InvalidImageData("The response is not a valid image.")
+    image = Image.fromarray(pixels)
+    if original_size is not None:
+        image.info["original_size"] = tuple(original_size)
+    return image
+
+
+def _fit_within(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    scale = max_side / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _decode_image_body(
+    body: bytes, mime_type: str, max_side: Optional[int] = None
+) -> Image.Image:
     expected_format = _MIME_TO_FORMAT.get(mime_type)
     try:
         with warnings.catch_warnings():
@@ -630,11 +1937,31 @@ def _decode_image(body: bytes, mime_type: str) -> Image.Image:
                     raise InvalidImageData(
                         "The image type does not match its contents."
                     )
+                original_size = candidate.size
+                reduce = max_side is not None and max(original_size) > max_side
+                if reduce:
+                    # JPEG decoders scale by 1/2, 1/4 or 1/8 in the DCT, so a
+                    # reduced fetch never holds the full-resolution raster.
+                    candidate.draft("RGB", _fit_within(original_size, max_side))
                 candidate.load()
                 converted = candidate.convert("RGB")
                 converted.load()
+                if reduce and max(converted.size) > max_side:
+                    target_size = _fit_within(original_size, max_side)
+                    factor = min(
+                        converted.size[0] // target_size[0],
+                        converted.size[1] // target_size[1],
+                    )
+                    if factor >= 2:
+                        converted = converted.reduce(factor)
+                    if converted.size != target_size:
+                        converted = converted.resize(
+                            target_size, Image.Resampling.LANCZOS
+                        )
                 result = converted.copy()
                 result.info.clear()
+                if max_side is not None:
+                    result.info["original_size"] = original_size
                 return result
     except ImageFetchError:
         raise
@@ -654,29 +1981,701 @@ def _decode_image(body: bytes, mime_type: str) -> Image.Image:
         raise InvalidImageData("The response is not a valid image.") from exc
 
 
-def fetch_image_from_url(url: str) -> Image.Image:
-    """Fetch an HTTP(S) raster image after enforcing SSRF and resource limits."""
+_DECODE_POOL = decode_pool.IsolatedPool.from_environment(_decode_pixels)
+
+
+def _redirect_target(
+    target: _Target, redirect_location: str, redirect_count: int
+) -> _Target:
+    if redirect_count >= MAX_REDIRECTS:
+        raise ImageDownloadError("The image URL redirected too many times.")
+    try:
+        next_url = urljoin(target.normalized_url, redirect_location)
+    except (UnicodeError, ValueError) as exc:
+        raise InvalidImageURL("Invalid redirect URL.") from exc
+    next_target = _parse_target(next_url)
+    if target.scheme == "https" and next_target.scheme != "https":
+        raise UnsafeImageURL("HTTPS redirects may not downgrade to HTTP.")
+    return _parse_target(next_target.normalized_url)
+
+
+def _decode_traced(
+    body: bytes, mime_type: str, max_side: Optional[int] = None
+) -> Image.Image:
+    _trace("decode.start", bytes=len(body))
+    image = _decode_image(body, mime_type, max_side)
+    _trace("decode.end", width=image.size[0], height=image.size[1])
+    return image
+
+
+def _disk_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _load_disk_entry(key: str) -> Optional[_CacheEntry]:
+    """Restore a cached response persisted by an earlier process."""
+
+    cache = disk_cache.shared_disk_cache()
+    if cache is None:
+        return None
+    index = cache.get("responses", _disk_key(key))
+    if index is None:
+        return None
+    try:
+        digest = str(index.metadata["digest"])
+        mime_type = str(index.metadata["mime_type"])
+        expires_at = float(index.metadata["expires_at"])
+        etag = index.metadata.get("etag")
+        last_modified = index.metadata.get("last_modified")
+        stored = cache.get("bodies", digest)
+    except (KeyError, TypeError, ValueError):
+        return None
+    if stored is None or stored.array.dtype != np.uint8 or stored.array.ndim != 1:
+        return None
+    body = stored.array.tobytes()
+    if hashlib.sha256(body).hexdigest() != digest:
+        return None
+    policy = _CachePolicy(
+        True, max(0.0, expires_at - time.time()), etag, last_modified
+    )
+    return _RESPONSE_CACHE.put(key, body, mime_type, policy)
+
+
+def _persist_entry(key: str, entry: Optional[_CacheEntry]) -> None:
+    cache = disk_cache.shared_disk_cache()
+    if cache is None:
+        return
+    if entry is None:
+        cache.discard("responses", _disk_key(key))
+        return
+    if not cache.contains("bodies", entry.digest):
+        cache.put("bodies", entry.digest, np.frombuffer(entry.body, dtype=np.uint8))
+    cache.put(
+        "responses",
+        _disk_key(key),
+        np.empty(0, dtype=np.uint8),
+        {
+            "digest": entry.digest,
+            "mime_type": entry.mime_type,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+            "expires_at": time.time() + entry.fresh_until - time.monotonic(),
+        },
+    )
 
-    deadline = time.monotonic() + TOTAL_TIMEOUT_SECONDS
-    current_url = url
 
+def _fresh_cache_entry(target: _Target) -> Tuple[bool, Optional[_CacheEntry]]:
+    cached = _RESPONSE_CACHE.get(target.normalized_url)
+    if cached is None:
+        cached = _load_disk_entry(target.normalized_url)
+    fresh = cached is not None and cached.fresh_until > time.monotonic()
+    metrics.record_cache_lookup("response", fresh)
+    return fresh, cached
+
+
+def _decoded_disk_key(digest: str, max_side: Optional[int]) -> str:
+    if max_side is None:
+        return digest
+    return _disk_key("{}:{}".format(digest, max_side))
+
+
+def _restore_decoded(stored: Any, max_side: Optional[int]) -> Optional[Image.Image]:
+    if (
+        stored is None
+        or stored.array.dtype != np.uint8
+        or stored.array.ndim != 3
+        or stored.array.shape[2] != 3
+    ):
+        return None
+    image = Image.fromarray(stored.array)
+    if max_side is not None:
+        original_size = stored.metadata.get("original_size")
+        if not isinstance(original_size, list) or len(original_size) != 2:
+            return None
+        image.info["original_size"] = tuple(original_size)
+    return image
+
+
+def _image_from_entry(
+    entry: _CacheEntry, max_side: Optional[int] = None
+) -> Image.Image:
+    """Return the shared decoded image for a cache entry; callers must copy it."""
+
+    image = _RESPONSE_CACHE.decoded(entry.digest, max_side)
+    metrics.record_cache_lookup("decoded_image", image is not None)
+    if image is not None:
+        return image
+    cache = disk_cache.shared_disk_cache()
+    disk_key = _decoded_disk_key(entry.digest, max_side)
+    image = _restore_decoded(
+        None if cache is None else cache.get("decoded", disk_key), max_side
+    )
+    if image is None:
+        image = _decode_traced(entry.body, entry.mime_type, max_side)
+        if cache is not None:
+            metadata = {}
+            if "original_size" in image.info:
+                metadata["original_size"] = list(image.info["original_size"])
+            cache.put("decoded", disk_key, np.asarray(image), metadata)
+    _RESPONSE_CACHE.remember_decoded(entry.digest, image, max_side)
+    return image
+
+
+def _image_from_response(
+    target: _Target,
+    response: _Response,
+    cached: Optional[_CacheEntry],
+    max_side: Optional[int] = None,
+) -> Image.Image:
+    """Decode a final response, storing or refreshing its cache entry first."""
+
+    policy = response.cache_policy or _CachePolicy(False, 0.0, None, None)
+    if response.not_modified:
+        if cached is None:
+            raise ImageDownloadError("The image response is incomplete.")
+        _trace("cache.revalidated")
+        refreshed = _RESPONSE_CACHE.refresh(target.normalized_url, cached, policy)
+        _persist_entry(target.normalized_url, refreshed if policy.storable else None)
+        return _image_from_entry(refreshed, max_side)
+    if response.body is None or response.mime_type is None:
+        raise ImageDownloadError("The image response is incomplete.")
+    _check_cancelled()
+    entry = _RESPONSE_CACHE.put(
+        target.normalized_url, response.body, response.mime_type, policy
+    )
+    _persist_entry(target.normalized_url, entry)
+    if entry is None:
+        return _decode_traced(response.body, response.mime_type, max_side)
+    return _image_from_entry(entry, max_side)
+
+
+def _fetch_target(
+    target: _Target, deadline: float, max_side: Optional[int] = None
+) -> Image.Image:
+    _NEGATIVE_CACHE.check(target.normalized_url)
+    try:
+        return _follow_redirects(target, deadline, max_side)
+    except _DETERMINISTIC_ERRORS as exc:
+        _NEGATIVE_CACHE.remember(target.normalized_url, exc)
+        raise
+
+
+def _follow_redirects(
+    target: _Target, deadline: float, max_side: Optional[int] = None
+) -> Image.Image:
     for redirect_count in range(MAX_REDIRECTS + 1):
-        target = _parse_target(current_url)
-        body, redirect_location, mime_type = _download_once(target, deadline)
-        if redirect_location is None:
-            if body is None or mime_type is None:
-                raise ImageDownloadError("The image response is incomplete.")
-            return _decode_image(body, mime_type)
-
-        if redirect_count >= MAX_REDIRECTS:
-            raise ImageDownloadError("The image URL redirected too many times.")
+        fresh, cached = _fresh_cache_entry(target)
+        if fresh and cached is not None:
+            _trace("cache.hit", bytes=len(cached.body))
+            return _image_from_entry(cached, max_side)
+        _check_cancelled()
+        with _CIRCUITS.guard(target.hostname):
+            response = _download_once(target, deadline, cached)
+        if response.redirect_location is None:
+            return _image_from_response(target, response, cached, max_side)
+        _trace("redirect", location=response.redirect_location)
+        target = _redirect_target(
+            target, response.redirect_location, redirect_count
+        )
+
+    raise ImageDownloadError("The image URL redirected too many times.")
+
+
+def _fetch_outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, (asyncio.CancelledError, FutureCancelled, FetchCancelled)):
+        return "cancelled"
+    if isinstance(error, ImageFetchError):
+        return type(error).__name__
+    return "unexpected"
+
+
+def _record_fetch(started: float, error: Optional[BaseException]) -> None:
+    outcome = _fetch_outcome(error)
+    _FETCHES.inc(outcome=outcome)
+    _FETCH_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+
+def _check_max_side(max_side: Optional[int]) -> None:
+    if max_side is not None and (
+        not isinstance(max_side, int) or isinstance(max_side, bool) or max_side < 1
+    ):
+        raise ValueError("max_side must be a positive integer.")
+
+
+def decode_image_bytes(body: bytes, mime_type: str = "") -> Image.Image:
+    """Decode untrusted image bytes to RGB with the limits of fetched images.
+
+    ``mime_type``, when known, must match the image's format. Raises
+    :class:`ImageTooLarge` or :class:`InvalidImageData`.
+    """
+
+    if len(body) > MAX_DOWNLOAD_BYTES:
+        raise ImageTooLarge("The image is larger than the download limit.")
+    return _decode_image(body, mime_type)
+
+
+def fetch_image_from_url(
+    url: str, trace: Optional[FetchTrace] = None, max_side: Optional[int] = None
+) -> Image.Image:
+    """Fetch an HTTP(S) raster image after enforcing SSRF and resource limits.
+
+    Concurrent calls for the same normalized URL share one download and decode;
+    every caller receives its own copy of the image. Responses that HTTP
+    caching rules allow a shared cache to keep are reused across sessions and
+    revalidated with a conditional request once stale. URLs that recently
+    failed with :class:`InvalidImageData` or :class:`ImageTooLarge` fail again
+    without a request, and hosts with repeated connection failures are skipped
+    with :class:`ImageHostUnavailable` until a probe succeeds. Pass a
+    :class:`FetchTrace` to record when each network and decode phase ran.
+
+    With ``max_side``, the image is scaled down during decoding so that neither
+    side exceeds it; JPEGs are decoded directly at a reduced scale. The result
+    then carries its full dimensions in ``info["original_size"]``. Size limits
+    still apply to the original dimensions.
+    """
+
+    _check_max_side(max_side)
+    token = _ACTIVE_TRACE.set(trace)
+    started = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        _trace("fetch.start", url=url)
+        deadline = time.monotonic() + TOTAL_TIMEOUT_SECONDS
+        target = _parse_target(url)
+        flight_key: Any = target.normalized_url
+        if max_side is not None:
+            flight_key = (flight_key, max_side)
+        image = _FETCH_FLIGHTS.do(
+            flight_key,
+            lambda: _fetch_target(target, deadline, max_side),
+            deadline,
+        )
+        return image.copy()
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _ACTIVE_TRACE.reset(token)
+        _record_fetch(started, error)
+        if trace is not None:
+            trace.finish(error)
+
+
+def fetch_images_from_urls(
+    urls: Iterable[str],
+    max_workers: int = BATCH_MAX_WORKERS,
+    max_per_host: int = BATCH_MAX_PER_HOST,
+    max_side: Optional[int] = None,
+) -> Iterator[BatchFetchResult]:
+    """Fetch several images in parallel and yield each result as it completes.
+
+    At most ``max_workers`` downloads run at once and at most ``max_per_host``
+    of them target one hostname. Hosts take turns, so one host with many URLs
+    cannot starve the others. Failures are yielded, not raised. ``max_side``
+    is passed on to :func:`fetch_image_from_url`.
+
+    Called from a :func:`run_in_background` operation, cancelling its handle
+    stops the downloads in flight and raises :class:`FetchCancelled`.
+    """
+
+    _check_max_side(max_side)
+    options = {} if max_side is None else {"max_side": max_side}
+    parent = _ACTIVE_FETCH.get()
+    queues: "OrderedDict[str, Deque[Tuple[int, str]]]" = OrderedDict()
+    for index, url in enumerate(urls):
+        try:
+            hostname = _parse_target(url).hostname
+        except ImageFetchError as exc:
+            yield BatchFetchResult(index, url, None, exc)
+            continue
+        queues.setdefault(hostname, deque()).append((index, url))
+
+    in_flight: Dict["Future[Image.Image]", Tuple[int, str, str]] = {}
+    host_load: Dict[str, int] = {}
+    try:
+        while queues or in_flight:
+            dispatched = True
+            while dispatched and len(in_flight) < max_workers:
+                dispatched = False
+                for hostname in list(queues):
+                    if len(in_flight) >= max_workers:
+                        break
+                    if host_load.get(hostname, 0) >= max_per_host:
+                        continue
+                    index, url = queues[hostname].popleft()
+                    if queues[hostname]:
+                        queues.move_to_end(hostname)
+                    else:
+                        del queues[hostname]
+                    fetch = functools.partial(fetch_image_from_url, url, **options)
+                    if parent is not None:
+                        fetch = functools.partial(parent._run_child, fetch)
+                    future = _BATCH_EXECUTOR.submit(fetch)
+                    in_flight[future] = (index, url, hostname)
+                    host_load[hostname] = host_load.get(hostname, 0) + 1
+                    dispatched = True
+
+            done, _pending = wait_for_futures(in_flight, return_when=FIRST_COMPLETED)
+            _check_cancelled()
+            for future in done:
+                index, url, hostname = in_flight.pop(future)
+                host_load[hostname] -= 1
+                try:
+                    image = future.result()
+                except ImageFetchError as exc:
+                    yield BatchFetchResult(index, url, None, exc)
+                except Exception as exc:
+                    error = ImageDownloadError("The image request failed.")
+                    error.__cause__ = exc
+                    yield BatchFetchResult(index, url, None, error)
+                else:
+                    yield BatchFetchResult(index, url, image, None)
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+class _AsyncLimits:
+    """Concurrency limits for asynchronous fetches on one event loop."""
+
+    def __init__(self) -> None:
+        self.fetches = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_FETCHES)
+        self._hosts: Dict[str, List[Any]] = {}
+
+    @contextlib.asynccontextmanager
+    async def host(self, hostname: str, deadline: float) -> AsyncIterator[None]:
+        entry = self._hosts.get(hostname)
+        if entry is None:
+            entry = self._hosts[hostname] = [
+                asyncio.Semaphore(ASYNC_MAX_CONCURRENT_PER_HOST),
+                0,
+            ]
+        entry[1] += 1
         try:
-            next_url = urljoin(target.normalized_url, redirect_location)
-        except (UnicodeError, ValueError) as exc:
-            raise InvalidImageURL("Invalid redirect URL.") from exc
-        next_target = _parse_target(next_url)
-        if target.scheme == "https" and next_target.scheme != "https":
-            raise UnsafeImageURL("HTTPS redirects may not downgrade to HTTP.")
-        current_url = next_target.normalized_url
+            async with _acquire_within(entry[0], deadline):
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[hostname]
+
+
+_ASYNC_LIMITS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncLimits]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _async_limits() -> _AsyncLimits:
+    loop = asyncio.get_running_loop()
+    limits = _ASYNC_LIMITS.get(loop)
+    if limits is None:
+        limits = _ASYNC_LIMITS[loop] = _AsyncLimits()
+    return limits
+
+
+@contextlib.asynccontextmanager
+async def _acquire_within(
+    semaphore: asyncio.Semaphore, deadline: float
+) -> AsyncIterator[None]:
+    acquire = asyncio.ensure_future(semaphore.acquire())
+    try:
+        await asyncio.wait_for(asyncio.shield(acquire), _remaining_time(deadline))
+    except BaseException as exc:
+        if acquire.done() and not acquire.cancelled():
+            semaphore.release()
+        else:
+            acquire.cancel()
+        if isinstance(exc, asyncio.TimeoutError):
+            raise ImageTimeout("The image request timed out.") from exc
+        raise
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+async def _within(awaitable: Awaitable[_T], deadline: float, cap: float) -> _T:
+    try:
+        timeout = min(cap, _remaining_time(deadline))
+    except ImageDownloadError:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif asyncio.isfuture(awaitable):
+            awaitable.cancel()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as exc:
+        _remaining_time(deadline)
+        raise socket.timeout("timed out") from exc
+
+
+async def _resolve_public_endpoints_async(
+    target: _Target, deadline: float
+) -> Tuple[_Endpoint, ...]:
+    try:
+        answers = await _within(
+            asyncio.wrap_future(_start_lookup(target)), deadline, DNS_TIMEOUT_SECONDS
+        )
+    except socket.timeout as exc:
+        raise ImageTimeout("The image host lookup timed out.") from exc
+    except dns_resolver.ResolverSaturated as exc:
+        raise FetchOverloaded("Too many image host lookups are pending.") from exc
+    except (OSError, RuntimeError, UnicodeError) as exc:
+        raise ImageDownloadError("The image host could not be resolved.") from exc
+    _remaining_time(deadline)
+    return _validated_endpoints(target, answers)
+
+
+async def _connect_endpoint_async(
+    target: _Target, endpoint: _Endpoint, deadline: float
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    loop = asyncio.get_running_loop()
+    connected_socket = socket.socket(
+        endpoint.family, endpoint.socket_type, endpoint.protocol
+    )
+    try:
+        connected_socket.setblocking(False)
+        await _within(
+            loop.sock_connect(connected_socket, endpoint.socket_address),
+            deadline,
+            CONNECT_TIMEOUT_SECONDS,
+        )
+        _verify_peer(target, endpoint, connected_socket.getpeername())
+        tls_options: Dict[str, Any] = {}
+        if target.scheme == "https":
+            tls_options = {"ssl": _sni_context(), "server_hostname": target.hostname}
+        return await _within(
+            asyncio.open_connection(
+                sock=connected_socket, limit=MAX_RESPONSE_HEAD_BYTES, **tls_options
+            ),
+            deadline,
+            CONNECT_TIMEOUT_SECONDS,
+        )
+    except BaseException:
+        connected_socket.close()
+        raise
+
+
+async def _open_connection_async(
+    target: _Target, endpoints: Tuple[_Endpoint, ...], deadline: float
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    last_error: Optional[BaseException] = None
+    for endpoint in _interleave_endpoints(endpoints):
+        try:
+            return await _connect_endpoint_async(target, endpoint, deadline)
+        except UnsafeImageURL:
+            raise
+        except (OSError, ssl.SSLError) as exc:
+            last_error = exc
+    raise ImageConnectionError("The image host could not be reached.") from last_error
+
+
+async def _read_response_head_async(
+    reader: asyncio.StreamReader, deadline: float
+) -> Tuple[int, Any]:
+    while True:
+        head = await _within(
+            reader.readuntil(b"\r\n\r\n"), deadline, READ_TIMEOUT_SECONDS
+        )
+        status_line, _separator, header_block = head.partition(b"\r\n")
+        version, _space, rest = status_line.decode("latin-1").partition(" ")
+        status_text = rest[:3]
+        if (
+            version not in {"HTTP/1.0", "HTTP/1.1"}
+            or len(status_text) != 3
+            or not status_text.isdigit()
+        ):
+            raise ImageDownloadError("The image server sent an invalid response.")
+        status = int(status_text)
+        if 100 <= status < 200 and status != 101:
+            continue
+        return status, http.client.parse_headers(BytesIO(header_block))
+
+
+async def _read_body_async(
+    reader: asyncio.StreamReader,
+    deadline: float,
+    declared_length: Optional[int],
+    chunked: bool,
+) -> bytes:
+    body = bytearray()
+
+    async def read(amount: int) -> bytes:
+        return await _within(reader.read(amount), deadline, READ_TIMEOUT_SECONDS)
+
+    if chunked:
+        while True:
+            size_line = await _within(
+                reader.readuntil(b"\r\n"), deadline, READ_TIMEOUT_SECONDS
+            )
+            size_text = size_line.split(b";", 1)[0].strip()
+            try:
+                chunk_left = int(size_text, 16)
+            except ValueError as exc:
+                raise ImageDownloadError("The response body is invalid.") from exc
+            if chunk_left < 0:
+                raise ImageDownloadError("The response body is invalid.")
+            if chunk_left == 0:
+                while await _within(
+                    reader.readuntil(b"\r\n"), deadline, READ_TIMEOUT_SECONDS
+                ) != b"\r\n":
+                    pass
+                break
+            if len(body) + chunk_left > MAX_DOWNLOAD_BYTES:
+                raise ImageTooLarge("The image download is too large.")
+            while chunk_left:
+                chunk = await read(min(READ_CHUNK_BYTES, chunk_left))
+                if not chunk:
+                    raise ImageDownloadError("The response body is incomplete.")
+                _append_body_chunk(body, chunk)
+                chunk_left -= len(chunk)
+            if await _within(
+                reader.readexactly(2), deadline, READ_TIMEOUT_SECONDS
+            ) != b"\r\n":
+                raise ImageDownloadError("The response body is invalid.")
+    else:
+        while declared_length is None or len(body) < declared_length:
+            amount = READ_CHUNK_BYTES
+            if declared_length is not None:
+                amount = min(amount, declared_length - len(body))
+            chunk = await read(amount)
+            if not chunk:
+                break
+            _append_body_chunk(body, chunk)
+
+    return _finish_body(body, declared_length)
+
+
+async def _download_once_async(
+    target: _Target, deadline: float, cached: Optional[_CacheEntry] = None
+) -> _Response:
+    endpoints = await _resolve_public_endpoints_async(target, deadline)
+    _remaining_time(deadline)
+    reader, writer = await _open_connection_async(target, endpoints, deadline)
+    try:
+        request = (
+            "GET {} HTTP/1.1\r\n"
+            "Host: {}\r\n"
+            "Accept: image/png, image/jpeg, image/webp, image/gif, image/bmp\r\n"
+            "Accept-Encoding: identity\r\n"
+            "Connection: close\r\n"
+            "User-Agent: ImageWorkdesk\r\n"
+            "{}"
+            "\r\n"
+        ).format(
+            target.request_target,
+            target.host_header,
+            "".join(
+                "{}: {}\r\n".format(name, value)
+                for name, value in _conditional_headers(cached).items()
+            ),
+        )
+        writer.write(request.encode("ascii"))
+        await _within(writer.drain(), deadline, READ_TIMEOUT_SECONDS)
+        status, headers = await _read_response_head_async(reader, deadline)
+        _remaining_time(deadline)
+
+        if status in _REDIRECT_STATUSES:
+            return _Response(None, _redirect_location(headers), None)
+        if status == 304 and cached is not None:
+            return _Response(
+                None, None, None, _cache_policy(headers), not_modified=True
+            )
+        if status != 200:
+            raise ImageDownloadError(
+                "The image server returned an unsuccessful response."
+            )
+
+        policy = _cache_policy(headers)
+        mime_type, declared_length, chunked = _body_framing(headers)
+        body = await _read_body_async(reader, deadline, declared_length, chunked)
+        return _Response(body, None, mime_type, policy)
+    except ImageFetchError:
+        raise
+    except (
+        OSError,
+        ssl.SSLError,
+        asyncio.IncompleteReadError,
+        asyncio.LimitOverrunError,
+        http.client.HTTPException,
+        UnicodeError,
+        ValueError,
+    ) as exc:
+        if isinstance(exc, socket.timeout):
+            raise ImageTimeout("The image host did not respond in time.") from exc
+        if isinstance(exc, OSError) and not isinstance(exc, ssl.SSLError):
+            raise ImageConnectionError("The image request failed.") from exc
+        raise ImageDownloadError("The image request failed.") from exc
+    finally:
+        writer.close()
+
+
+async def fetch_image_from_url_async(
+    url: str, max_side: Optional[int] = None
+) -> Image.Image:
+    """Asyncio counterpart of :func:`fetch_image_from_url`.
+
+    Every hop goes through the same URL, address, peer, TLS, deadline, size and
+    redirect checks. At most ``ASYNC_MAX_CONCURRENT_FETCHES`` fetches run at
+    once per event loop, and at most ``ASYNC_MAX_CONCURRENT_PER_HOST`` of them
+    talk to one hostname. Decoding runs in the loop's default executor.
+    ``max_side`` works as in :func:`fetch_image_from_url`.
+    """
+
+    _check_max_side(max_side)
+    started = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        return await _fetch_target_async(url, max_side)
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _record_fetch(started, error)
+
+
+async def _fetch_target_async(
+    url: str, max_side: Optional[int] = None
+) -> Image.Image:
+    target = _parse_target(url)
+    _NEGATIVE_CACHE.check(target.normalized_url)
+    try:
+        return await _follow_redirects_async(target, max_side)
+    except _DETERMINISTIC_ERRORS as exc:
+        _NEGATIVE_CACHE.remember(target.normalized_url, exc)
+        raise
+
+
+async def _follow_redirects_async(
+    target: _Target, max_side: Optional[int] = None
+) -> Image.Image:
+    deadline = time.monotonic() + TOTAL_TIMEOUT_SECONDS
+    limits = _async_limits()
+
+    async with _acquire_within(limits.fetches, deadline):
+        loop = asyncio.get_running_loop()
+        for redirect_count in range(MAX_REDIRECTS + 1):
+            fresh, cached = await loop.run_in_executor(
+                None, _fresh_cache_entry, target
+            )
+            if fresh and cached is not None:
+                image = await loop.run_in_executor(
+                    None, _image_from_entry, cached, max_side
+                )
+                return image.copy()
+            async with limits.host(target.hostname, deadline):
+                with _CIRCUITS.guard(target.hostname):
+                    response = await _download_once_async(target, deadline, cached)
+            if response.redirect_location is None:
+                image = await loop.run_in_executor(
+                    None, _image_from_response, target, response, cached, max_side
+                )
+                return image.copy()
+            target = _redirect_target(
+                target, response.redirect_location, redirect_count
+            )
 
     raise ImageDownloadError("The image URL redirected too many times.")
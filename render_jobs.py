@@ -0,0 +1,167 @@
+"""Full-resolution renders on a background worker pool.
+
+The interactive editing stages work on a downscaled preview. The final image
+and its PNG export are rendered at full resolution by a :class:`RenderQueue`,
+one per session, on a background lane of the shared pipeline executor (see
+:mod:`admission`):
+
+* A render starts only once its settings have been left alone for
+  ``DEBOUNCE_SECONDS``, so dragging a slider does not start a render for every
+  value it passes through.
+* Requesting a render with new settings cancels the previous job. A job that
+  has not started yet never runs; a running one stops at its next step.
+"""
+
+from concurrent.futures import CancelledError as FutureCancelled
+from concurrent.futures import Executor, Future
+import threading
+import time
+from typing import Hashable, List, NamedTuple, Optional
+import weakref
+
+from PIL import Image
+
+import admission
+import metrics
+from pipeline import EditSettings, encode_png, render_steps
+
+
+DEBOUNCE_SECONDS = 0.75
+
+_RENDERS = metrics.REGISTRY.counter(
+    "imageworkdesk_renders_total",
+    "Full-resolution render jobs by outcome (rendered, cancelled or failed).",
+    ["outcome"],
+)
+_RENDER_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_render_seconds",
+    "Time spent rendering and encoding full-resolution images.",
+)
+
+
+class RenderCancelled(Exception):
+    """The render was superseded by newer settings or its session ended."""
+
+
+class RenderResult(NamedTuple):
+    image: Image.Image
+    png: bytes
+
+
+class RenderJob:
+    """One pending or finished render of ``image`` with ``settings``."""
+
+    def __init__(self, key: Hashable) -> None:
+        self.key = key
+        self._future: "Future[RenderResult]" = Future()
+        self._cancelled = threading.Event()
+        self._timer: Optional[threading.Timer] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    def result(self, timeout: Optional[float] = None) -> RenderResult:
+        try:
+            return self._future.result(timeout)
+        except FutureCancelled:
+            raise RenderCancelled("The render was cancelled.") from None
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        if self._timer is not None:
+            self._timer.cancel()
+        if self._future.cancel():
+            _RENDERS.inc(outcome="cancelled")
+
+
+def _render(job: RenderJob, image: Image.Image, settings: EditSettings) -> None:
+    if not job._future.set_running_or_notify_cancel():
+        return
+    started = time.perf_counter()
+    try:
+        for rendered in render_steps(image, settings):
+            if job.cancelled:
+                raise RenderCancelled("The render was cancelled.")
+        result = RenderResult(rendered, encode_png(rendered))
+    except RenderCancelled as exc:
+        _RENDERS.inc(outcome="cancelled")
+        job._future.set_exception(exc)
+    except Exception as exc:
+        _RENDERS.inc(outcome="failed")
+        job._future.set_exception(exc)
+    else:
+        _RENDERS.inc(outcome="rendered")
+        _RENDER_SECONDS.observe(time.perf_counter() - started)
+        job._future.set_result(result)
+
+
+def _start(
+    executor: Executor,
+    job: RenderJob,
+    image: Image.Image,
+    settings: EditSettings,
+) -> None:
+    if not job.cancelled:
+        executor.submit(_render, job, image, settings)
+
+
+def _cancel_pending(pending: List[RenderJob]) -> None:
+    for job in pending:
+        job.cancel()
+
+
+class RenderQueue:
+    """The latest render requested by one session.
+
+    Renders run on ``executor``, by default a background lane of the shared
+    pipeline executor. Jobs left pending when the queue is garbage-collected
+    are cancelled.
+    """
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        debounce: float = DEBOUNCE_SECONDS,
+    ) -> None:
+        self._executor = (
+            admission.shared_executor().lane(background=True)
+            if executor is None
+            else executor
+        )
+        self._debounce = debounce
+        self._lock = threading.Lock()
+        # A list rather than an attribute holding the job, so the finalizer
+        # can cancel it without keeping the queue alive.
+        self._current: List[RenderJob] = []
+        weakref.finalize(self, _cancel_pending, self._current)
+
+    def request(
+        self, key: Hashable, image: Image.Image, settings: EditSettings
+    ) -> RenderJob:
+        """Return the job for ``key``, superseding the previous one if it differs.
+
+        ``key`` must identify ``image`` and ``settings``; a request with the
+        same key as the current job returns that job unchanged.
+        """
+
+        with self._lock:
+            if self._current and self._current[0].key == key:
+                return self._current[0]
+            _cancel_pending(self._current)
+            job = RenderJob(key)
+            job._timer = threading.Timer(
+                self._debounce, _start, (self._executor, job, image, settings)
+            )
+            job._timer.daemon = True
+            self._current[:] = [job]
+        job._timer.start()
+        return job
+
+    def cancel(self) -> None:
+        with self._lock:
+            _cancel_pending(self._current)
+            del self._current[:]
@@ -0,0 +1,587 @@
+"""HTTP service that applies WorkDesk edits without the Streamlit UI.
+
+Run from the repository root::
+
+    python service.py [--host HOST] [--port PORT]
+
+``POST /process`` with an image as the request body, or with an empty body
+and a ``url`` query parameter to fetch the image with
+:func:`remote_image.fetch_image_from_url`, answers with the edited image as
+PNG. The edits are given as query parameters:
+
+``remove_bg``, ``mirror``
+    ``1`` to remove the background or mirror the image.
+``tone``
+    ``grayscale`` or ``bw`` (black and white).
+``rotate``
+    Degrees to rotate the image clockwise, from 0 to 360.
+``brightness``, ``saturation``, ``contrast``, ``sharpness``
+    Percentages from 0 to 1000; 100 leaves the image unchanged.
+``crop``
+    ``left,top,right,bottom`` as fractions of the image's width and height.
+``timeout``
+    Seconds the client is prepared to wait, up to 120 (30 by default).
+
+Jobs wait in a bounded queue for a fixed pool of worker threads. When the
+queue is full, the service answers ``429 Too Many Requests`` at once instead
+of queueing more work. A job whose deadline passes, while queued or between
+two editing steps, is abandoned and answered with ``504 Gateway Timeout``.
+The PNG is encoded straight into a chunked response, so the first bytes are
+sent before the image is fully encoded.
+
+``GET /healthz`` reports the queue and ``GET /metrics`` serves the process's
+Prometheus metrics. ``IMAGE_WORKDESK_SERVICE_WORKERS`` and
+``IMAGE_WORKDESK_SERVICE_QUEUE`` set the number of workers (by default one
+per core, up to four) and of jobs allowed to wait for one (16).
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Deque, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs
+import weakref
+
+from PIL import Image
+
+from batch import BatchRecipe, apply_crop
+import metrics
+from pipeline import EditSettings, render_steps
+from remote_image import (
+    BackgroundFetch,
+    FetchCancelled,
+    FetchOverloaded,
+    ImageDownloadError,
+    ImageFetchError,
+    ImageTimeout,
+    ImageTooLarge,
+    InvalidImageData,
+    InvalidImageURL,
+    MAX_DOWNLOAD_BYTES,
+    UnsafeImageURL,
+    cancellable_fetches,
+    decode_image_bytes,
+    fetch_image_from_url,
+)
+
+
+SERVICE_WORKERS_ENV = "IMAGE_WORKDESK_SERVICE_WORKERS"
+SERVICE_QUEUE_ENV = "IMAGE_WORKDESK_SERVICE_QUEUE"
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_QUEUE = 16
+DEFAULT_PORT = 8510
+DEFAULT_TIMEOUT_SECONDS = 30.0
+MAX_TIMEOUT_SECONDS = 120.0
+RETRY_AFTER_SECONDS = 1
+KEEP_ALIVE_SECONDS = 30.0
+STREAM_CHUNK_BYTES = 64 * 1024
+MAX_UPLOAD_BYTES = MAX_DOWNLOAD_BYTES
+
+_TONES = {"grayscale": "Grayscale", "bw": "Black & White"}
+_ENHANCEMENTS = ("brightness", "saturation", "contrast", "sharpness")
+_PARAMETERS = frozenset(
+    ("remove_bg", "mirror", "tone", "rotate", "crop", "url", "timeout")
+    + _ENHANCEMENTS
+)
+_ERROR_STATUSES = (
+    (FetchCancelled, 504),
+    (InvalidImageURL, 400),
+    (UnsafeImageURL, 400),
+    (ImageTooLarge, 413),
+    (InvalidImageData, 422),
+    (ImageTimeout, 504),
+    (FetchOverloaded, 503),
+    (ImageDownloadError, 502),
+    (ImageFetchError, 502),
+)
+
+_REQUESTS = metrics.REGISTRY.counter(
+    "imageworkdesk_service_requests_total",
+    "Processing requests answered by the HTTP service, by status code.",
+    ["status"],
+)
+_REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_service_request_seconds",
+    "Time from reading a processing request to the end of its response.",
+)
+_QUEUE_WAIT_SECONDS = metrics.REGISTRY.histogram(
+    "imageworkdesk_service_queue_wait_seconds",
+    "Time processing jobs waited in the queue for a worker.",
+)
+_QUEUE_DEPTH = metrics.REGISTRY.gauge(
+    "imageworkdesk_service_queue_depth", "Processing jobs waiting for a worker."
+)
+_BUSY_WORKERS = metrics.REGISTRY.gauge(
+    "imageworkdesk_service_busy_workers", "Service workers running a job."
+)
+
+
+class ServiceSaturated(RuntimeError):
+    """The job queue is full; the job was not queued."""
+
+
+class DeadlineExceeded(Exception):
+    """The job was abandoned because its deadline passed."""
+
+
+class ProcessRequest(NamedTuple):
+    recipe: BatchRecipe
+    url: Optional[str]
+    timeout: float
+
+
+class QueueStats(NamedTuple):
+    workers: int
+    busy: int
+    queued: int
+    max_queue: int
+
+
+def _flag(value: str, name: str) -> bool:
+    if value not in {"0", "1", "true", "false"}:
+        raise ValueError("{} must be 0 or 1.".format(name))
+    return value in {"1", "true"}
+
+
+def _integer(value: str, name: str, maximum: int) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if not 0 <= number <= maximum:
+        raise ValueError(
+            "{} must be a whole number from 0 to {}.".format(name, maximum)
+        )
+    return number
+
+
+def _crop(value: str) -> Tuple[float, float, float, float]:
+    try:
+        left, top, right, bottom = (float(part) for part in value.split(","))
+    except ValueError:
+        raise ValueError("crop must be four comma-separated fractions.") from None
+    if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+        raise ValueError("crop must select part of the image.")
+    return left, top, right, bottom
+
+
+def parse_query(query: str) -> ProcessRequest:
+    """Read a ``/process`` query string; raises ``ValueError`` if it is invalid."""
+
+    try:
+        values = parse_qs(query, strict_parsing=bool(query), max_num_fields=32)
+    except ValueError:
+        raise ValueError("The query string is malformed.") from None
+    unknown = sorted(set(values) - _PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown parameters: {}.".format(", ".join(unknown)))
+    repeated = sorted(name for name, given in values.items() if len(given) > 1)
+    if repeated:
+        raise ValueError("Repeated parameters: {}.".format(", ".join(repeated)))
+    params = {name: given[0] for name, given in values.items()}
+
+    tone = params.get("tone")
+    if tone is not None and tone not in _TONES:
+        raise ValueError("tone must be one of {}.".format(", ".join(sorted(_TONES))))
+    enhancements: Tuple[int, ...] = ()
+    if any(name in params for name in _ENHANCEMENTS):
+        enhancements = tuple(
+            _integer(params.get(name, "100"), name, 1000) for name in _ENHANCEMENTS
+        )
+    settings = EditSettings(
+        _flag(params.get("remove_bg", "0"), "remove_bg"),
+        _flag(params.get("mirror", "0"), "mirror"),
+        _TONES.get(tone or ""),
+        _integer(params.get("rotate", "0"), "rotate", 360),
+        enhancements,
+    )
+    crop = _crop(params["crop"]) if "crop" in params else None
+
+    timeout = DEFAULT_TIMEOUT_SECONDS
+    if "timeout" in params:
+        try:
+            timeout = float(params["timeout"])
+        except ValueError:
+            timeout = math.nan
+        if not 0 < timeout <= MAX_TIMEOUT_SECONDS:
+            raise ValueError(
+                "timeout must be a number of seconds up to {:g}.".format(
+                    MAX_TIMEOUT_SECONDS
+                )
+            )
+    return ProcessRequest(BatchRecipe(settings, crop), params.get("url"), timeout)
+
+
+class Job:
+    """A queued call that is abandoned once its deadline passes.
+
+    Fetches made under :attr:`fetches` are cancelled with the job, so an
+    abandoned job does not hold its worker until the fetch times out.
+    """
+
+    def __init__(self, function: Callable[["Job"], Any], deadline: float) -> None:
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        self.fetches = BackgroundFetch()
+        self._function = function
+        self._future: "Future[Any]" = Future()
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        """Raise :class:`DeadlineExceeded` if the job should stop."""
+
+        if self.cancelled or time.monotonic() >= self.deadline:
+            raise DeadlineExceeded("The request did not finish before its deadline.")
+
+    def result(self) -> Any:
+        """Wait for the result until the deadline, then abandon the job."""
+
+        try:
+            return self._future.result(max(0.0, self.deadline - time.monotonic()))
+        except FutureTimeout:
+            self.cancel()
+            raise DeadlineExceeded(
+                "The request did not finish before its deadline."
+            ) from None
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        self.fetches.cancel()
+
+    def _run(self) -> None:
+        if not self._future.set_running_or_notify_cancel():
+            return
+        try:
+            self.check()
+            result = self._function(self)
+        except BaseException as exc:
+            self._future.set_exception(exc)
+        else:
+            self._future.set_result(result)
+
+
+class JobQueue:
+    """Fixed pool of worker threads fed from a bounded queue.
+
+    :meth:`submit` raises :class:`ServiceSaturated` at once when ``max_queue``
+    jobs are already waiting. Jobs whose deadline passed while they waited
+    fail without running.
+    """
+
+    def __init__(self, workers: int, max_queue: int) -> None:
+        if workers < 1 or max_queue < 0:
+            raise ValueError("Invalid job queue size.")
+        self._workers = workers
+        self._max_queue = max_queue
+        self._condition = threading.Condition()
+        self._queue: Deque[Job] = deque()
+        self._busy = 0
+        self._shutdown = False
+        for number in range(workers):
+            threading.Thread(
+                target=self._work,
+                name="image-service-{}".format(number + 1),
+                daemon=True,
+            ).start()
+
+        queue = weakref.ref(self)
+
+        def stat(field: str) -> Callable[[], float]:
+            def read() -> float:
+                current = queue()
+                return 0.0 if current is None else getattr(current.stats(), field)
+
+            return read
+
+        _QUEUE_DEPTH.set_function(stat("queued"))
+        _BUSY_WORKERS.set_function(stat("busy"))
+
+    @classmethod
+    def from_environment(cls) -> "JobQueue":
+        workers = int(os.environ.get(SERVICE_WORKERS_ENV) or 0)
+        if workers <= 0:
+            workers = min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+        return cls(
+            workers=workers,
+            max_queue=int(os.environ.get(SERVICE_QUEUE_ENV, DEFAULT_MAX_QUEUE)),
+        )
+
+    def stats(self) -> QueueStats:
+        with self._condition:
+            return QueueStats(
+                self._workers, self._busy, len(self._queue), self._max_queue
+            )
+
+    def saturated(self) -> bool:
+        """Whether a job submitted now would be rejected."""
+
+        with self._condition:
+            return self._saturated_locked()
+
+    def _saturated_locked(self) -> bool:
+        idle = self._workers - self._busy - len(self._queue)
+        return idle <= 0 and len(self._queue) >= self._max_queue
+
+    def submit(self, function: Callable[[Job], Any], deadline: float) -> Job:
+        """Queue ``function(job)`` to run before ``deadline`` (monotonic time)."""
+
+        job = Job(function, deadline)
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("The job queue has been shut down.")
+            if self._saturated_locked():
+                raise ServiceSaturated("Too many processing requests are pending.")
+            self._queue.append(job)
+            self._condition.notify()
+        return job
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                self._busy += 1
+            _QUEUE_WAIT_SECONDS.observe(time.monotonic() - job.queued_at)
+            try:
+                job._run()
+            finally:
+                with self._condition:
+                    self._busy -= 1
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs; workers exit once the queued jobs have run."""
+
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+
+
+def process(
+    job: Job, request: ProcessRequest, body: bytes, mime_type: str
+) -> Image.Image:
+    """Load the request's image and apply its recipe, checking ``job`` as it goes."""
+
+    if request.url is None:
+        image = decode_image_bytes(body, mime_type)
+    else:
+        with cancellable_fetches(job.fetches):
+            image = fetch_image_from_url(request.url)
+    job.check()
+    image = apply_crop(image, request.recipe.crop)
+    for image in render_steps(image, request.recipe.settings):
+        job.check()
+    return image
+
+
+class _ChunkedWriter:
+    # Frames the PNG encoder's writes as HTTP/1.1 chunks, collecting small
+    # writes until a chunk is worth sending.
+    def __init__(self, output: Any) -> None:
+        self._output = output
+        self._buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= STREAM_CHUNK_BYTES:
+            self._send()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _send(self) -> None:
+        if self._buffer:
+            self._output.write(b"%X\r\n%s\r\n" % (len(self._buffer), self._buffer))
+            self._buffer.clear()
+
+    def close(self) -> None:
+        self._send()
+        self._output.write(b"0\r\n\r\n")
+        self._output.flush()
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEP_ALIVE_SECONDS
+    server: "_ServiceHTTPServer"
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path == "/healthz":
+            self._send_body(
+                200, "application/json", json.dumps(self.server.jobs.stats()._asdict())
+            )
+        elif path == "/metrics":
+            self._send_body(200, metrics.CONTENT_TYPE, metrics.REGISTRY.render())
+        else:
+            self._send_error(404, "Not found.", body_read=True)
+
+    def do_POST(self) -> None:
+        started = time.perf_counter()
+        status = self._process()
+        _REQUESTS.inc(status=status)
+        _REQUEST_SECONDS.observe(time.perf_counter() - started)
+
+    def _process(self) -> int:
+        path, _separator, query = self.path.partition("?")
+        if path != "/process":
+            return self._send_error(404, "Not found.")
+        try:
+            request = parse_query(query)
+        except ValueError as exc:
+            return self._send_error(400, str(exc))
+        if "Transfer-Encoding" in self.headers:
+            return self._send_error(411, "Send the image with a Content-Length.")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self._send_error(400, "The Content-Length is invalid.")
+        if length > MAX_UPLOAD_BYTES:
+            return self._send_error(413, "The image is larger than the upload limit.")
+        if (length > 0) == (request.url is not None):
+            return self._send_error(400, "Send either an image or a url.")
+        # Rejecting before the body is read keeps an overloaded service cheap
+        # to refuse; the connection is closed instead of draining the upload.
+        if self.server.jobs.saturated():
+            return self._send_error(429, "The service is busy; retry shortly.")
+
+        body = self.rfile.read(length)
+        mime_type = self.headers.get_content_type() if length else ""
+        if mime_type in {"application/octet-stream", "text/plain"}:
+            mime_type = ""  # The defaults when no image type was given.
+        try:
+            job = self.server.jobs.submit(
+                functools.partial(
+                    process, request=request, body=body, mime_type=mime_type
+                ),
+                time.monotonic() + request.timeout,
+            )
+        except ServiceSaturated:
+            return self._send_error(429, "The service is busy; retry shortly.", True)
+        try:
+            image = job.result()
+        except DeadlineExceeded as exc:
+            return self._send_error(504, str(exc), True)
+        except ImageFetchError as exc:
+            status = next(
+                status
+                for error, status in _ERROR_STATUSES
+                if isinstance(exc, error)
+            )
+            return self._send_error(status, str(exc), True)
+        except Exception:
+            traceback.print_exc()
+            return self._send_error(500, "The image could not be processed.", True)
+        return self._send_png(image)
+
+    def _send_png(self, image: Image.Image) -> int:
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            writer = _ChunkedWriter(self.wfile)
+            image.save(writer, format="PNG")
+            writer.close()
+        except OSError:
+            self.close_connection = True  # The client went away.
+        return 200
+
+    def _send_body(self, status: int, content_type: str, text: str) -> None:
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 503):
+            self.send_header("Retry-After", str(RETRY_AFTER_SECONDS))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, body_read: bool = False) -> int:
+        if not body_read:
+            self.close_connection = True
+        self._send_body(status, "application/json", json.dumps({"error": message}))
+        return status
+
+    def log_message(self, *_args: object) -> None:
+        return None
+
+
+class _ServiceHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Refused clients reconnect at once; a short listen backlog would leave
+    # their connection attempts waiting for a SYN retransmission.
+    request_queue_size = 128
+
+    def __init__(self, address: Tuple[str, int], jobs: JobQueue) -> None:
+        super().__init__(address, _ServiceHandler)
+        self.jobs = jobs
+
+
+class ProcessingService:
+    """The processing service running on a daemon thread."""
+
+    def __init__(
+        self,
+        jobs: Optional[JobQueue] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.jobs = JobQueue.from_environment() if jobs is None else jobs
+        self._server = _ServiceHTTPServer((host, port), self.jobs)
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.5},
+            name="image-service-http",
+            daemon=True,
+        )
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(self.host, self.port)
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self.jobs.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    server = _ServiceHTTPServer((args.host, args.port), JobQueue.from_environment())
+    print("Serving on http://{}:{}".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
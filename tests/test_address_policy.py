@@ -0,0 +1,148 @@
+import ipaddress
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import address_policy
+import remote_image
+from test_remote_image import PUBLIC_V4
+
+
+def ip(text):
+    return ipaddress.ip_address(text)
+
+
+class AddressPolicyTests(unittest.TestCase):
+    def test_longest_matching_prefix_wins(self):
+        policy = address_policy.AddressPolicy(
+            [
+                "deny 203.0.113.0/24",
+                "allow 203.0.113.128/25",
+                "deny 203.0.113.200",
+                "allow 2001:db8::/32",
+                "deny 2001:db8:bad::/48",
+            ]
+        )
+
+        self.assertEqual(len(policy), 5)
+        for address, expected in (
+            ("203.0.113.1", False),
+            ("203.0.113.129", True),
+            ("203.0.113.200", False),
+            ("198.51.100.1", None),
+            ("2001:db8:1::1", True),
+            ("2001:db8:bad::1", False),
+            ("2001:db9::1", None),
+        ):
+            with self.subTest(address=address):
+                self.assertIs(policy.decision(ip(address)), expected)
+
+    def test_deny_wins_when_a_prefix_is_both_allowed_and_denied(self):
+        for rules in (
+            ["allow 198.51.100.0/24", "deny 198.51.100.0/24"],
+            ["deny 198.51.100.0/24", "allow 198.51.100.0/24"],
+        ):
+            with self.subTest(rules=rules):
+                policy = address_policy.AddressPolicy(rules)
+                self.assertIs(policy.decision(ip("198.51.100.9")), False)
+
+    def test_compiled_lookups_match_a_linear_scan(self):
+        generator = random.Random(7)
+        rules = []
+        for _index in range(300):
+            length = generator.randint(20, 32)
+            base = (0xC0A80000 | generator.getrandbits(16)) >> (32 - length)
+            network = ipaddress.IPv4Network((base << (32 - length), length))
+            action = generator.choice(["allow", "deny"])
+            rules.append(address_policy.Rule(action, network))
+        policy = address_policy.AddressPolicy(rules)
+
+        def linear_scan(address):
+            matches = [rule for rule in rules if address in rule.network]
+            if not matches:
+                return None
+            longest = max(rule.network.prefixlen for rule in matches)
+            return all(
+                rule.action == "allow"
+                for rule in matches
+                if rule.network.prefixlen == longest
+            )
+
+        for _index in range(2_000):
+            address = ipaddress.IPv4Address(0xC0A80000 | generator.getrandbits(16))
+            self.assertIs(policy.decision(address), linear_scan(address), address)
+
+    def test_rules_are_read_from_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "policy.txt")
+            with open(path, "w", encoding="utf-8") as policy_file:
+                policy_file.write(
+                    "# partner ranges\n\nALLOW 10.20.0.0/16  # vpn\n198.51.100.7\n"
+                )
+            rules = address_policy.read_rules(path)
+
+            with open(path, "a", encoding="utf-8") as policy_file:
+                policy_file.write("block 192.0.2.0/24\n")
+            with self.assertRaisesRegex(ValueError, "policy.txt:5"):
+                address_policy.read_rules(path)
+
+        self.assertEqual(
+            rules,
+            [
+                address_policy.Rule("allow", ipaddress.ip_network("10.20.0.0/16")),
+                address_policy.Rule("deny", ipaddress.ip_network("198.51.100.7/32")),
+            ],
+        )
+
+    def test_environment_policy_extends_the_built_in_rules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "policy.txt")
+            with open(path, "w", encoding="utf-8") as policy_file:
+                policy_file.write("allow 169.254.0.0/16\n")
+            with patch.dict(os.environ, {address_policy.POLICY_FILE_ENV: path}):
+                policy = address_policy.AddressPolicy.from_environment()
+
+        self.assertIs(policy.decision(ip("169.254.1.1")), True)
+        self.assertIs(policy.decision(ip("169.254.169.254")), False)
+        self.assertIs(
+            address_policy.AddressPolicy.default().decision(ip("168.63.129.16")),
+            False,
+        )
+
+
+class PublicAddressPolicyTests(unittest.TestCase):
+    def use_policy(self, *rules):
+        policy = address_policy.AddressPolicy(
+            address_policy.DEFAULT_DENY + rules
+        )
+        active = patch("remote_image._ADDRESS_POLICY", policy)
+        active.start()
+        self.addCleanup(active.stop)
+
+    def test_denied_public_ranges_are_blocked_including_embedded_forms(self):
+        self.use_policy("deny 93.184.216.0/24")
+        for address in (
+            PUBLIC_V4,
+            "::ffff:93.184.216.34",
+            "2002:5db8:d822::1",
+            "2001:0:5db8:d822::f7f7:f7f7",
+        ):
+            with self.subTest(address=address):
+                self.assertFalse(remote_image._is_public_address(ip(address)))
+        self.assertTrue(remote_image._is_public_address(ip("93.184.217.1")))
+
+    def test_allowed_ranges_override_the_built_in_checks(self):
+        self.use_policy("allow 10.20.0.0/16", "allow 169.254.0.0/16")
+
+        self.assertTrue(remote_image._is_public_address(ip("10.20.3.4")))
+        self.assertFalse(remote_image._is_public_address(ip("10.21.3.4")))
+        self.assertFalse(remote_image._is_public_address(ip("169.254.169.254")))
+        self.assertFalse(
+            remote_image._is_public_address(ip("::ffff:169.254.169.254"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
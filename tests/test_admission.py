@@ -0,0 +1,152 @@
+from concurrent.futures import CancelledError
+import os
+import threading
+import unittest
+from unittest.mock import patch
+
+import admission
+from test_remote_image import wait_until
+
+
+class Gate:
+    """Tasks that record their start and block until released."""
+
+    def __init__(self, test):
+        self.started = []
+        self._lock = threading.Lock()
+        self._release = threading.Event()
+        test.addCleanup(self._release.set)
+
+    def task(self, name):
+        def run():
+            with self._lock:
+                self.started.append(name)
+            self._release.wait(5)
+            return name
+
+        return run
+
+    def release(self):
+        self._release.set()
+
+
+class FairExecutorTests(unittest.TestCase):
+    def test_a_lane_runs_one_task_and_replaces_the_waiting_one(self):
+        gate = Gate(self)
+        lane = admission.FairExecutor(max_workers=4).lane()
+
+        first = lane.submit(gate.task("first"))
+        wait_until(lambda: gate.started == ["first"])
+        second = lane.submit(gate.task("second"))
+        third = lane.submit(gate.task("third"))
+
+        self.assertTrue(second.cancelled())
+        with self.assertRaises(CancelledError):
+            second.result(0)
+        self.assertEqual(gate.started, ["first"])
+        gate.release()
+        self.assertEqual((first.result(5), third.result(5)), ("first", "third"))
+        self.assertEqual(gate.started, ["first", "third"])
+
+    def test_lanes_take_turns_for_the_workers(self):
+        gate = Gate(self)
+        executor = admission.FairExecutor(max_workers=1, max_background=0)
+        greedy, other, late = (executor.lane() for _lane in range(3))
+
+        greedy.submit(gate.task("greedy 1"))
+        wait_until(lambda: executor.stats().busy == 1)
+        pending = [
+            other.submit(gate.task("other")),
+            greedy.submit(gate.task("greedy 2")),
+            late.submit(gate.task("late")),
+        ]
+
+        self.assertEqual(executor.stats(), admission.PipelineStats(1, 1, 2))
+        gate.release()
+        for future in pending:
+            future.result(5)
+        self.assertEqual(gate.started, ["greedy 1", "other", "late", "greedy 2"])
+
+    def test_background_lanes_leave_a_worker_for_interactive_ones(self):
+        gate = Gate(self)
+        executor = admission.FairExecutor(max_workers=2)
+        renders = [executor.lane(background=True) for _lane in range(2)]
+        interactive = executor.lane()
+
+        running = renders[0].submit(gate.task("render 1"))
+        wait_until(lambda: executor.stats().busy == 1)
+        waiting = renders[1].submit(gate.task("render 2"))
+        edit = interactive.submit(lambda: "edit")
+
+        self.assertEqual(edit.result(5), "edit")
+        self.assertFalse(waiting.running() or waiting.done())
+        gate.release()
+        self.assertEqual(
+            (running.result(5), waiting.result(5)), ("render 1", "render 2")
+        )
+
+    def test_a_single_worker_does_not_wait_for_renders(self):
+        gate = Gate(self)
+        executor = admission.FairExecutor(max_workers=1)
+        render = executor.lane(background=True)
+
+        running = render.submit(gate.task("render"))
+        wait_until(lambda: gate.started == ["render"])
+        waiting = executor.lane(background=True).submit(gate.task("second render"))
+
+        self.assertEqual(executor.lane().submit(lambda: "edit").result(5), "edit")
+        self.assertFalse(running.done() or waiting.running())
+        gate.release()
+        self.assertEqual(waiting.result(5), "second render")
+
+    def test_interactive_lanes_go_before_waiting_renders(self):
+        gate = Gate(self)
+        executor = admission.FairExecutor(max_workers=2, max_background=2)
+        blockers = [executor.lane().submit(gate.task(name)) for name in "abc"]
+        wait_until(lambda: executor.stats().busy == 3)
+
+        pending = [
+            executor.lane(background=True).submit(gate.task("render")),
+            executor.lane().submit(gate.task("edit")),
+        ]
+        gate.release()
+        for future in blockers + pending:
+            future.result(5)
+
+        self.assertEqual(gate.started[3:], ["edit", "render"])
+
+    def test_errors_are_raised_from_the_future(self):
+        lane = admission.FairExecutor(max_workers=1).lane()
+
+        def fail():
+            raise ValueError("bad settings")
+
+        with self.assertRaisesRegex(ValueError, "bad settings"):
+            lane.submit(fail).result(5)
+        self.assertEqual(lane.submit(lambda: 1).result(5), 1)
+
+    def test_queue_wait_is_recorded_by_lane(self):
+        counts, _total = admission._QUEUE_WAIT_SECONDS.snapshot(lane="background")
+        before = sum(counts)
+
+        admission.FairExecutor(max_workers=2).lane(background=True).submit(
+            lambda: None
+        ).result(5)
+
+        counts, _total = admission._QUEUE_WAIT_SECONDS.snapshot(lane="background")
+        self.assertEqual(sum(counts), before + 1)
+
+    def test_the_worker_count_comes_from_the_environment(self):
+        with patch.dict(os.environ, {admission.PIPELINE_WORKERS_ENV: "3"}):
+            self.assertEqual(
+                admission.FairExecutor.from_environment().stats().workers, 3
+            )
+        with patch.dict(os.environ, {admission.PIPELINE_WORKERS_ENV: ""}):
+            self.assertEqual(
+                admission.FairExecutor.from_environment().stats().workers,
+                max(os.cpu_count() or 1, 2),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
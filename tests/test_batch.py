@@ -0,0 +1,134 @@
+from concurrent.futures import Future
+from io import BytesIO
+import os
+import unittest
+from unittest.mock import patch
+import zipfile
+
+import batch
+from pipeline import EditSettings, encode_png, render_final
+from test_remote_image import png_bytes, random_image
+
+
+SETTINGS = EditSettings(False, True, "Grayscale", 90, (120, 100, 150, 200))
+
+
+class RenderUploadTests(unittest.TestCase):
+    def test_crops_are_fractions_of_each_image(self):
+        image = random_image((40, 20))
+        recipe = batch.BatchRecipe(SETTINGS, (0.25, 0.5, 0.75, 1.0))
+
+        expected = encode_png(render_final(image.crop((10, 10, 30, 20)), SETTINGS))
+        self.assertEqual(batch.render_upload(png_bytes(image), recipe), expected)
+
+    def test_without_a_crop_the_whole_image_is_rendered(self):
+        image = random_image((12, 9), seed=1)
+
+        self.assertEqual(
+            batch.render_upload(png_bytes(image), batch.BatchRecipe(SETTINGS)),
+            encode_png(render_final(image, SETTINGS)),
+        )
+
+    def test_decoded_images_are_rendered_like_their_bytes(self):
+        image = random_image((16, 10), seed=2).convert("RGBA")
+        recipe = batch.BatchRecipe(SETTINGS, (0.0, 0.0, 0.5, 0.5))
+
+        self.assertEqual(
+            batch.render_upload(image, recipe),
+            batch.render_upload(png_bytes(image), recipe),
+        )
+
+
+class ProcessBatchTests(unittest.TestCase):
+    def setUp(self):
+        environment = patch.dict(os.environ, {batch.BATCH_WORKERS_ENV: "1"})
+        environment.start()
+        self.addCleanup(environment.stop)
+        pool = batch._Pool()
+        active = patch("batch._POOL", pool)
+        active.start()
+        self.addCleanup(active.stop)
+        self.addCleanup(lambda: pool.discard(pool.get()))
+
+    def test_every_upload_is_rendered_and_failures_are_reported(self):
+        uploads = [
+            ("{}.png".format(index), png_bytes(random_image((8, 6), seed=index)))
+            for index in range(4)
+        ] + [("broken.png", b"not an image")]
+        recipe = batch.BatchRecipe(SETTINGS)
+
+        results = sorted(batch.process_batch(uploads, recipe))
+
+        self.assertEqual([result.index for result in results], list(range(5)))
+        for result, (name, data) in zip(results[:4], uploads):
+            self.assertEqual(result.name, name)
+            self.assertIsNone(result.error)
+            self.assertEqual(result.png, batch.render_upload(data, recipe))
+        self.assertEqual(results[4].name, "broken.png")
+        self.assertIsNone(results[4].png)
+        self.assertIn("cannot identify image file", results[4].error)
+
+    def test_uploads_are_read_as_workers_free_up(self):
+        consumed = []
+
+        def uploads():
+            for index in range(10):
+                consumed.append(index)
+                yield "{}.png".format(index), png_bytes(random_image((4, 4)))
+
+        results = batch.process_batch(uploads(), batch.BatchRecipe(SETTINGS))
+        next(results)
+
+        self.assertLessEqual(len(consumed), batch.PENDING_PER_WORKER + 1)
+        self.assertEqual(len(list(results)), 9)
+
+    def test_closing_the_batch_cancels_its_pending_renders(self):
+        futures = []
+
+        def submit(_data, _recipe):
+            future = Future()
+            if not futures:
+                future.set_result(b"png")
+            futures.append(future)
+            return future, None
+
+        with patch("batch._submit", submit):
+            results = batch.process_batch(
+                [("{}.png".format(index), b"") for index in range(4)],
+                batch.BatchRecipe(SETTINGS),
+            )
+            self.assertEqual(next(results).png, b"png")
+            results.close()
+
+        self.assertEqual(len(futures), batch.PENDING_PER_WORKER)
+        self.assertTrue(all(future.cancelled() for future in futures[1:]))
+
+
+class ZipStreamTests(unittest.TestCase):
+    def test_chunks_form_a_readable_archive(self):
+        members = [("a.png", b"first"), ("b/c.png", b"second" * 1000)]
+
+        archive = zipfile.ZipFile(BytesIO(b"".join(batch.zip_stream(members))))
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            [(name, archive.read(name)) for name in archive.namelist()], members
+        )
+
+    def test_members_are_written_as_they_arrive(self):
+        consumed = []
+
+        def members():
+            for index in range(3):
+                consumed.append(index)
+                yield "{}.png".format(index), b"data"
+
+        chunks = batch.zip_stream(members())
+
+        self.assertIn(b"0.png", next(chunks))
+        self.assertEqual(consumed, [0])
+        self.assertEqual(len(list(chunks)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
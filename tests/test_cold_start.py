@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"
+    ),
+)
+
+import import_time  # noqa: E402
+
+
+# About 115 ms when measured; the headroom is for slow CI machines. Importing
+# rembg alone takes well over a second.
+COLD_START_BUDGET_MS = 400
+LAZY_MODULES = {
+    "bs4",
+    "onnxruntime",
+    "rembg",
+    "scipy",
+    "skimage",
+    "st_social_media_links",
+    "streamlit_cropper",
+    "streamlit_image_comparison",
+}
+
+
+class ImportTimeParsingTests(unittest.TestCase):
+    def test_importtime_lines_are_parsed_with_their_depth(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       224 |        224 |   _io\n"
+            "import time:      1296 |      48368 | bs4\n"
+            "unrelated line\n"
+        )
+
+        timings = import_time.parse_importtime(output)
+
+        self.assertEqual(
+            timings,
+            [
+                import_time.ImportTiming("_io", 1, 224, 224),
+                import_time.ImportTiming("bs4", 0, 1296, 48368),
+            ],
+        )
+        self.assertEqual(import_time.total_ms(timings), 48.368)
+
+    def test_only_top_level_imports_of_the_app_are_collected(self):
+        modules = import_time.app_imports()
+
+        self.assertIn("streamlit", modules)
+        self.assertIn("pipeline", modules)
+        self.assertEqual(LAZY_MODULES.intersection(modules), set())
+
+
+class ColdStartTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.timings = import_time.measure(import_time.app_imports())
+
+    def test_heavy_dependencies_are_imported_on_first_use(self):
+        imported = {timing.module.split(".")[0] for timing in self.timings}
+
+        self.assertEqual(imported & LAZY_MODULES, set())
+
+    def test_app_imports_fit_the_cold_start_budget(self):
+        slowest = sorted(
+            (timing for timing in self.timings if timing.depth == 0),
+            key=lambda timing: -timing.cumulative_us,
+        )[:5]
+        self.assertLess(
+            import_time.total_ms(self.timings),
+            COLD_START_BUDGET_MS,
+            "Slowest imports: {}".format(
+                ", ".join(
+                    "{} ({:.0f} ms)".format(timing.module, timing.cumulative_us / 1e3)
+                    for timing in slowest
+                )
+            ),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+import glob
+import os
+import signal
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+import decode_pool
+import remote_image
+from test_remote_image import png_bytes, wait_until
+
+
+PNG = png_bytes(Image.new("RGB", (6, 4), (10, 200, 30)))
+
+
+def worker_pid():
+    return np.array([os.getpid()])
+
+
+def crash(*_args):
+    os.kill(os.getpid(), signal.SIGSEGV)
+
+
+def allocate(megabytes):
+    return np.ones(megabytes * 1024 * 1024, dtype=np.uint8)
+
+
+def spin(*_args):
+    while True:
+        pass
+
+
+class LateConnection:
+    """A worker connection whose replies arrive after the caller gave up."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def poll(self, _timeout):
+        self._connection.poll(5)
+        return False
+
+
+class IsolatedPoolTests(unittest.TestCase):
+    def make_pool(self, function, **options):
+        pool = decode_pool.IsolatedPool(function, workers=1, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_images_are_decoded_in_a_worker_process(self):
+        pool = self.make_pool(remote_image._decode_image_body)
+
+        pixels = pool.run(PNG, "image/png")
+        self.assertEqual(pixels.shape, (4, 6, 3))
+        self.assertTrue((pixels == (10, 200, 30)).all())
+        self.assertNotEqual(self.make_pool(worker_pid).run()[0], os.getpid())
+
+    def test_errors_from_the_function_are_re_raised(self):
+        pool = self.make_pool(remote_image._decode_image_body)
+
+        with self.assertRaises(remote_image.InvalidImageData):
+            pool.run(b"not an image", "image/png")
+        self.assertEqual(pool.run(PNG, "image/png").shape, (4, 6, 3))
+
+    def test_crashed_workers_fail_only_their_call_and_are_replaced(self):
+        pool = self.make_pool(crash)
+
+        with self.assertRaises(decode_pool.WorkerFailed) as caught:
+            pool.run()
+        self.assertFalse(caught.exception.resource_exhausted)
+        with self.assertRaises(decode_pool.WorkerFailed):
+            pool.run()
+
+    def test_memory_limit_turns_into_memory_error(self):
+        pool = self.make_pool(allocate, memory_limit=64 * 1024 * 1024)
+
+        with self.assertRaises(MemoryError):
+            pool.run(256)
+        self.assertEqual(pool.run(1).nbytes, 1024 * 1024)
+
+    def test_cpu_limit_kills_runaway_work(self):
+        pool = self.make_pool(spin, cpu_seconds=1)
+
+        with self.assertRaises(decode_pool.WorkerFailed) as caught:
+            pool.run()
+        self.assertTrue(caught.exception.resource_exhausted)
+
+    def test_calls_wait_for_a_free_worker_only_until_the_timeout(self):
+        pool = self.make_pool(worker_pid, timeout=0.2)
+        pool.start()
+        pool._idle.get()
+
+        with self.assertRaises(decode_pool.WorkerFailed) as caught:
+            pool.run()
+        self.assertTrue(caught.exception.resource_exhausted)
+
+    def test_blocks_of_unread_replies_are_unlinked(self):
+        pool = self.make_pool(allocate, timeout=5)
+        pool.run(1)
+        (worker,) = pool._all
+        worker.connection = LateConnection(worker.connection)
+
+        with self.assertRaises(decode_pool.WorkerFailed):
+            pool.run(1)
+        self.assertEqual(glob.glob("/dev/shm/iwd_*"), [])
+        (replacement,) = pool._all
+        wait_until(lambda: replacement.wait_ready(0), timeout=30)
+        self.assertEqual(pool.run(1).nbytes, 1024 * 1024)
+
+    def test_pool_is_disabled_unless_configured(self):
+        with patch.dict(os.environ, {decode_pool.WORKERS_ENV: ""}):
+            self.assertIsNone(decode_pool.IsolatedPool.from_environment(spin))
+        with patch.dict(os.environ, {decode_pool.WORKERS_ENV: "2"}):
+            pool = decode_pool.IsolatedPool.from_environment(spin)
+        self.assertEqual(pool._workers, 2)
+
+
+class IsolatedDecodeTests(unittest.TestCase):
+    def use_pool(self, function):
+        pool = decode_pool.IsolatedPool(function, workers=1)
+        self.addCleanup(pool.close)
+        active = patch("remote_image._DECODE_POOL", pool)
+        active.start()
+        self.addCleanup(active.stop)
+
+    def test_fetch_decoding_uses_the_pool(self):
+        self.use_pool(remote_image._decode_pixels)
+
+        image = remote_image._decode_image(PNG, "image/png")
+        self.assertEqual((image.mode, image.size), ("RGB", (6, 4)))
+        self.assertEqual(image.getpixel((0, 0)), (10, 200, 30))
+        self.assertEqual(image.info, {})
+
+        preview = remote_image._decode_image(PNG, "image/png", max_side=3)
+        self.assertEqual(preview.size, (3, 2))
+        self.assertEqual(preview.info, {"original_size": (6, 4)})
+
+    def test_worker_failures_map_to_image_errors(self):
+        for function, error in (
+            (crash, remote_image.InvalidImageData),
+            (spin, remote_image.ImageTooLarge),
+        ):
+            with self.subTest(function=function.__name__):
+                pool = decode_pool.IsolatedPool(function, workers=1, cpu_seconds=1)
+                self.addCleanup(pool.close)
+                with patch("remote_image._DECODE_POOL", pool), self.assertRaises(
+                    error
+                ):
+                    remote_image._decode_image(PNG, "image/png")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+import disk_cache
+
+
+KEY_A = "a" * 64
+KEY_B = "b" * 64
+KEY_C = "c" * 64
+
+
+class DiskCacheTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = disk_cache.DiskCache(self.directory, max_bytes=1024 * 1024)
+
+    def entry_path(self, namespace, key):
+        return os.path.join(self.directory, namespace, key + ".arr")
+
+    def test_arrays_round_trip_as_read_only_memory_maps(self):
+        pixels = np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3)
+        mask = np.linspace(0, 1, 6, dtype=np.float32).reshape(2, 3)
+
+        self.assertTrue(self.cache.put("sources", KEY_A, pixels, {"kind": "rgb"}))
+        self.assertTrue(self.cache.put("masks", KEY_B, mask[:, ::2]))
+        restarted = disk_cache.DiskCache(self.directory)
+        source = restarted.get("sources", KEY_A)
+        stored_mask = restarted.get("masks", KEY_B)
+
+        self.assertIsInstance(source.array, np.memmap)
+        self.assertFalse(source.array.flags.writeable)
+        np.testing.assert_array_equal(source.array, pixels)
+        self.assertEqual(source.metadata, {"kind": "rgb"})
+        np.testing.assert_array_equal(stored_mask.array, mask[:, ::2])
+        self.assertEqual(stored_mask.array.dtype, np.float32)
+        self.assertEqual(restarted.size_bytes, self.cache.size_bytes)
+
+    def test_payload_is_aligned_for_memory_mapping(self):
+        self.cache.put("sources", KEY_A, np.zeros(5, dtype=np.float64))
+
+        with open(self.entry_path("sources", KEY_A), "rb") as entry:
+            prefix = disk_cache._PREFIX.unpack(entry.read(disk_cache._PREFIX.size))
+        self.assertEqual(prefix[3] % 64, 0)
+
+    def test_empty_arrays_carry_metadata(self):
+        self.cache.put("responses", KEY_A, np.empty(0, np.uint8), {"etag": '"x"'})
+
+        stored = self.cache.get("responses", KEY_A)
+        self.assertEqual(stored.array.shape, (0,))
+        self.assertEqual(stored.metadata, {"etag": '"x"'})
+
+    def test_corrupted_entries_are_detected_and_removed(self):
+        def flip_payload_byte(path):
+            with open(path, "r+b") as entry:
+                entry.seek(-1, os.SEEK_END)
+                last = entry.read(1)
+                entry.seek(-1, os.SEEK_END)
+                entry.write(bytes([last[0] ^ 0xFF]))
+
+        def truncate(path):
+            with open(path, "r+b") as entry:
+                entry.truncate(os.path.getsize(path) - 1)
+
+        def break_magic(path):
+            with open(path, "r+b") as entry:
+                entry.write(b"JUNK")
+
+        def break_header(path):
+            with open(path, "r+b") as entry:
+                entry.seek(disk_cache._PREFIX.size + 2)
+                entry.write(b"!")
+
+        for corrupt in (flip_payload_byte, truncate, break_magic, break_header):
+            with self.subTest(corruption=corrupt.__name__):
+                cache = disk_cache.DiskCache(self.directory)
+                cache.put("sources", KEY_A, np.arange(64, dtype=np.uint8))
+                corrupt(self.entry_path("sources", KEY_A))
+
+                self.assertIsNone(cache.get("sources", KEY_A))
+                self.assertFalse(os.path.exists(self.entry_path("sources", KEY_A)))
+
+    def test_checksum_is_verified_again_after_the_file_changes(self):
+        self.cache.put("sources", KEY_A, np.arange(64, dtype=np.uint8))
+        self.assertIsNotNone(self.cache.get("sources", KEY_A))
+        path = self.entry_path("sources", KEY_A)
+        with open(path, "r+b") as entry:
+            entry.seek(-1, os.SEEK_END)
+            entry.write(b"\x00")
+        os.utime(path, ns=(1, 1))
+
+        self.assertIsNone(self.cache.get("sources", KEY_A))
+
+    def test_writes_are_atomic_and_leave_no_temporary_files(self):
+        self.cache.put("sources", KEY_A, np.ones(8, dtype=np.uint8))
+
+        with patch("disk_cache.os.replace", side_effect=OSError("disk full")):
+            self.assertFalse(
+                self.cache.put("sources", KEY_A, np.zeros(8, dtype=np.uint8))
+            )
+
+        np.testing.assert_array_equal(
+            self.cache.get("sources", KEY_A).array, np.ones(8, dtype=np.uint8)
+        )
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, "sources")), [KEY_A + ".arr"]
+        )
+
+    def test_least_recently_used_entries_are_evicted_over_budget(self):
+        cache = disk_cache.DiskCache(self.directory)
+        cache.put("sources", KEY_A, np.zeros(400, dtype=np.uint8))
+        entry_size = os.path.getsize(self.entry_path("sources", KEY_A))
+        cache.max_bytes = 2 * entry_size
+        cache.put("sources", KEY_B, np.zeros(400, dtype=np.uint8))
+        os.utime(self.entry_path("sources", KEY_A), (1_000, 1_000))
+        os.utime(self.entry_path("sources", KEY_B), (2_000, 2_000))
+
+        with patch("disk_cache.time.time", return_value=3_000):
+            self.assertIsNotNone(cache.get("sources", KEY_A))
+        cache.put("sources", KEY_C, np.zeros(400, dtype=np.uint8))
+
+        self.assertIsNotNone(cache.get("sources", KEY_A))
+        self.assertIsNone(cache.get("sources", KEY_B))
+        self.assertIsNotNone(cache.get("sources", KEY_C))
+        self.assertEqual(cache.size_bytes, 2 * entry_size)
+        self.assertFalse(cache.put("sources", KEY_B, np.zeros(1_000, np.uint8)))
+
+    def test_namespaces_and_keys_cannot_escape_the_directory(self):
+        for namespace, key in (
+            ("../etc", KEY_A),
+            ("sources", "../" + KEY_A),
+            ("sources", "NOT-A-DIGEST"),
+        ):
+            with self.subTest(namespace=namespace, key=key), self.assertRaises(
+                ValueError
+            ):
+                self.cache.put(namespace, key, np.zeros(1, dtype=np.uint8))
+
+    def test_shared_cache_is_configured_by_environment(self):
+        with patch.dict(os.environ, {disk_cache.CACHE_DIR_ENV: ""}):
+            self.assertIsNone(disk_cache.shared_disk_cache())
+        with patch.dict(
+            os.environ,
+            {
+                disk_cache.CACHE_DIR_ENV: self.directory,
+                disk_cache.CACHE_MAX_BYTES_ENV: "4096",
+            },
+        ):
+            shared = disk_cache.shared_disk_cache()
+            self.assertIs(disk_cache.shared_disk_cache(), shared)
+        self.assertEqual(shared.directory, os.path.abspath(self.directory))
+        self.assertEqual(shared.max_bytes, 4096)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,422 @@
+from concurrent.futures import CancelledError
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import dns_resolver
+import metrics
+import remote_image
+from test_remote_image import PUBLIC_V4, RemoteImageTestCase, wait_until
+
+
+STREAM = (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "")
+
+
+def encode_name(name):
+    return b"".join(
+        bytes([len(label)]) + label.encode("ascii") for label in name.split(".")
+    ) + b"\0"
+
+
+class StubDNSServer:
+    """Answers A, AAAA and CNAME queries from a zone dictionary on loopback.
+
+    A name whose entry has an ``rcode`` is answered with that error code. A
+    name whose entry sets ``truncate`` is answered with TC=1 over UDP and in
+    full over TCP, on the same port.
+    """
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.queries = []
+        self.tcp_queries = []
+        self.silent = False
+        self.spoof_first = False
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.address = self.socket.getsockname()
+        self.listener = socket.create_server(self.address)
+        for target in (self.serve, self.serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+
+    def close(self):
+        self.socket.close()
+        self.listener.close()
+
+    def parse(self, message):
+        query_id = struct.unpack("!H", message[:2])[0]
+        question = message[12:]
+        name_end = question.index(b"\0") + 1
+        labels, offset = [], 0
+        while question[offset]:
+            labels.append(question[offset + 1 : offset + 1 + question[offset]])
+            offset += 1 + question[offset]
+        name = b".".join(labels).decode("ascii")
+        query_type = struct.unpack("!H", question[name_end : name_end + 2])[0]
+        return query_id, question[: name_end + 4], name, query_type
+
+    def serve(self):
+        while True:
+            try:
+                message, client = self.socket.recvfrom(512)
+            except OSError:
+                return
+            query_id, question, name, query_type = self.parse(message)
+            self.queries.append((name, query_type))
+            if self.silent:
+                continue
+            if self.spoof_first:
+                self.socket.sendto(
+                    self.response(query_id ^ 1, question, name, query_type), client
+                )
+            response = self.response(query_id, question, name, query_type)
+            if self.zone.get(name, {}).get("truncate"):
+                flags = struct.unpack("!H", response[2:4])[0] | 0x0200
+                response = (
+                    response[:2]
+                    + struct.pack("!HHHHH", flags, 1, 0, 0, 0)
+                    + question
+                )
+            self.socket.sendto(response, client)
+
+    def serve_tcp(self):
+        while True:
+            try:
+                connection, _client = self.listener.accept()
+            except OSError:
+                return
+            with connection:
+                length = struct.unpack("!H", connection.recv(2))[0]
+                query_id, question, name, query_type = self.parse(
+                    connection.recv(length)
+                )
+                self.tcp_queries.append((name, query_type))
+                response = self.response(query_id, question, name, query_type)
+                connection.sendall(struct.pack("!H", len(response)) + response)
+
+    def response(self, query_id, question, name, query_type):
+        if name not in self.zone:
+            return struct.pack("!HHHHHH", query_id, 0x8183, 1, 0, 0, 0) + question
+        if "rcode" in self.zone[name]:
+            flags = 0x8180 | self.zone[name]["rcode"]
+            return struct.pack("!HHHHHH", query_id, flags, 1, 0, 0, 0) + question
+        records = []
+        owner = name
+        while True:
+            entry = self.zone[owner]
+            if "cname" in entry:
+                target = entry["cname"]
+                data = encode_name(target)
+                header = struct.pack("!HHIH", 5, 1, 60, len(data))
+                records.append(encode_name(owner) + header + data)
+                owner = target
+                continue
+            for address in entry.get(query_type, []):
+                data = ipaddress.ip_address(address).packed
+                # Compressed owner name pointing at the question.
+                records.append(
+                    (b"\xc0\x0c" if owner == name else encode_name(owner))
+                    + struct.pack("!HHIH", query_type, 1, 60, len(data))
+                    + data
+                )
+            break
+        header = struct.pack("!HHHHHH", query_id, 0x8180, 1, len(records), 0, 0)
+        return header + question + b"".join(records)
+
+
+class ResolverPoolTests(unittest.TestCase):
+    def make_pool(self, **options):
+        options.setdefault("name", "test-{}".format(self.id()))
+        pool = dns_resolver.ResolverPool(**options)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def blocker(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        return release, lambda: release.wait(5) and "done"
+
+    def test_full_queue_rejects_lookups_immediately(self):
+        pool = self.make_pool(max_workers=1, max_queue=2)
+        release, blocked = self.blocker()
+        running = pool.submit(blocked)
+        wait_until(lambda: pool.stats().in_flight == 1)
+        queued = [pool.submit(blocked), pool.submit(blocked)]
+        rejected = metrics.REGISTRY.counter(
+            "imageworkdesk_dns_rejected_total", "", ["pool"]
+        )
+        before = rejected.value(pool=pool.name)
+
+        started = time.monotonic()
+        with self.assertRaises(dns_resolver.ResolverSaturated):
+            pool.submit(blocked)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(rejected.value(pool=pool.name), before + 1)
+
+        release.set()
+        self.assertEqual(
+            [future.result(2) for future in [running] + queued], ["done"] * 3
+        )
+
+    def test_pool_grows_with_demand_up_to_its_limit(self):
+        pool = self.make_pool(max_workers=3, max_queue=10)
+        release, blocked = self.blocker()
+        futures = [pool.submit(blocked) for _index in range(5)]
+
+        wait_until(lambda: pool.stats().in_flight == 3)
+        self.assertEqual(pool.stats().workers, 3)
+        self.assertEqual(pool.stats().queued, 2)
+        release.set()
+        for future in futures:
+            self.assertEqual(future.result(2), "done")
+
+    def test_stuck_workers_are_replaced_and_reported(self):
+        pool = self.make_pool(max_workers=1, stuck_after=0.05)
+        release, blocked = self.blocker()
+        stuck = pool.submit(blocked)
+        wait_until(lambda: pool.stats().in_flight == 1)
+        time.sleep(0.06)
+
+        self.assertEqual(pool.submit(lambda: "fresh").result(2), "fresh")
+        self.assertEqual(pool.stats().stuck, 1)
+        self.assertIn(
+            'imageworkdesk_dns_stuck_workers{{pool="{}"}} 1'.format(pool.name),
+            metrics.REGISTRY.render(),
+        )
+        self.assertFalse(stuck.done())
+
+        # Stuck workers never push the pool past twice its configured size.
+        pool.submit(blocked)
+        wait_until(lambda: pool.stats().in_flight == 2)
+        time.sleep(0.06)
+        pool.submit(blocked)
+        self.assertEqual(pool.stats().workers, 2)
+        self.assertEqual(pool.stats().queued, 1)
+
+    def test_idle_workers_above_the_minimum_exit(self):
+        pool = self.make_pool(min_workers=1, max_workers=4, idle_timeout=0.05)
+        release, blocked = self.blocker()
+        futures = [pool.submit(blocked) for _index in range(4)]
+        wait_until(lambda: pool.stats().workers == 4)
+        release.set()
+        for future in futures:
+            future.result(2)
+
+        wait_until(lambda: pool.stats().workers == 1)
+
+    def test_cancelled_queued_lookups_are_skipped(self):
+        pool = self.make_pool(max_workers=1)
+        release, blocked = self.blocker()
+        pool.submit(blocked)
+        wait_until(lambda: pool.stats().in_flight == 1)
+        calls = []
+        queued = pool.submit(calls.append, "ran")
+
+        self.assertTrue(queued.cancel())
+        release.set()
+        self.assertEqual(pool.submit(lambda: "after").result(2), "after")
+        self.assertEqual(calls, [])
+
+    def test_pool_is_configured_by_environment(self):
+        with patch.dict(
+            os.environ,
+            {
+                dns_resolver.MAX_WORKERS_ENV: "7",
+                dns_resolver.MAX_QUEUE_ENV: "3",
+                dns_resolver.DNS_SERVER_ENV: "",
+            },
+        ):
+            pool = dns_resolver.ResolverPool.from_environment()
+            self.assertIsNone(dns_resolver.UDPResolver.from_environment())
+        self.assertEqual((pool._max_workers, pool._max_queue), (7, 3))
+
+
+class UDPResolverTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubDNSServer(
+            {
+                "images.example": {1: [PUBLIC_V4], 28: ["2606:2800::1"]},
+                "www.images.example": {"cname": "cdn.images.example"},
+                "cdn.images.example": {1: ["93.184.216.35"]},
+                "broken.example": {"rcode": 2},
+                "many.images.example": {
+                    "truncate": True,
+                    1: ["93.184.216.{}".format(host) for host in range(1, 41)],
+                },
+            }
+        )
+        self.addCleanup(self.server.close)
+        self.resolver = dns_resolver.UDPResolver(
+            self.server.address, timeout=0.5, retry_interval=0.1
+        )
+
+    def test_a_and_aaaa_answers_are_returned_as_getaddrinfo_results(self):
+        answers = self.resolver.lookup("images.example", 443).result(2)
+
+        self.assertEqual(
+            sorted(answers),
+            sorted(
+                [
+                    STREAM + ((PUBLIC_V4, 443),),
+                    (socket.AF_INET6, *STREAM[1:], ("2606:2800::1", 443, 0, 0)),
+                ]
+            ),
+        )
+        self.assertEqual(
+            sorted(self.server.queries),
+            [("images.example", 1), ("images.example", 28)],
+        )
+
+    def test_cname_chains_are_followed(self):
+        answers = self.resolver.lookup("www.images.example", 80).result(2)
+
+        self.assertEqual(
+            [answer[4] for answer in answers], [("93.184.216.35", 80)]
+        )
+
+    def test_unknown_names_raise_gaierror(self):
+        with self.assertRaises(socket.gaierror):
+            self.resolver.lookup("missing.example", 443).result(2)
+
+    def test_server_failures_end_the_lookup_without_waiting(self):
+        resolver = dns_resolver.UDPResolver(self.server.address, timeout=30)
+        started = time.monotonic()
+
+        with self.assertRaises(dns_resolver.DNSServerFailure):
+            resolver.lookup("broken.example", 443).result(5)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_queries_offer_an_edns_payload_size(self):
+        query = dns_resolver.build_query(7, "images.example", 1)
+
+        self.assertEqual(struct.unpack("!H", query[10:12]), (1,))
+        self.assertEqual(
+            query[-11:],
+            b"\0" + struct.pack("!HHIH", 41, dns_resolver.EDNS_PAYLOAD_BYTES, 0, 0),
+        )
+
+    def test_truncated_answers_are_asked_for_again_over_tcp(self):
+        answers = self.resolver.lookup("many.images.example", 80).result(2)
+
+        self.assertEqual(
+            [answer[4] for answer in answers],
+            [("93.184.216.{}".format(host), 80) for host in range(1, 41)],
+        )
+        self.assertEqual(
+            sorted(self.server.tcp_queries),
+            [("many.images.example", 1), ("many.images.example", 28)],
+        )
+
+    def test_socket_errors_are_reported_instead_of_a_timeout(self):
+        closed = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        closed.bind(("127.0.0.1", 0))
+        address = closed.getsockname()
+        closed.close()
+        resolver = dns_resolver.UDPResolver(address, timeout=30)
+
+        with self.assertRaises(ConnectionRefusedError):
+            resolver.lookup("images.example", 443).result(5)
+
+    def test_responses_with_the_wrong_id_are_ignored(self):
+        self.server.spoof_first = True
+
+        answers = self.resolver.lookup("images.example", 443).result(2)
+        self.assertEqual(len(answers), 2)
+
+    def test_unanswered_lookups_retry_and_then_time_out(self):
+        self.server.silent = True
+
+        with self.assertRaises(socket.timeout):
+            self.resolver.lookup("images.example", 443).result(2)
+        self.assertGreaterEqual(len(self.server.queries), 4)
+
+    def test_cancelling_a_lookup_closes_its_socket(self):
+        self.server.silent = True
+        lookup = self.resolver.lookup("images.example", 443)
+        lookup_socket = lookup.sock
+
+        self.assertTrue(lookup.cancel())
+        with self.assertRaises(CancelledError):
+            lookup.result(0)
+        wait_until(lambda: lookup_socket.fileno() == -1)
+
+    def test_server_is_read_from_environment(self):
+        address = "{}:{}".format(*self.server.address)
+        with patch.dict(os.environ, {dns_resolver.DNS_SERVER_ENV: address}):
+            resolver = dns_resolver.UDPResolver.from_environment()
+        self.assertEqual(resolver.server, self.server.address)
+        with patch.dict(os.environ, {dns_resolver.DNS_SERVER_ENV: "[::1]"}):
+            self.assertEqual(
+                dns_resolver.UDPResolver.from_environment().server, ("::1", 53)
+            )
+
+
+class RemoteImageResolverTests(RemoteImageTestCase):
+    def test_saturated_pool_is_reported_as_a_download_error(self):
+        pool = dns_resolver.ResolverPool(max_workers=1, max_queue=1, name="saturated")
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        pool.submit(release.wait, 5)
+        wait_until(lambda: pool.stats().in_flight == 1)
+        pool.submit(release.wait, 5)
+
+        with patch("remote_image._DNS_EXECUTOR", pool), self.assertRaisesRegex(
+            remote_image.ImageDownloadError, "Too many"
+        ):
+            remote_image._resolve_public_endpoints(
+                remote_image._parse_target("https://saturated.example/image.png")
+            )
+
+    def test_configured_udp_resolver_is_used_for_lookups(self):
+        server = StubDNSServer({"images.example": {1: [PUBLIC_V4]}})
+        self.addCleanup(server.close)
+        resolver = dns_resolver.UDPResolver(server.address, timeout=0.5)
+
+        with patch("remote_image._UDP_RESOLVER", resolver):
+            endpoints = remote_image._resolve_public_endpoints(
+                remote_image._parse_target("https://images.example/image.png")
+            )
+
+        self.assertEqual(
+            [endpoint.address_text for endpoint in endpoints], [PUBLIC_V4]
+        )
+
+    def test_address_literals_are_not_sent_to_the_udp_resolver(self):
+        server = StubDNSServer({})
+        self.addCleanup(server.close)
+        resolver = dns_resolver.UDPResolver(server.address, timeout=0.5)
+
+        for url, expected in (
+            ("http://{}/image.png".format(PUBLIC_V4), (PUBLIC_V4, 80)),
+            ("https://[2606:2800::1]/image.png", ("2606:2800::1", 443, 0, 0)),
+        ):
+            with self.subTest(url=url), patch("remote_image._UDP_RESOLVER", resolver):
+                endpoints = remote_image._resolve_public_endpoints(
+                    remote_image._parse_target(url)
+                )
+                self.assertEqual(
+                    [endpoint.socket_address for endpoint in endpoints], [expected]
+                )
+        self.assertEqual(server.queries, [])
+
+    def test_server_failures_are_reported_as_resolution_errors(self):
+        server = StubDNSServer({"broken.example": {"rcode": 5}})
+        self.addCleanup(server.close)
+        resolver = dns_resolver.UDPResolver(server.address, timeout=30)
+
+        with patch("remote_image._UDP_RESOLVER", resolver), self.assertRaisesRegex(
+            remote_image.ImageDownloadError, "could not be resolved"
+        ):
+            remote_image._resolve_public_endpoints(
+                remote_image._parse_target("https://broken.example/image.png")
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
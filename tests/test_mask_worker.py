@@ -0,0 +1,186 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+from PIL import Image
+
+import mask_worker
+import pipeline
+from test_remote_image import random_image, wait_until
+
+
+def threshold_masks(images):
+    return [np.where(np.asarray(image)[..., 0] > 127, 255, 0) for image in images]
+
+
+class MaskServerTests(unittest.TestCase):
+    def serve(self, predict, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        address = os.path.join(directory.name, "masks.sock")
+        server = mask_worker.MaskServer(address, predict, **options)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.close)
+        client = mask_worker.MaskClient(address, timeout=5)
+        self.addCleanup(client.close)
+        return server, client
+
+    def test_masks_are_computed_by_the_worker(self):
+        _server, client = self.serve(threshold_masks)
+
+        for size in ((31, 17), (1, 1), (64, 48)):
+            with self.subTest(size=size):
+                image = random_image(size)
+                np.testing.assert_array_equal(
+                    client.mask(image), threshold_masks([image])[0]
+                )
+        self.assertEqual(len(client._idle), 1)
+
+    def test_concurrent_requests_share_a_model_run(self):
+        batches = []
+        first_started, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def predict(images):
+            batches.append(len(images))
+            first_started.set()
+            release.wait(5)
+            return threshold_masks(images)
+
+        server, client = self.serve(predict, max_batch=4)
+        images = [random_image((20, 10), seed) for seed in range(5)]
+        with ThreadPoolExecutor(max_workers=5) as clients:
+            first = clients.submit(client.mask, images[0])
+            first_started.wait(5)
+            rest = [clients.submit(client.mask, image) for image in images[1:]]
+            wait_until(lambda: server._requests.qsize() == 4)
+            release.set()
+            masks = [first.result()] + [future.result() for future in rest]
+
+        self.assertEqual(batches, [1, 4])
+        for image, mask in zip(images, masks):
+            np.testing.assert_array_equal(mask, threshold_masks([image])[0])
+
+    def test_prediction_errors_are_reported_to_the_client(self):
+        _server, client = self.serve(Mock(side_effect=RuntimeError("model failed")))
+
+        with self.assertRaisesRegex(mask_worker.MaskWorkerError, "model failed"):
+            client.mask(random_image((4, 4)))
+
+    def test_an_unreachable_worker_is_reported_as_unavailable(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        client = mask_worker.MaskClient(os.path.join(directory.name, "missing.sock"))
+
+        with self.assertRaises(mask_worker.MaskWorkerUnavailable):
+            client.mask(random_image((4, 4)))
+
+    def test_an_unreachable_worker_is_retried_only_after_a_pause(self):
+        client = mask_worker.MaskClient("/nonexistent/masks.sock")
+        connect = Mock(side_effect=FileNotFoundError)
+
+        with patch("mask_worker.mp_connection.Client", connect):
+            for _attempt in range(2):
+                with self.assertRaises(mask_worker.MaskWorkerUnavailable):
+                    client.mask(random_image((4, 4)))
+            self.assertEqual(connect.call_count, 1)
+            later = time.monotonic() + mask_worker.RETRY_AFTER_SECONDS
+            with patch("mask_worker.time.monotonic", return_value=later):
+                with self.assertRaises(mask_worker.MaskWorkerUnavailable):
+                    client.mask(random_image((4, 4)))
+
+        self.assertEqual(connect.call_count, 2)
+
+    def test_a_slow_worker_fails_the_mask_instead_of_loading_the_model(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def stall(images):
+            release.wait(5)
+            return threshold_masks(images)
+
+        _server, client = self.serve(stall)
+        slow = mask_worker.MaskClient(client.address, timeout=0.2)
+        self.addCleanup(slow.close)
+
+        with patch("mask_worker.shared_client", return_value=slow), patch.dict(
+            sys.modules, {"rembg": None}
+        ):
+            with self.assertRaisesRegex(mask_worker.MaskWorkerError, "in time"):
+                pipeline._rembg_mask(random_image((4, 4)), "u2net")
+
+    def test_the_pipeline_uses_the_configured_worker(self):
+        _server, client = self.serve(threshold_masks)
+        image = random_image((12, 8))
+
+        with patch.dict(os.environ, {mask_worker.MASK_SOCKET_ENV: client.address}):
+            mask = pipeline._rembg_mask(image, mask_worker.DEFAULT_MODEL)
+
+        np.testing.assert_array_equal(mask, threshold_masks([image])[0])
+
+
+class FakeModel:
+    """A model whose output for each image depends only on that image."""
+
+    def __init__(self, batch_dimension):
+        self.runs = []
+        self.input = Mock(shape=[batch_dimension, 3, 8, 8])
+        self.input.name = "input.1"
+
+    def get_inputs(self):
+        return [self.input]
+
+    def run(self, output_names, feed):
+        batch = feed["input.1"]
+        self.runs.append(len(batch))
+        return [batch.mean(axis=1, keepdims=True), batch]
+
+
+class FakeSession:
+    def __init__(self, model):
+        self.inner_session = model
+
+    def predict(self, image):
+        pixels = np.asarray(image.convert("RGB").resize((8, 8)), np.float32)
+        feed = {"input.1": pixels.transpose(2, 0, 1)[np.newaxis] / 255}
+        prediction = self.inner_session.run(None, feed)[0][:, 0]
+        prediction = (prediction - prediction.min()) / np.ptp(prediction)
+        mask = Image.fromarray((prediction[0] * 255).astype(np.uint8), "L")
+        return [mask.resize(image.size)]
+
+
+class SessionPredictorTests(unittest.TestCase):
+    def test_dynamic_batches_run_the_model_once(self):
+        model = FakeModel("batch_size")
+        images = [random_image((9 + seed, 7), seed) for seed in range(3)]
+
+        masks = mask_worker.session_predictor(FakeSession(model))(images)
+
+        self.assertEqual(model.runs, [3])
+        expected = FakeSession(FakeModel(1))
+        for image, mask in zip(images, masks):
+            np.testing.assert_array_equal(
+                mask, np.asarray(expected.predict(image)[0])
+            )
+
+    def test_fixed_batch_sizes_run_the_images_one_by_one(self):
+        model = FakeModel(1)
+
+        masks = mask_worker.session_predictor(FakeSession(model))(
+            [random_image((8, 8), seed) for seed in range(3)]
+        )
+
+        self.assertEqual(model.runs, [1, 1, 1])
+        self.assertEqual([mask.shape for mask in masks], [(8, 8)] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+from io import BytesIO
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from urllib.request import urlopen
+
+from PIL import Image
+
+import metrics
+import remote_image
+from test_remote_image import (
+    PUBLIC_V4,
+    FakeResponse,
+    queued_resolver,
+    scripted_transport,
+)
+
+
+class RegistryExpositionTests(unittest.TestCase):
+    def test_counters_and_gauges_render_as_prometheus_text(self):
+        registry = metrics.MetricsRegistry()
+        requests = registry.counter(
+            "demo_requests_total", "Requests served.", ["path"]
+        )
+        requests.inc(path="/a")
+        requests.inc(2, path='/b"\\\n')
+        in_flight = registry.gauge("demo_in_flight", "Requests in flight.")
+        in_flight.inc()
+        in_flight.inc()
+        in_flight.dec()
+        registry.gauge("demo_queue", "Queued work.").set_function(lambda: 7)
+
+        self.assertEqual(
+            registry.render(),
+            "# HELP demo_in_flight Requests in flight.\n"
+            "# TYPE demo_in_flight gauge\n"
+            "demo_in_flight 1.0\n"
+            "# HELP demo_queue Queued work.\n"
+            "# TYPE demo_queue gauge\n"
+            "demo_queue 7.0\n"
+            "# HELP demo_requests_total Requests served.\n"
+            "# TYPE demo_requests_total counter\n"
+            'demo_requests_total{path="/a"} 1.0\n'
+            'demo_requests_total{path="/b\\"\\\\\\n"} 2.0\n',
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = metrics.MetricsRegistry()
+        latency = registry.histogram(
+            "demo_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0)
+        )
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value, stage="decode")
+
+        lines = registry.render().splitlines()[2:]
+        self.assertEqual(
+            lines,
+            [
+                'demo_seconds_bucket{stage="decode",le="0.1"} 2.0',
+                'demo_seconds_bucket{stage="decode",le="1.0"} 3.0',
+                'demo_seconds_bucket{stage="decode",le="+Inf"} 4.0',
+                'demo_seconds_sum{stage="decode"} 3.65',
+                'demo_seconds_count{stage="decode"} 4.0',
+            ],
+        )
+
+    def test_registration_is_idempotent_and_labels_are_checked(self):
+        registry = metrics.MetricsRegistry()
+        first = registry.counter("demo_total", "Demo.", ["kind"])
+        self.assertIs(registry.counter("demo_total", "Demo.", ["kind"]), first)
+        with self.assertRaises(ValueError):
+            registry.gauge("demo_total", "Demo.", ["kind"])
+        with self.assertRaises(ValueError):
+            first.inc(other="x")
+        with self.assertRaises(ValueError):
+            first.inc(-1, kind="x")
+
+    def test_concurrent_updates_are_not_lost(self):
+        registry = metrics.MetricsRegistry()
+        counter = registry.counter("demo_total", "Demo.", ["worker"])
+        histogram = registry.histogram("demo_seconds", "Demo.")
+
+        def work(worker):
+            for _ in range(2_000):
+                counter.inc(worker=worker % 2)
+                histogram.observe(0.01)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.value(worker=0) + counter.value(worker=1), 16_000)
+        self.assertEqual(sum(histogram.snapshot()[0]), 16_000)
+
+
+class ExporterTests(unittest.TestCase):
+    def test_textfile_is_replaced_atomically(self):
+        registry = metrics.MetricsRegistry()
+        registry.counter("demo_total", "Demo.").inc()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "workdesk.prom")
+            with open(path, "w", encoding="utf-8") as stale:
+                stale.write("stale\n")
+
+            registry.write_textfile(path)
+
+            with open(path, encoding="utf-8") as written:
+                self.assertEqual(written.read(), registry.render())
+            self.assertEqual(os.listdir(directory), ["workdesk.prom"])
+
+    def test_local_endpoint_serves_the_registry_to_a_scraper(self):
+        registry = metrics.MetricsRegistry()
+        registry.counter("demo_total", "Demo.").inc(3)
+        server = registry.serve()
+        self.addCleanup(server.close)
+
+        with urlopen(
+            "http://127.0.0.1:{}/metrics".format(server.port), timeout=5
+        ) as response:
+            self.assertEqual(response.headers["Content-Type"], metrics.CONTENT_TYPE)
+            scraped = response.read().decode("utf-8")
+
+        self.assertIn("demo_total 3.0\n", scraped)
+        self.assertEqual(server.host, "127.0.0.1")
+
+
+class RemoteImageInstrumentationTests(unittest.TestCase):
+    def test_fetch_outcomes_bytes_and_decode_time_are_recorded(self):
+        output = BytesIO()
+        Image.new("RGB", (2, 3)).save(output, format="PNG")
+        png = output.getvalue()
+        fetches = remote_image._FETCHES
+        ok_before = fetches.value(outcome="ok")
+        failed_before = fetches.value(outcome="ImageDownloadError")
+        bytes_before = remote_image._DOWNLOADED_BYTES.value()
+        decodes_before = sum(remote_image._DECODE_SECONDS.snapshot()[0])
+
+        success = FakeResponse(headers={"Content-Type": "image/png"}, chunks=[png])
+        with scripted_transport([success], queued_resolver([PUBLIC_V4])):
+            remote_image.fetch_image_from_url("http://public.test/image.png")
+        with patch(
+            "remote_image.socket.getaddrinfo",
+            side_effect=socket.gaierror("not found"),
+        ), self.assertRaises(remote_image.ImageDownloadError):
+            remote_image.fetch_image_from_url("http://public.test/missing.png")
+
+        self.assertEqual(fetches.value(outcome="ok"), ok_before + 1)
+        self.assertEqual(
+            fetches.value(outcome="ImageDownloadError"), failed_before + 1
+        )
+        self.assertEqual(
+            remote_image._DOWNLOADED_BYTES.value(), bytes_before + len(png)
+        )
+        self.assertEqual(
+            sum(remote_image._DECODE_SECONDS.snapshot()[0]), decodes_before + 1
+        )
+        self.assertIn(
+            'imageworkdesk_remote_fetch_seconds_count{outcome="ok"}',
+            metrics.REGISTRY.render(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
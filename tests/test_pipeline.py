@@ -0,0 +1,251 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+import disk_cache
+import mask_worker
+import pipeline
+from test_remote_image import png_bytes
+
+
+class PipelineCacheTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.disk = disk_cache.DiskCache(directory.name)
+        self.restart()
+        shared = patch("pipeline.disk_cache.shared_disk_cache", return_value=self.disk)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+    def restart(self):
+        for name, size in (("_SOURCES", 8), ("_MASKS", 16)):
+            active = patch(
+                "pipeline." + name, pipeline._ArrayLRU(size, name.strip("_").lower())
+            )
+            active.start()
+            self.addCleanup(active.stop)
+
+    def test_sources_are_decoded_once_and_survive_a_restart(self):
+        data = png_bytes(Image.new("RGB", (4, 3), (200, 100, 50)))
+        with patch("pipeline.Image.open", wraps=Image.open) as image_open:
+            first = pipeline.decode_source(data)
+            pipeline.decode_source(data)
+            self.restart()
+            restored = pipeline.decode_source(data)
+
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual((first.mode, first.size), ("RGB", (4, 3)))
+        self.assertEqual(restored.getpixel((0, 0)), (200, 100, 50))
+
+    def test_masks_are_computed_once_per_image_content(self):
+        image = Image.new("RGB", (4, 2), (10, 20, 30))
+        mask = np.array([[0, 255, 255, 0], [0, 255, 255, 0]], dtype=np.uint8)
+        rembg_mask = Mock(return_value=mask)
+
+        with patch("pipeline._rembg_mask", rembg_mask):
+            cutout = pipeline.remove_background(image)
+            self.restart()
+            pipeline.remove_background(image.copy())
+            pipeline.remove_background(Image.new("RGB", (4, 2), (0, 0, 0)))
+
+        self.assertEqual(rembg_mask.call_count, 2)
+        self.assertEqual(cutout.mode, "RGBA")
+        np.testing.assert_array_equal(np.asarray(cutout)[..., 3], mask)
+        self.assertEqual(cutout.getpixel((0, 0)), (0, 0, 0, 0))
+        self.assertEqual(cutout.getpixel((1, 0)), (10, 20, 30, 255))
+
+    def test_previews_reuse_the_mask_of_their_source(self):
+        source = Image.new("RGB", (8, 4), (10, 20, 30))
+        mask = np.zeros((4, 8), dtype=np.uint8)
+        mask[:, 4:] = 255
+        rembg_mask = Mock(return_value=mask)
+
+        with patch("pipeline._rembg_mask", rembg_mask):
+            preview = pipeline.remove_background(
+                pipeline.preview_image(source, 4), mask_source=source
+            )
+            rendered = pipeline.render_final(
+                source, pipeline.EditSettings(True, False, None)
+            )
+
+        rembg_mask.assert_called_once()
+        self.assertEqual(preview.size, (4, 2))
+        scaled = Image.fromarray(mask).resize((4, 2), Image.Resampling.BILINEAR)
+        np.testing.assert_array_equal(np.asarray(preview)[..., 3], scaled)
+        np.testing.assert_array_equal(np.asarray(rendered)[..., 3], mask)
+
+    def test_masks_are_cached_per_model(self):
+        image = Image.new("RGB", (2, 2))
+        rembg_mask = Mock(return_value=np.zeros((2, 2), dtype=np.uint8))
+
+        with patch("pipeline._rembg_mask", rembg_mask):
+            for model in ("u2net", "isnet-general-use", "u2net"):
+                with patch.dict(os.environ, {mask_worker.MASK_MODEL_ENV: model}):
+                    pipeline.background_mask(image)
+
+        self.assertEqual(
+            [call.args[1] for call in rembg_mask.call_args_list],
+            ["u2net", "isnet-general-use"],
+        )
+
+    def test_without_a_disk_tier_results_are_cached_in_memory(self):
+        rembg_mask = Mock(return_value=np.zeros((2, 2), dtype=np.uint8))
+        with patch(
+            "pipeline.disk_cache.shared_disk_cache", return_value=None
+        ), patch("pipeline._rembg_mask", rembg_mask):
+            pipeline.background_mask(Image.new("RGB", (2, 2)))
+            pipeline.background_mask(Image.new("RGB", (2, 2)))
+
+        self.assertEqual(rembg_mask.call_count, 1)
+
+
+def pillow_variant(image, variant):
+    if variant.mirror:
+        image = ImageOps.mirror(image)
+    image = image.rotate(360 - variant.rotate)
+    image = ImageEnhance.Brightness(image).enhance(variant.brightness / 100)
+    image = ImageEnhance.Color(image).enhance(variant.saturation / 100)
+    image = ImageEnhance.Contrast(image).enhance(variant.contrast / 100)
+    return np.asarray(ImageEnhance.Sharpness(image).enhance(variant.sharpness / 100))
+
+
+class VariantGridTests(unittest.TestCase):
+    def test_batched_variants_match_the_pillow_pipeline(self):
+        generator = np.random.default_rng(0)
+        variants = pipeline.sample_variants(24, generator) + [
+            pipeline.VariantParams(True, 90, 100, 100, 100, 100),
+            pipeline.VariantParams(False, 180, 0, 1000, 999, 0),
+        ]
+        for shape in ((37, 53, 3), (24, 24, 4)):
+            with self.subTest(shape=shape):
+                pixels = generator.integers(0, 256, shape, dtype=np.uint8)
+                rendered = pipeline.render_variants(pixels, variants)
+
+                self.assertEqual(rendered.shape, (len(variants),) + shape)
+                for preview, variant in zip(rendered, variants):
+                    np.testing.assert_array_equal(
+                        preview, pillow_variant(Image.fromarray(pixels), variant)
+                    )
+
+    def test_chunking_does_not_change_the_result(self):
+        generator = np.random.default_rng(1)
+        pixels = generator.integers(0, 256, (20, 30, 3), dtype=np.uint8)
+        variants = pipeline.sample_variants(7, generator)
+
+        np.testing.assert_array_equal(
+            pipeline.render_variants(pixels, variants, max_bytes=1),
+            pipeline.render_variants(pixels, variants),
+        )
+
+    def test_samples_cover_the_slider_ranges(self):
+        variants = pipeline.sample_variants(500, np.random.default_rng(2))
+
+        self.assertEqual({variant.mirror for variant in variants}, {False, True})
+        self.assertTrue(all(0 <= variant.rotate < 360 for variant in variants))
+        self.assertTrue(
+            all(0 <= value < 1000 for variant in variants for value in variant[2:])
+        )
+
+    def test_proxy_is_downscaled_and_keeps_transparency(self):
+        proxy = pipeline.variant_proxy(Image.new("LA", (1000, 500)), max_side=100)
+
+        self.assertEqual(proxy.shape, (50, 100, 4))
+
+
+class CropBoxTests(unittest.TestCase):
+    def test_boxes_are_scaled_from_the_proxy_to_the_source(self):
+        box = {"left": 70, "top": 35, "width": 560, "height": 140}
+
+        self.assertEqual(
+            pipeline.crop_box(box, (700, 175), (4000, 1000)), (400, 200, 3600, 1000)
+        )
+
+    def test_boxes_stay_inside_the_source(self):
+        self.assertEqual(
+            pipeline.crop_box(
+                {"left": -3, "top": 690, "width": 900, "height": 0.2},
+                (700, 700),
+                (1400, 1400),
+            ),
+            (0, 1380, 1400, 1381),
+        )
+
+
+class RenderFinalTests(unittest.TestCase):
+    def test_settings_are_applied_in_the_app_order(self):
+        generator = np.random.default_rng(3)
+        image = Image.fromarray(
+            generator.integers(0, 256, (21, 34, 3), dtype=np.uint8)
+        )
+        for variant in pipeline.sample_variants(4, generator):
+            with self.subTest(variant=variant):
+                settings = pipeline.EditSettings(
+                    False, variant.mirror, None, variant.rotate, tuple(variant[2:])
+                )
+                np.testing.assert_array_equal(
+                    np.asarray(pipeline.render_final(image, settings)),
+                    pillow_variant(image, variant),
+                )
+
+    def test_grayscale_takes_the_single_channel_path(self):
+        image = Image.fromarray(
+            np.random.default_rng(4).integers(0, 256, (19, 26, 3), dtype=np.uint8)
+        )
+        variant = pipeline.VariantParams(True, 45, 130, 300, 80, 160)
+        settings = pipeline.EditSettings(
+            False, True, "Grayscale", variant.rotate, tuple(variant[2:])
+        )
+
+        steps = list(pipeline.render_steps(image, settings))
+
+        self.assertTrue(all(step.mode == "L" for step in steps))
+        self.assertEqual(len(steps), 6)
+        np.testing.assert_array_equal(
+            np.asarray(steps[-1]),
+            pillow_variant(image.convert("L"), variant),
+        )
+
+    def test_black_and_white_images_skip_the_enhancements(self):
+        image = Image.linear_gradient("L").convert("RGB")
+        settings = pipeline.EditSettings(False, False, "Black & White", 90)
+
+        rendered = pipeline.render_final(image, settings)
+
+        self.assertEqual(rendered.mode, "1")
+        self.assertEqual(len(list(pipeline.render_steps(image, settings))), 2)
+
+
+class StageCacheTests(unittest.TestCase):
+    def test_matching_inputs_reuse_the_last_output(self):
+        cache = pipeline.StageCache()
+        compute = Mock(side_effect=["first", "second"])
+
+        key, output = cache.run("contrast", "input", 150, compute)
+        again = cache.run("contrast", "input", 150, compute)
+
+        self.assertEqual(again, (key, "first"))
+        self.assertEqual(compute.call_count, 1)
+
+    def test_changed_parameters_or_inputs_recompute_the_stage(self):
+        cache = pipeline.StageCache()
+        compute = Mock(side_effect=["first", "second", "third", "fourth"])
+
+        first_key, _output = cache.run("contrast", "input", 150, compute)
+        second_key, output = cache.run("contrast", "input", 160, compute)
+        self.assertEqual(output, "second")
+        third_key, output = cache.run("contrast", "other input", 160, compute)
+        self.assertEqual(output, "third")
+
+        self.assertEqual(len({first_key, second_key, third_key}), 3)
+        # Only the latest output of each stage is kept.
+        self.assertEqual(cache.run("contrast", "input", 150, compute)[1], "fourth")
+        self.assertEqual(compute.call_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,20 @@
 from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import BytesIO
 import ipaddress
 from pathlib import Path
 import socket
 import ssl
+import tempfile
+import threading
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import ANY, Mock, patch
 
-from PIL import Image
+import numpy as np
+from PIL import Image, JpegImagePlugin
 
+import disk_cache
+import dns_resolver
 import remote_image
 
 
@@ -46,12 +52,16 @@ class FakeHeaders:
 
 
 class FakeResponse:
-    def __init__(self, status=200, headers=None, chunks=None):
+    def __init__(self, status=200, headers=None, chunks=None, will_close=True):
         self.status = status
         self.headers = FakeHeaders(headers)
         self._chunks = list(chunks or [])
         self.read_calls = 0
         self.closed = False
+        self.will_close = will_close
+
+    def isclosed(self):
+        return self.closed or not self._chunks
 
     def read1(self, _amount):
         self.read_calls += 1
@@ -69,6 +79,7 @@ class FakeSocket:
         self.timeouts = []
         self.connected_to = None
         self.closed = False
+        self.shut_down = threading.Event()
 
     def settimeout(self, timeout):
         self.timeouts.append(timeout)
@@ -76,6 +87,9 @@ class FakeSocket:
     def connect(self, socket_address):
         self.connected_to = socket_address
 
+    def shutdown(self, _how):
+        self.shut_down.set()
+
     def getpeername(self):
         return self.peer
 
@@ -183,6 +197,16 @@ def scripted_transport(responses, resolver):
         }
 
 
+class RemoteImageTestCase(unittest.TestCase):
+    """Start every test with no remembered failures or open circuits."""
+
+    def setUp(self):
+        remote_image._NEGATIVE_CACHE.clear()
+        remote_image._CIRCUITS.clear()
+        self.addCleanup(remote_image._NEGATIVE_CACHE.clear)
+        self.addCleanup(remote_image._CIRCUITS.clear)
+
+
 class URLPolicyTests(unittest.TestCase):
     def test_accepts_http_https_default_ports_and_normalizes_host(self):
         http_target = remote_image._parse_target("HTTP://Example.COM:80/a?q=1")
@@ -325,7 +349,7 @@ class AddressPolicyTests(unittest.TestCase):
             remote_image._resolve_public_endpoints(self.target())
 
 
-class ConnectionPinningTests(unittest.TestCase):
+class ConnectionPinningTests(RemoteImageTestCase):
     def endpoint(self, address=PUBLIC_V4, port=80):
         return remote_image._Endpoint(
             socket.AF_INET,
@@ -367,8 +391,10 @@ class ConnectionPinningTests(unittest.TestCase):
         )
 
     def test_default_tls_context_verifies_certificates_and_hostnames(self):
-        self.assertEqual(remote_image._SNI_CONTEXT.verify_mode, ssl.CERT_REQUIRED)
-        self.assertTrue(remote_image._SNI_CONTEXT.check_hostname)
+        tls_context = remote_image._sni_context()
+
+        self.assertEqual(tls_context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(tls_context.check_hostname)
 
     def test_certificate_failure_closes_the_connected_socket(self):
         target = remote_image._parse_target("https://images.example/image.png")
@@ -410,7 +436,141 @@ class ConnectionPinningTests(unittest.TestCase):
         self.assertTrue(fake_socket.closed)
 
 
-class DeadlineTransportTests(unittest.TestCase):
+class ConnectionRacingTests(RemoteImageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.listeners = []
+        self.sockets = []
+
+    def tearDown(self):
+        for open_socket in self.sockets + self.listeners:
+            open_socket.close()
+
+    def listen(self, family, address, port=0, backlog=8):
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        listener.bind((address, port))
+        listener.listen(backlog)
+        self.listeners.append(listener)
+        return listener.getsockname()[1]
+
+    def stalled_listener(self, address, port=0):
+        # A full accept queue makes the kernel drop further SYNs, so the next
+        # connection attempt hangs like a blackholed address.
+        port = self.listen(socket.AF_INET, address, port, backlog=0)
+        filler = socket.create_connection((address, port), timeout=1)
+        self.sockets.append(filler)
+        return port
+
+    def endpoint(self, address, port):
+        if ":" in address:
+            return remote_image._Endpoint(
+                socket.AF_INET6,
+                socket.SOCK_STREAM,
+                socket.IPPROTO_TCP,
+                (address, port, 0, 0),
+                address,
+            )
+        return remote_image._Endpoint(
+            socket.AF_INET,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            (address, port),
+            address,
+        )
+
+    def target(self, port):
+        return remote_image._Target(
+            "http", "public.test", port, "public.test", "/", "http://public.test/"
+        )
+
+    def recording_start_connect(self):
+        started = []
+        real_start = remote_image._start_connect
+
+        def start(endpoint):
+            attempt = real_start(endpoint)
+            started.append(attempt)
+            return attempt
+
+        return started, patch("remote_image._start_connect", side_effect=start)
+
+    def test_endpoints_interleave_address_families(self):
+        v6_a, v6_b = self.endpoint("2001:db8::1", 80), self.endpoint("2001:db8::2", 80)
+        v4_a, v4_b = self.endpoint("192.0.2.1", 80), self.endpoint("192.0.2.2", 80)
+
+        ordered = remote_image._interleave_endpoints((v6_a, v6_b, v4_a, v4_b))
+
+        self.assertEqual(ordered, (v6_a, v4_a, v6_b, v4_b))
+
+    def test_stalled_endpoint_is_overtaken_and_closed(self):
+        port = self.stalled_listener("127.0.0.1")
+        self.listen(socket.AF_INET6, "::1", port)
+        endpoints = (self.endpoint("127.0.0.1", port), self.endpoint("::1", port))
+        started, start_patch = self.recording_start_connect()
+
+        with start_patch, patch(
+            "remote_image.CONNECTION_ATTEMPT_DELAY_SECONDS", 0.05
+        ):
+            began = remote_image.time.monotonic()
+            winner = remote_image._open_connected_socket(
+                self.target(port), endpoints, began + 5
+            )
+            elapsed = remote_image.time.monotonic() - began
+        self.sockets.append(winner)
+
+        self.assertEqual(winner.getpeername()[0], "::1")
+        self.assertLess(elapsed, remote_image.CONNECT_TIMEOUT_SECONDS)
+        self.assertEqual(len(started), 2)
+        self.assertEqual(started[0].fileno(), -1)
+        self.assertIs(started[1], winner)
+        self.assertIsNotNone(winner.gettimeout())
+
+    def test_refused_endpoint_falls_back_without_waiting_for_the_delay(self):
+        port = self.listen(socket.AF_INET, "127.0.0.1")
+        endpoints = (self.endpoint("::1", port), self.endpoint("127.0.0.1", port))
+
+        with patch("remote_image.CONNECTION_ATTEMPT_DELAY_SECONDS", 5):
+            began = remote_image.time.monotonic()
+            winner = remote_image._open_connected_socket(
+                self.target(port), endpoints, began + 10
+            )
+            elapsed = remote_image.time.monotonic() - began
+        self.sockets.append(winner)
+
+        self.assertEqual(winner.getpeername()[0], "127.0.0.1")
+        self.assertLess(elapsed, 1)
+
+    def test_all_failed_attempts_are_normalized(self):
+        port = self.listen(socket.AF_INET, "127.0.0.1")
+        self.listeners.pop().close()
+        endpoints = (self.endpoint("::1", port), self.endpoint("127.0.0.1", port))
+        started, start_patch = self.recording_start_connect()
+
+        with start_patch, self.assertRaises(remote_image.ImageDownloadError):
+            remote_image._open_connected_socket(
+                self.target(port), endpoints, remote_image.time.monotonic() + 5
+            )
+
+        self.assertTrue(all(attempt.fileno() == -1 for attempt in started))
+
+    def test_peer_verification_failure_aborts_the_race(self):
+        port = self.listen(socket.AF_INET, "127.0.0.1")
+        endpoints = (
+            self.endpoint("127.0.0.1", port),
+            self.endpoint("::1", port),
+        )
+        target = self.target(port)._replace(port=port + 1)
+        started, start_patch = self.recording_start_connect()
+
+        with start_patch, self.assertRaises(remote_image.UnsafeImageURL):
+            remote_image._open_connected_socket(
+                target, endpoints, remote_image.time.monotonic() + 5
+            )
+
+        self.assertTrue(all(attempt.fileno() == -1 for attempt in started))
+
+
+class DeadlineTransportTests(RemoteImageTestCase):
     def test_real_http_parser_cannot_slow_drip_headers_past_total_deadline(self):
         clock = {"value": 0.0}
         raw_socket = SlowHeaderSocket(
@@ -460,7 +620,184 @@ class DeadlineTransportTests(unittest.TestCase):
         self.assertTrue(fake_socket.closed)
 
 
-class FetchWorkflowTests(unittest.TestCase):
+class KeepAliveImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.request_headers.append(dict(self.headers))
+        if self.path == "/start":
+            self.send_response(302)
+            self.send_header("Location", "/a.png")
+            self.send_header("Content-Length", "5")
+            self.end_headers()
+            self.wfile.write(b"moved")
+            return
+        body = self.server.body
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.server.close_after_response
+
+    def log_message(self, *_args):
+        return None
+
+
+class ConnectionPoolTests(RemoteImageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveImageHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.server.request_headers = []
+        self.server.body = b"image-bytes"
+        self.server.close_after_response = False
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.05}
+        )
+        self.server_thread.start()
+        port = self.server.server_address[1]
+        self.target = remote_image._Target(
+            "http", "public.test", port, "public.test", "/a.png", "http://public.test/"
+        )
+        self.endpoint = remote_image._Endpoint(
+            socket.AF_INET,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            ("127.0.0.1", port),
+            "127.0.0.1",
+        )
+        self.pool = remote_image._ConnectionPool(4, 2, 30)
+        patches = [
+            patch("remote_image._CONNECTION_POOL", self.pool),
+            patch(
+                "remote_image._resolve_public_endpoints",
+                return_value=(self.endpoint,),
+            ),
+        ]
+        for active in patches:
+            active.start()
+            self.addCleanup(active.stop)
+
+    def tearDown(self):
+        self.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join(5)
+
+    def download(self):
+        return remote_image._download_once(
+            self.target, remote_image.time.monotonic() + 5
+        )
+
+    def test_keep_alive_connection_is_reused_for_the_same_validated_peer(self):
+        first = self.download()
+        second = self.download()
+
+        self.assertEqual(first[:3], (b"image-bytes", None, "image/png"))
+        self.assertEqual(second, first)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.request_headers), 2)
+        self.assertEqual(
+            self.server.request_headers[0]["Connection"], "keep-alive"
+        )
+
+    def test_same_host_redirect_reuses_the_drained_connection(self):
+        redirect_target = self.target._replace(request_target="/start")
+
+        redirect = remote_image._download_once(
+            redirect_target, remote_image.time.monotonic() + 5
+        )
+        final = self.download()
+
+        self.assertEqual(redirect[:3], (None, "/a.png", None))
+        self.assertEqual(final[0], b"image-bytes")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pooled_socket_is_not_used_for_a_different_validated_peer(self):
+        self.download()
+        other = remote_image._PoolKey("http", "public.test", PUBLIC_V4)
+
+        self.assertIsNone(self.pool.acquire([other]))
+        self.assertIsNotNone(
+            self.pool.acquire(
+                [remote_image._PoolKey("http", "public.test", "127.0.0.1")]
+            )
+        )
+
+    def test_expired_idle_connections_are_closed_not_reused(self):
+        expiring_pool = remote_image._ConnectionPool(4, 2, 0)
+        with patch("remote_image._CONNECTION_POOL", expiring_pool):
+            self.download()
+            self.download()
+
+        self.assertEqual(self.server.connections, 2)
+
+    def test_connection_closed_by_server_is_replaced(self):
+        self.server.close_after_response = True
+        self.download()
+        wait_until(lambda: not remote_image._socket_is_idle(self.pool._idle[0][1]))
+
+        self.assertEqual(self.download()[0], b"image-bytes")
+        self.assertEqual(self.server.connections, 2)
+
+    def test_stale_connection_failure_is_retried_on_a_fresh_connection(self):
+        self.server.close_after_response = True
+        self.download()
+        wait_until(lambda: not remote_image._socket_is_idle(self.pool._idle[0][1]))
+
+        with patch("remote_image._socket_is_idle", return_value=True):
+            self.assertEqual(self.download()[0], b"image-bytes")
+        self.assertEqual(self.server.connections, 2)
+
+    def test_server_requested_close_is_not_pooled(self):
+        response = FakeResponse(
+            headers={"Content-Type": "image/png", "Content-Length": "3"},
+            chunks=[b"abc"],
+            will_close=True,
+        )
+        with scripted_transport([response], queued_resolver()):
+            remote_image._exchange(self.target, FakeSocket(), 10**9)
+
+        self.assertEqual(self.pool._idle, [])
+
+    def test_tls_sessions_are_offered_on_repeat_handshakes(self):
+        target = remote_image._parse_target("https://images.example/image.png")
+        endpoint = remote_image._Endpoint(
+            socket.AF_INET,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            (PUBLIC_V4, 443),
+            PUBLIC_V4,
+        )
+        session = object()
+        tls_socket = Mock(spec=ssl.SSLSocket)
+        tls_socket.session = session
+        tls_context = Mock()
+        tls_context.wrap_socket.return_value = tls_socket
+
+        with patch("remote_image._SNI_CONTEXT", tls_context), patch(
+            "remote_image._TLS_SESSIONS", remote_image.OrderedDict()
+        ), patch("remote_image.time.monotonic", return_value=0):
+            for _attempt in range(2):
+                remote_image._finish_connection(
+                    target, endpoint, FakeSocket(peer=(PUBLIC_V4, 443)), 10
+                )
+
+        first_call, second_call = tls_context.wrap_socket.call_args_list
+        self.assertEqual(first_call.kwargs, {"server_hostname": "images.example"})
+        self.assertEqual(
+            second_call.kwargs,
+            {"server_hostname": "images.example", "session": session},
+        )
+
+
+class FetchWorkflowTests(RemoteImageTestCase):
     @classmethod
     def setUpClass(cls):
         output = BytesIO()
@@ -622,7 +959,913 @@ class FetchWorkflowTests(unittest.TestCase):
         self.assertEqual(image.size, (2, 3))
 
 
-class BodyAndImageLimitTests(unittest.TestCase):
+def png_bytes(image):
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def random_image(size, seed=0):
+    width, height = size
+    return Image.fromarray(
+        np.random.default_rng(seed).integers(0, 256, (height, width, 3), np.uint8)
+    )
+
+
+def wait_until(predicate, timeout=5):
+    deadline = remote_image.time.monotonic() + timeout
+    while not predicate():
+        if remote_image.time.monotonic() > deadline:
+            raise AssertionError("Condition was not reached in time")
+        threading.Event().wait(0.005)
+
+
+class SingleFlightTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 3), (10, 20, 30)).save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def test_concurrent_identical_fetches_share_one_download(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_fetch(target, _deadline, _max_side=None):
+            calls.append(target.normalized_url)
+            release.wait(5)
+            return remote_image._decode_image(self.png, "image/png")
+
+        results = []
+        flights = remote_image._FETCH_FLIGHTS._flights
+        key = "http://public.test/image.png"
+
+        with patch("remote_image._fetch_target", side_effect=slow_fetch):
+            threads = [
+                threading.Thread(
+                    target=lambda url=url: results.append(
+                        remote_image.fetch_image_from_url(url)
+                    )
+                )
+                for url in (key, "HTTP://PUBLIC.test:80/image.png", key)
+            ]
+            threads[0].start()
+            wait_until(lambda: key in flights)
+            for thread in threads[1:]:
+                thread.start()
+            wait_until(lambda: flights[key].waiters == 2)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(calls, [key])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len({id(image) for image in results}), 3)
+        self.assertTrue(all(image.size == (2, 3) for image in results))
+        self.assertEqual(flights, {})
+
+    def test_waiter_is_bounded_by_its_own_deadline(self):
+        flights = remote_image._SingleFlight("test")
+        release = threading.Event()
+        leader = threading.Thread(
+            target=flights.do,
+            args=("key", lambda: release.wait(5), remote_image.time.monotonic() + 30),
+        )
+        leader.start()
+        try:
+            wait_until(lambda: "key" in flights._flights)
+            with self.assertRaises(remote_image.ImageDownloadError):
+                flights.do(
+                    "key",
+                    lambda: self.fail("waiter must not run the operation"),
+                    remote_image.time.monotonic() + 0.05,
+                )
+        finally:
+            release.set()
+            leader.join(5)
+
+    def test_waiters_receive_their_own_copy_of_the_leader_error(self):
+        flights = remote_image._SingleFlight("test")
+        release = threading.Event()
+        errors = []
+
+        def failing_operation():
+            release.wait(5)
+            raise remote_image.InvalidImageData("bad image")
+
+        def call():
+            try:
+                flights.do("key", failing_operation, remote_image.time.monotonic() + 30)
+            except remote_image.ImageFetchError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        threads[0].start()
+        wait_until(lambda: "key" in flights._flights)
+        threads[1].start()
+        wait_until(lambda: flights._flights["key"].waiters == 1)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(
+            all(isinstance(error, remote_image.InvalidImageData) for error in errors)
+        )
+        self.assertIsNot(errors[0], errors[1])
+
+    def test_concurrent_lookups_for_one_host_share_the_resolver_call(self):
+        release = threading.Event()
+
+        def slow_resolve(_hostname, port, *_args):
+            release.wait(5)
+            return [address_answer(PUBLIC_V4, port)]
+
+        resolver = Mock(side_effect=slow_resolve)
+        target = remote_image._parse_target("http://public.test/image.png")
+        lookups = remote_image._DNS_LOOKUPS._lookups
+        results = []
+
+        with patch("remote_image.socket.getaddrinfo", resolver):
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(
+                        remote_image._resolve_public_endpoints(target)
+                    )
+                )
+                for _ in range(3)
+            ]
+            for thread in threads:
+                thread.start()
+            wait_until(lambda: lookups.get(("public.test", 80), [None, 0])[1] == 3)
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(resolver.call_count, 1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(lookups, {})
+
+
+class SlowBodyResponse(FakeResponse):
+    """Returns its chunks, then times out reading the rest of the body."""
+
+    def read1(self, amount):
+        if self._chunks:
+            return super().read1(amount)
+        raise socket.timeout("timed out")
+
+
+class StallingResponse(FakeResponse):
+    """Returns its chunks, then blocks until the fetch's socket is shut down."""
+
+    def __init__(self, headers, chunks):
+        super().__init__(headers=headers, chunks=chunks)
+        self.stalled = threading.Event()
+        self.sockets = []
+
+    def read1(self, amount):
+        if self._chunks:
+            return super().read1(amount)
+        self.stalled.set()
+        self.sockets[-1].shut_down.wait(5)
+        return b""
+
+
+class BackgroundFetchTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 3), (10, 20, 30)).save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def test_progress_counts_body_bytes_against_the_declared_length(self):
+        headers = {"Content-Type": "image/png", "Content-Length": str(len(self.png))}
+        chunks = [self.png[:10], self.png[10:]]
+        url = "http://public.test/progress.png"
+
+        with scripted_transport(
+            [FakeResponse(headers=headers, chunks=chunks)], queued_resolver([PUBLIC_V4])
+        ):
+            load = remote_image.run_in_background(
+                lambda: remote_image.fetch_image_from_url(url)
+            )
+            image = load.result(5)
+
+        self.assertEqual(image.size, (2, 3))
+        self.assertEqual(
+            load.progress(), remote_image.FetchProgress(len(self.png), len(self.png))
+        )
+        self.assertFalse(load.cancelled)
+
+    def test_cancel_shuts_down_the_socket_and_remembers_nothing(self):
+        headers = {"Content-Type": "image/png", "Content-Length": str(len(self.png))}
+        url = "http://public.test/cancelled.png"
+        response = StallingResponse(headers, [self.png[:10]])
+
+        with scripted_transport(
+            [response], queued_resolver([PUBLIC_V4])
+        ) as transport:
+            response.sockets = transport["sockets"]
+            load = remote_image.run_in_background(
+                lambda: remote_image.fetch_image_from_url(url)
+            )
+            wait_until(response.stalled.is_set)
+            self.assertEqual(
+                load.progress(), remote_image.FetchProgress(10, len(self.png))
+            )
+
+            load.cancel()
+            with self.assertRaises(remote_image.FetchCancelled):
+                load.result(5)
+
+        self.assertTrue(response.sockets[0].shut_down.is_set())
+        self.assertTrue(response.sockets[0].closed)
+        self.assertEqual(len(remote_image._NEGATIVE_CACHE._failures), 0)
+        self.assertEqual(remote_image._CIRCUITS.open_count(), 0)
+
+    def test_waiters_retry_when_the_leading_fetch_is_cancelled(self):
+        flights = remote_image._SingleFlight("test")
+        release = threading.Event()
+        deadline = remote_image.time.monotonic() + 30
+
+        def leader_operation():
+            release.wait(5)
+            remote_image._check_cancelled()
+            return "leader"
+
+        leader = remote_image.run_in_background(
+            lambda: flights.do("key", leader_operation, deadline)
+        )
+        wait_until(lambda: "key" in flights._flights)
+        waiter = remote_image._BATCH_EXECUTOR.submit(
+            flights.do, "key", lambda: "waiter", deadline
+        )
+        wait_until(lambda: flights._flights["key"].waiters == 1)
+
+        leader.cancel()
+        release.set()
+        with self.assertRaises(remote_image.FetchCancelled):
+            leader.result(5)
+        self.assertEqual(waiter.result(5), "waiter")
+
+    def test_cancelled_waiters_stop_waiting(self):
+        flights = remote_image._SingleFlight("test")
+        release = threading.Event()
+        self.addCleanup(release.set)
+        deadline = remote_image.time.monotonic() + 30
+        leader = remote_image._BATCH_EXECUTOR.submit(
+            flights.do, "key", lambda: release.wait(5), deadline
+        )
+        wait_until(lambda: "key" in flights._flights)
+        waiter = remote_image.run_in_background(
+            lambda: flights.do("key", lambda: self.fail("must not run"), deadline)
+        )
+        wait_until(lambda: flights._flights["key"].waiters == 1)
+
+        waiter.cancel()
+        with self.assertRaises(remote_image.FetchCancelled):
+            waiter.result(1)
+        release.set()
+        self.assertTrue(leader.result(5))
+
+
+class BatchFetchTests(RemoteImageTestCase):
+    def test_results_and_failures_are_reported_per_url(self):
+        def fake_fetch(url):
+            if "bad" in url:
+                raise remote_image.InvalidImageData("not an image")
+            if "boom" in url:
+                raise RuntimeError("unexpected")
+            return Image.new("RGB", (1, 1))
+
+        urls = [
+            "http://a.test/1.png",
+            "ftp://a.test/2.png",
+            "http://b.test/bad.png",
+            "http://c.test/boom.png",
+        ]
+        with patch("remote_image.fetch_image_from_url", side_effect=fake_fetch):
+            results = sorted(remote_image.fetch_images_from_urls(urls))
+
+        self.assertEqual([result.url for result in results], urls)
+        self.assertEqual(results[0].image.size, (1, 1))
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, remote_image.InvalidImageURL)
+        self.assertIsInstance(results[2].error, remote_image.InvalidImageData)
+        self.assertIsInstance(results[3].error, remote_image.ImageDownloadError)
+        self.assertTrue(all(result.image is None for result in results[1:]))
+
+    def test_hosts_take_turns_within_worker_and_per_host_limits(self):
+        lock = threading.Lock()
+        started = []
+        active = {"all": 0, "max_all": 0}
+        per_host = {}
+
+        def fake_fetch(url):
+            host = url.split("/")[2]
+            with lock:
+                started.append(host)
+                active["all"] += 1
+                per_host[host] = per_host.get(host, 0) + 1
+                active["max_all"] = max(active["max_all"], active["all"])
+                active.setdefault("max_host", 0)
+                active["max_host"] = max(active["max_host"], per_host[host])
+            threading.Event().wait(0.02)
+            with lock:
+                active["all"] -= 1
+                per_host[host] -= 1
+            return Image.new("RGB", (1, 1))
+
+        urls = ["http://busy.test/{}.png".format(index) for index in range(6)]
+        urls += ["http://quiet.test/1.png", "http://other.test/1.png"]
+        with patch("remote_image.fetch_image_from_url", side_effect=fake_fetch):
+            results = list(
+                remote_image.fetch_images_from_urls(urls, max_workers=3, max_per_host=1)
+            )
+
+        self.assertEqual(len(results), 8)
+        self.assertEqual(active["max_host"], 1)
+        self.assertLessEqual(active["max_all"], 3)
+        self.assertEqual(set(started[:3]), {"busy.test", "quiet.test", "other.test"})
+
+    def test_cancelling_a_background_batch_stops_the_downloads_in_flight(self):
+        started, stopped = [], []
+
+        def fake_fetch(url):
+            started.append(url)
+            try:
+                for _tick in range(500):
+                    remote_image._check_cancelled()
+                    threading.Event().wait(0.01)
+                return Image.new("RGB", (1, 1))
+            finally:
+                stopped.append(url)
+
+        urls = ["http://{}.test/1.png".format(host) for host in "abcd"]
+        with patch("remote_image.fetch_image_from_url", side_effect=fake_fetch):
+            handle = remote_image.run_in_background(
+                lambda: list(remote_image.fetch_images_from_urls(urls, max_workers=2))
+            )
+            wait_until(lambda: len(started) == 2)
+            handle.cancel()
+
+            with self.assertRaises(remote_image.FetchCancelled):
+                handle.result(5)
+            wait_until(lambda: len(stopped) == 2, timeout=1)
+
+        self.assertEqual(len(started), 2)
+
+
+class FetchTraceTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 3), (10, 20, 30)).save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def test_trace_records_every_phase_of_a_redirected_fetch(self):
+        redirect = FakeResponse(status=302, headers={"Location": "/final.png"})
+        success = FakeResponse(
+            headers={"Content-Type": "image/png"},
+            chunks=[self.png[:10], self.png[10:]],
+        )
+        resolver = queued_resolver([PUBLIC_V4], [PUBLIC_V4])
+        streamed, spans = [], []
+        trace = remote_image.FetchTrace(
+            on_event=streamed.append, on_finish=spans.append
+        )
+
+        with scripted_transport([redirect, success], resolver):
+            remote_image.fetch_image_from_url(
+                "http://public.test/start.png", trace=trace
+            )
+
+        names = [event.name for event in trace.events]
+        self.assertEqual(
+            names,
+            [
+                "fetch.start",
+                "dns.start",
+                "dns.end",
+                "connection",
+                "request.sent",
+                "response.headers",
+                "redirect",
+                "dns.start",
+                "dns.end",
+                "connection",
+                "request.sent",
+                "response.headers",
+                "body.chunk",
+                "body.chunk",
+                "body.end",
+                "decode.start",
+                "decode.end",
+                "fetch.end",
+            ],
+        )
+        timestamps = [event.timestamp for event in trace.events]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(streamed, trace.events)
+
+        span = spans[0]
+        self.assertEqual(span["url"], "http://public.test/start.png")
+        self.assertEqual(span["redirects"], 1)
+        self.assertEqual(span["bytes"], len(self.png))
+        self.assertEqual(span["endpoint"], PUBLIC_V4)
+        self.assertIsNone(span["error"])
+        self.assertEqual(span["events"][0]["offset"], 0)
+        self.assertEqual(span["events"][2]["addresses"], [PUBLIC_V4])
+
+    def test_failed_fetch_reports_the_error_class_in_the_span(self):
+        spans = []
+        with patch(
+            "remote_image.socket.getaddrinfo",
+            side_effect=socket.gaierror("not found"),
+        ), self.assertRaises(remote_image.ImageDownloadError):
+            remote_image.fetch_image_from_url(
+                "http://public.test/image.png",
+                trace=remote_image.FetchTrace(on_finish=spans.append),
+            )
+
+        span = spans[0]
+        self.assertEqual(span["error"], "ImageDownloadError")
+        self.assertEqual(span["events"][2]["name"], "dns.end")
+        self.assertEqual(span["events"][2]["error"], "gaierror")
+
+    def test_connection_attempts_and_tls_are_traced(self):
+        target = remote_image._parse_target("https://images.example/image.png")
+        endpoint = remote_image._Endpoint(
+            socket.AF_INET,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            (PUBLIC_V4, 443),
+            PUBLIC_V4,
+        )
+        fake_socket = FakeSocket(peer=(PUBLIC_V4, 443))
+        tls_context = Mock()
+        tls_context.wrap_socket.return_value = fake_socket
+        trace = remote_image.FetchTrace()
+        token = remote_image._ACTIVE_TRACE.set(trace)
+        try:
+            with patch(
+                "remote_image.socket.socket", return_value=fake_socket
+            ), patch("remote_image._SNI_CONTEXT", tls_context), patch(
+                "remote_image.time.monotonic", return_value=0
+            ):
+                remote_image._connect_endpoint(target, endpoint, 10)
+        finally:
+            remote_image._ACTIVE_TRACE.reset(token)
+
+        self.assertEqual(
+            [(event.name, event.fields.get("address")) for event in trace.events],
+            [
+                ("connect.start", PUBLIC_V4),
+                ("connect.end", PUBLIC_V4),
+                ("tls.start", None),
+                ("tls.end", None),
+            ],
+        )
+
+    def test_untraced_fetches_record_nothing(self):
+        self.assertIsNone(remote_image._ACTIVE_TRACE.get())
+        remote_image._trace("dns.start", hostname="public.test")
+
+
+class FailureIsolationTests(RemoteImageTestCase):
+    def unreachable_host(self, attempts):
+        resolver = queued_resolver(*[[PUBLIC_V4]] * attempts)
+        return patch("remote_image.socket.getaddrinfo", resolver), patch(
+            "remote_image._open_connected_socket",
+            side_effect=remote_image.ImageConnectionError("unreachable"),
+        )
+
+    def test_deterministic_failures_are_remembered_for_a_short_time(self):
+        not_an_image = FakeResponse(
+            headers={"Content-Type": "image/png"}, chunks=[b"not an image"]
+        )
+        with scripted_transport(
+            [not_an_image], queued_resolver([PUBLIC_V4])
+        ) as transport:
+            for _attempt in range(3):
+                with self.assertRaises(remote_image.InvalidImageData):
+                    remote_image.fetch_image_from_url("http://public.test/a.png")
+
+        self.assertEqual(len(transport["connections"]), 1)
+
+        expired = remote_image._NegativeCache(0, 16)
+        expired.remember("http://public.test/a.png", remote_image.ImageTooLarge())
+        expired.check("http://public.test/a.png")
+
+    def test_transient_failures_are_not_remembered(self):
+        resolver_patch, open_patch = self.unreachable_host(2)
+        with resolver_patch, open_patch as opened:
+            for _attempt in range(2):
+                with self.assertRaises(remote_image.ImageConnectionError):
+                    remote_image.fetch_image_from_url("http://public.test/a.png")
+
+        self.assertEqual(opened.call_count, 2)
+
+    def test_repeated_connection_failures_open_the_circuit_for_the_host(self):
+        resolver_patch, open_patch = self.unreachable_host(3)
+        with resolver_patch, open_patch as opened:
+            for index in range(3):
+                with self.assertRaises(remote_image.ImageConnectionError):
+                    remote_image.fetch_image_from_url(
+                        "http://public.test/{}.png".format(index)
+                    )
+            with self.assertRaises(remote_image.ImageHostUnavailable):
+                remote_image.fetch_image_from_url("http://public.test/other.png")
+
+        self.assertEqual(opened.call_count, 3)
+        self.assertEqual(remote_image._CIRCUITS.open_count(), 1)
+
+    def test_http_errors_do_not_trip_the_circuit(self):
+        responses = [FakeResponse(status=404) for _attempt in range(4)]
+        with scripted_transport(
+            responses, queued_resolver(*[[PUBLIC_V4]] * 4)
+        ) as transport:
+            for _attempt in range(4):
+                with self.assertRaises(remote_image.ImageDownloadError) as raised:
+                    remote_image.fetch_image_from_url("http://public.test/a.png")
+                self.assertNotIsInstance(
+                    raised.exception, remote_image.ImageHostUnavailable
+                )
+
+        self.assertEqual(len(transport["connections"]), 4)
+
+    def test_half_open_circuit_admits_one_probe_and_closes_on_success(self):
+        breaker = remote_image._CircuitBreaker(2, 30, 16)
+        for _attempt in range(2):
+            with self.assertRaises(remote_image.ImageConnectionError):
+                with breaker.guard("host.test"):
+                    raise remote_image.ImageConnectionError()
+
+        with patch(
+            "remote_image.time.monotonic",
+            return_value=remote_image.time.monotonic() + 31,
+        ):
+            with breaker.guard("host.test"):
+                with self.assertRaises(remote_image.ImageHostUnavailable):
+                    with breaker.guard("host.test"):
+                        self.fail("only one probe may run at a time")
+            with breaker.guard("host.test"), breaker.guard("host.test"):
+                pass
+
+        self.assertEqual(breaker.open_count(), 0)
+
+    def test_failed_probe_reopens_the_circuit(self):
+        breaker = remote_image._CircuitBreaker(1, 30, 16)
+        with self.assertRaises(remote_image.ImageConnectionError):
+            with breaker.guard("host.test"):
+                raise remote_image.ImageConnectionError()
+        later = remote_image.time.monotonic() + 31
+
+        with patch("remote_image.time.monotonic", return_value=later):
+            with self.assertRaises(remote_image.ImageConnectionError):
+                with breaker.guard("host.test"):
+                    raise remote_image.ImageConnectionError()
+            with self.assertRaises(remote_image.ImageHostUnavailable):
+                with breaker.guard("host.test"):
+                    pass
+
+    def test_timeouts_and_local_overload_leave_the_circuit_alone(self):
+        breaker = remote_image._CircuitBreaker(2, 30, 16)
+        errors = (
+            remote_image.ImageConnectionError,
+            remote_image.ImageTimeout,
+            remote_image.FetchOverloaded,
+            remote_image.ImageConnectionError,
+        )
+        for error in errors:
+            with self.assertRaises(error):
+                with breaker.guard("host.test"):
+                    raise error()
+        self.assertEqual(breaker.open_count(), 1)
+        later = remote_image.time.monotonic() + 31
+
+        with patch("remote_image.time.monotonic", return_value=later):
+            for error in (remote_image.ImageTimeout, remote_image.FetchOverloaded):
+                with self.assertRaises(error):
+                    with breaker.guard("host.test"):
+                        raise error()
+            with breaker.guard("host.test"):
+                pass
+
+        self.assertEqual(breaker.open_count(), 0)
+
+    def test_slow_downloads_time_out_without_tripping_the_circuit(self):
+        headers = {"Content-Type": "image/png", "Content-Length": "100"}
+        responses = [
+            SlowBodyResponse(headers=headers, chunks=[b"partial"])
+            for _attempt in range(4)
+        ]
+        with scripted_transport(responses, queued_resolver(*[[PUBLIC_V4]] * 4)):
+            for _attempt in range(4):
+                with self.assertRaises(remote_image.ImageTimeout):
+                    remote_image.fetch_image_from_url("http://public.test/a.png")
+
+        self.assertEqual(remote_image._CIRCUITS.open_count(), 0)
+
+    def test_a_saturated_resolver_is_reported_as_local_overload(self):
+        with patch(
+            "remote_image._start_lookup",
+            side_effect=dns_resolver.ResolverSaturated("full"),
+        ):
+            with self.assertRaises(remote_image.FetchOverloaded):
+                remote_image.fetch_image_from_url("http://public.test/a.png")
+
+
+class ResponseCacheTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 3), (10, 20, 30)).save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        self.cache = remote_image._ResponseCache(1024 * 1024, 1024 * 1024)
+        active = patch("remote_image._RESPONSE_CACHE", self.cache)
+        active.start()
+        self.addCleanup(active.stop)
+
+    def image_response(self, **headers):
+        return FakeResponse(
+            headers={"Content-Type": "image/png", **headers}, chunks=[self.png]
+        )
+
+    def test_fresh_entry_is_served_without_network_or_decoding(self):
+        decode = Mock(wraps=remote_image._decode_image)
+        with scripted_transport(
+            [self.image_response(**{"Cache-Control": "max-age=60"})],
+            queued_resolver([PUBLIC_V4]),
+        ), patch("remote_image._decode_image", decode):
+            first = remote_image.fetch_image_from_url("http://public.test/a.png")
+            second = remote_image.fetch_image_from_url("http://PUBLIC.test/a.png")
+
+        self.assertEqual(decode.call_count, 1)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.getpixel((0, 0)), (10, 20, 30))
+
+    def test_uncacheable_responses_are_fetched_every_time(self):
+        for headers in (
+            {"Cache-Control": "no-store, max-age=60"},
+            {"Cache-Control": "private, max-age=60"},
+            {"Cache-Control": "max-age=60", "Vary": "*"},
+            {},
+        ):
+            with self.subTest(headers=headers), scripted_transport(
+                [self.image_response(**headers), self.image_response(**headers)],
+                queued_resolver([PUBLIC_V4], [PUBLIC_V4]),
+            ) as transport:
+                remote_image.fetch_image_from_url("http://public.test/a.png")
+                remote_image.fetch_image_from_url("http://public.test/a.png")
+
+                self.assertEqual(len(transport["connections"]), 2)
+                self.assertEqual(self.cache.size_bytes, 0)
+
+    def test_stale_entry_is_revalidated_with_a_conditional_request(self):
+        stored = self.image_response(
+            **{
+                "Cache-Control": "no-cache",
+                "ETag": '"v1"',
+                "Last-Modified": "Tue, 15 Nov 1994 12:45:26 GMT",
+            }
+        )
+        not_modified = FakeResponse(
+            status=304, headers={"Cache-Control": "max-age=60"}
+        )
+        decode = Mock(wraps=remote_image._decode_image)
+        with scripted_transport(
+            [stored, not_modified],
+            queued_resolver([PUBLIC_V4], [PUBLIC_V4]),
+        ) as transport, patch("remote_image._decode_image", decode):
+            remote_image.fetch_image_from_url("http://public.test/a.png")
+            revalidated = remote_image.fetch_image_from_url("http://public.test/a.png")
+            remote_image.fetch_image_from_url("http://public.test/a.png")
+
+        first_headers = transport["connections"][0].requests[0][2]
+        conditional = transport["connections"][1].requests[0][2]
+        self.assertNotIn("If-None-Match", first_headers)
+        self.assertEqual(conditional["If-None-Match"], '"v1"')
+        self.assertEqual(
+            conditional["If-Modified-Since"], "Tue, 15 Nov 1994 12:45:26 GMT"
+        )
+        self.assertEqual(revalidated.size, (2, 3))
+        self.assertEqual(decode.call_count, 1)
+
+    def test_changed_resource_replaces_the_stale_entry(self):
+        output = BytesIO()
+        Image.new("RGB", (4, 4)).save(output, format="PNG")
+        changed = FakeResponse(
+            headers={"Content-Type": "image/png", "ETag": '"v2"'},
+            chunks=[output.getvalue()],
+        )
+        with scripted_transport(
+            [self.image_response(ETag='"v1"'), changed],
+            queued_resolver([PUBLIC_V4], [PUBLIC_V4]),
+        ):
+            remote_image.fetch_image_from_url("http://public.test/a.png")
+            image = remote_image.fetch_image_from_url("http://public.test/a.png")
+
+        self.assertEqual(image.size, (4, 4))
+        entry = self.cache.get("http://public.test/a.png")
+        self.assertEqual(entry.etag, '"v2"')
+        self.assertEqual(self.cache.size_bytes, len(output.getvalue()))
+
+    def test_unsolicited_not_modified_is_an_error(self):
+        with scripted_transport(
+            [FakeResponse(status=304)], queued_resolver([PUBLIC_V4])
+        ), self.assertRaises(remote_image.ImageDownloadError):
+            remote_image.fetch_image_from_url("http://public.test/a.png")
+
+    def test_disk_tier_serves_responses_and_decodes_after_a_restart(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        disk = disk_cache.DiskCache(directory.name)
+        decode = Mock(wraps=remote_image._decode_image)
+        with patch(
+            "remote_image.disk_cache.shared_disk_cache", return_value=disk
+        ), patch("remote_image._decode_image", decode):
+            with scripted_transport(
+                [self.image_response(**{"Cache-Control": "max-age=60"})],
+                queued_resolver([PUBLIC_V4]),
+            ):
+                remote_image.fetch_image_from_url("http://public.test/a.png")
+
+            with patch(
+                "remote_image._RESPONSE_CACHE",
+                remote_image._ResponseCache(1024 * 1024, 1024 * 1024),
+            ), scripted_transport([], queued_resolver()):
+                restored = remote_image.fetch_image_from_url(
+                    "http://public.test/a.png"
+                )
+
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(restored.getpixel((1, 2)), (10, 20, 30))
+
+    def test_identical_bodies_are_stored_and_decoded_once(self):
+        policy = remote_image._CachePolicy(True, 60, None, None)
+        first = self.cache.put("http://a.test/1.png", self.png, "image/png", policy)
+        second = self.cache.put("http://b.test/2.png", self.png, "image/png", policy)
+
+        self.assertEqual(first.digest, second.digest)
+        self.assertIs(first.body, second.body)
+        self.assertEqual(self.cache.size_bytes, len(self.png))
+        decoded = remote_image._image_from_entry(first)
+        self.assertIs(remote_image._image_from_entry(second), decoded)
+
+        self.cache.discard("http://a.test/1.png")
+        self.assertEqual(self.cache.size_bytes, len(self.png))
+        self.cache.discard("http://b.test/2.png")
+        self.assertEqual(self.cache.size_bytes, 0)
+        self.assertIsNone(self.cache.decoded(first.digest))
+
+    def test_least_recently_used_bodies_are_evicted_within_the_budget(self):
+        cache = remote_image._ResponseCache(10, 1024)
+        policy = remote_image._CachePolicy(True, 60, None, None)
+        cache.put("a", b"aaaa", "image/png", policy)
+        cache.put("b", b"bbbb", "image/png", policy)
+        cache.get("a")
+        cache.put("c", b"cccc", "image/png", policy)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.size_bytes, 8)
+        self.assertIsNone(cache.put("d", b"d" * 11, "image/png", policy))
+
+    def test_freshness_follows_cache_control_expires_and_age(self):
+        cases = [
+            ({"Cache-Control": "max-age=60"}, True, 60),
+            ({"Cache-Control": "max-age=60, s-maxage=5"}, True, 5),
+            ({"Cache-Control": "max-age=60", "Age": "20"}, True, 40),
+            ({"Cache-Control": "max-age=60", "Age": "90"}, False, 0),
+            (
+                {
+                    "Date": "Tue, 15 Nov 1994 08:12:31 GMT",
+                    "Expires": "Tue, 15 Nov 1994 08:13:31 GMT",
+                },
+                True,
+                60,
+            ),
+            ({"Expires": "0"}, False, 0),
+            ({"Cache-Control": "no-cache, max-age=60", "ETag": '"x"'}, True, 0),
+            ({"ETag": ['"x"', '"y"'], "Cache-Control": "max-age=60"}, False, 0),
+        ]
+        for headers, storable, lifetime in cases:
+            with self.subTest(headers=headers):
+                policy = remote_image._cache_policy(FakeHeaders(headers))
+                self.assertEqual(policy.storable, storable)
+                self.assertEqual(policy.lifetime, lifetime)
+
+
+class ReducedDecodeTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        jpeg_output = BytesIO()
+        Image.new("RGB", (1600, 1200), (200, 40, 40)).save(
+            jpeg_output, format="JPEG"
+        )
+        cls.jpeg = jpeg_output.getvalue()
+        png_output = BytesIO()
+        Image.new("RGB", (40, 20), (0, 90, 180)).save(png_output, format="PNG")
+        cls.png = png_output.getvalue()
+
+    def setUp(self):
+        super().setUp()
+        cache = remote_image._ResponseCache(1024 * 1024, 16 * 1024 * 1024)
+        active = patch("remote_image._RESPONSE_CACHE", cache)
+        active.start()
+        self.addCleanup(active.stop)
+
+    def test_jpegs_are_drafted_at_a_reduced_scale(self):
+        jpeg_class = JpegImagePlugin.JpegImageFile
+        with patch.object(
+            jpeg_class, "draft", autospec=True, side_effect=jpeg_class.draft
+        ) as drafted, patch.object(
+            Image.Image, "reduce", autospec=True, side_effect=Image.Image.reduce
+        ) as reduced:
+            image = remote_image._decode_image(self.jpeg, "image/jpeg", max_side=200)
+
+        drafted.assert_called_once_with(ANY, "RGB", (200, 150))
+        reduced.assert_not_called()
+        self.assertEqual((image.mode, image.size), ("RGB", (200, 150)))
+        self.assertEqual(image.info, {"original_size": (1600, 1200)})
+        red, green, blue = image.getpixel((100, 75))
+        self.assertGreater(red, 150)
+        self.assertLess(green, 80)
+
+    def test_other_formats_are_reduced_and_resized_after_decoding(self):
+        image = remote_image._decode_image(self.png, "image/png", max_side=15)
+
+        self.assertEqual(image.size, (15, 8))
+        self.assertEqual(image.getpixel((7, 4)), (0, 90, 180))
+        self.assertEqual(image.info, {"original_size": (40, 20)})
+
+        small = remote_image._decode_image(self.png, "image/png", max_side=100)
+        self.assertEqual(small.size, (40, 20))
+        self.assertEqual(small.info, {"original_size": (40, 20)})
+
+    def test_invalid_max_side_is_rejected(self):
+        for max_side in (0, -5, 2.5, True):
+            with self.subTest(max_side=max_side), self.assertRaises(ValueError):
+                remote_image.fetch_image_from_url(
+                    "http://public.test/a.jpg", max_side=max_side
+                )
+
+    def test_full_and_reduced_decodes_share_one_cached_download(self):
+        response = FakeResponse(
+            headers={"Content-Type": "image/jpeg", "Cache-Control": "max-age=60"},
+            chunks=[self.jpeg],
+        )
+        decode = Mock(wraps=remote_image._decode_image)
+        with scripted_transport(
+            [response], queued_resolver([PUBLIC_V4])
+        ) as transport, patch("remote_image._decode_image", decode):
+            preview = remote_image.fetch_image_from_url(
+                "http://public.test/a.jpg", max_side=320
+            )
+            again = remote_image.fetch_image_from_url(
+                "http://public.test/a.jpg", max_side=320
+            )
+            full = remote_image.fetch_image_from_url("http://public.test/a.jpg")
+
+        self.assertEqual(len(transport["connections"]), 1)
+        self.assertEqual(decode.call_count, 2)
+        self.assertEqual(preview.size, (320, 240))
+        self.assertEqual(again.info["original_size"], (1600, 1200))
+        self.assertEqual(full.size, (1600, 1200))
+        self.assertEqual(full.info, {})
+
+    def test_reduced_decodes_keep_their_original_size_on_disk(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        disk = disk_cache.DiskCache(directory.name)
+        policy = remote_image._CachePolicy(True, 60, None, None)
+        decode = Mock(wraps=remote_image._decode_image)
+        with patch(
+            "remote_image.disk_cache.shared_disk_cache", return_value=disk
+        ), patch("remote_image._decode_image", decode):
+            entry = remote_image._RESPONSE_CACHE.put(
+                "http://a.test/1.png", self.png, "image/png", policy
+            )
+            remote_image._image_from_entry(entry, 10)
+            remote_image._RESPONSE_CACHE.clear()
+            entry = remote_image._RESPONSE_CACHE.put(
+                "http://a.test/1.png", self.png, "image/png", policy
+            )
+            restored = remote_image._image_from_entry(entry, 10)
+            full = remote_image._image_from_entry(entry)
+
+        self.assertEqual(decode.call_count, 2)
+        self.assertEqual(restored.size, (10, 5))
+        self.assertEqual(restored.info, {"original_size": (40, 20)})
+        self.assertEqual(full.size, (40, 20))
+
+
+class BodyAndImageLimitTests(RemoteImageTestCase):
     @classmethod
     def setUpClass(cls):
         png_output = BytesIO()
@@ -826,7 +2069,7 @@ class AppWiringTests(unittest.TestCase):
         self.assertNotIn("requests.get", source)
         self.assertNotIn("import requests", source)
         self.assertNotIn("from io import BytesIO", source)
-        self.assertIn("streamlit>=1.53.0", requirements)
+        self.assertIn("streamlit>=1.66.0", requirements)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,437 @@
+import asyncio
+from contextlib import contextmanager
+from io import BytesIO
+import socket
+import unittest
+from unittest.mock import patch
+
+from PIL import Image
+
+import remote_image
+from test_remote_image import PUBLIC_V4, RemoteImageTestCase, queued_resolver
+
+
+def http_response(status=200, headers=None, body=b"", reason="OK"):
+    lines = ["HTTP/1.1 {} {}".format(status, reason)]
+    for name, value in (headers or {}).items():
+        for item in value if isinstance(value, list) else [value]:
+            lines.append("{}: {}".format(name, item))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class FakeWriter:
+    def __init__(self):
+        self.written = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.written.extend(data)
+
+    async def drain(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+    def request_line(self):
+        return bytes(self.written).split(b"\r\n", 1)[0].decode("ascii")
+
+    def request_headers(self):
+        head = bytes(self.written).split(b"\r\n\r\n", 1)[0].decode("ascii")
+        return dict(line.split(": ", 1) for line in head.split("\r\n")[1:])
+
+
+@contextmanager
+def scripted_async_transport(responses, resolver):
+    response_queue = list(responses)
+    writers = []
+    opened_targets = []
+
+    async def open_connection(target, _endpoints, _deadline):
+        if not response_queue:
+            raise AssertionError("Unexpected HTTP connection")
+        reader = asyncio.StreamReader(limit=remote_image.MAX_RESPONSE_HEAD_BYTES)
+        payload = response_queue.pop(0)
+        if payload is not None:
+            reader.feed_data(payload)
+            reader.feed_eof()
+        writer = FakeWriter()
+        writers.append(writer)
+        opened_targets.append(target)
+        return reader, writer
+
+    with patch("remote_image.socket.getaddrinfo", resolver), patch(
+        "remote_image._open_connection_async", side_effect=open_connection
+    ) as open_mock:
+        yield {"open_mock": open_mock, "targets": opened_targets, "writers": writers}
+
+
+def fetch(url):
+    return asyncio.run(remote_image.fetch_image_from_url_async(url))
+
+
+class AsyncFetchWorkflowTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 3), (10, 20, 30)).save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def image_response(self, content_type="image/png"):
+        return http_response(
+            headers={"Content-Type": content_type, "Content-Length": len(self.png)},
+            body=self.png,
+        )
+
+    def redirect(self, location):
+        return http_response(302, {"Location": location}, reason="Found")
+
+    def test_complete_offline_fetch_returns_detached_rgb_image(self):
+        resolver = queued_resolver([PUBLIC_V4])
+        with scripted_async_transport([self.image_response()], resolver) as transport:
+            image = fetch("http://public.test/image.png")
+
+        self.assertEqual((image.mode, image.size), ("RGB", (2, 3)))
+        self.assertEqual(image.info, {})
+        self.assertEqual(resolver.call_count, 1)
+        writer = transport["writers"][0]
+        self.assertEqual(writer.request_line(), "GET /image.png HTTP/1.1")
+        headers = writer.request_headers()
+        self.assertEqual(headers["Host"], "public.test")
+        self.assertEqual(headers["Accept-Encoding"], "identity")
+        self.assertNotIn("Authorization", headers)
+        self.assertNotIn("Cookie", headers)
+        self.assertTrue(writer.closed)
+
+    def test_relative_redirect_is_revalidated_and_resolved_again(self):
+        resolver = queued_resolver([PUBLIC_V4], [PUBLIC_V4])
+        responses = [self.redirect("/final.png"), self.image_response()]
+
+        with scripted_async_transport(responses, resolver) as transport:
+            image = fetch("http://public.test/start.png")
+
+        self.assertEqual(image.size, (2, 3))
+        self.assertEqual(resolver.call_count, 2)
+        self.assertEqual(transport["open_mock"].call_count, 2)
+        self.assertEqual(
+            transport["writers"][1].request_line(), "GET /final.png HTTP/1.1"
+        )
+
+    def test_shared_cache_is_revalidated_and_then_served_fresh(self):
+        cache = remote_image._ResponseCache(1024 * 1024, 1024 * 1024)
+        stored = http_response(
+            headers={
+                "Content-Type": "image/png",
+                "Content-Length": len(self.png),
+                "ETag": '"v1"',
+            },
+            body=self.png,
+        )
+        not_modified = http_response(
+            304, {"Cache-Control": "max-age=60"}, reason="Not Modified"
+        )
+        resolver = queued_resolver([PUBLIC_V4], [PUBLIC_V4])
+
+        with patch("remote_image._RESPONSE_CACHE", cache), scripted_async_transport(
+            [stored, not_modified], resolver
+        ) as transport:
+            first = fetch("http://public.test/image.png")
+            second = fetch("http://public.test/image.png")
+            third = fetch("http://public.test/image.png")
+
+        self.assertEqual(transport["open_mock"].call_count, 2)
+        conditional = transport["writers"][1].request_headers()
+        self.assertEqual(conditional["If-None-Match"], '"v1"')
+        self.assertEqual({first.size, second.size, third.size}, {(2, 3)})
+        self.assertIsNot(second, third)
+
+    def test_redirect_to_private_address_is_blocked_before_second_request(self):
+        resolver = queued_resolver([PUBLIC_V4], ["127.0.0.1"])
+        responses = [self.redirect("http://private.test/secret.png")]
+
+        with scripted_async_transport(responses, resolver) as transport:
+            with self.assertRaises(remote_image.UnsafeImageURL):
+                fetch("http://public.test/start.png")
+
+        self.assertEqual(resolver.call_count, 2)
+        self.assertEqual(transport["open_mock"].call_count, 1)
+
+    def test_same_host_dns_rebinding_is_blocked(self):
+        resolver = queued_resolver([PUBLIC_V4], ["169.254.169.254"])
+
+        with scripted_async_transport(
+            [self.redirect("/again.png")], resolver
+        ) as transport, self.assertRaises(remote_image.UnsafeImageURL):
+            fetch("http://public.test/start.png")
+
+        self.assertEqual(transport["open_mock"].call_count, 1)
+
+    def test_mixed_dns_answer_prevents_any_connection(self):
+        resolver = queued_resolver([PUBLIC_V4, "10.0.0.1"])
+
+        with scripted_async_transport(
+            [self.image_response()], resolver
+        ) as transport, self.assertRaises(remote_image.UnsafeImageURL):
+            fetch("http://public.test/image.png")
+
+        transport["open_mock"].assert_not_called()
+
+    def test_https_to_http_redirect_is_blocked(self):
+        resolver = queued_resolver([PUBLIC_V4])
+
+        with scripted_async_transport(
+            [self.redirect("http://public.test/final.png")], resolver
+        ) as transport, self.assertRaises(remote_image.UnsafeImageURL):
+            fetch("https://public.test/start.png")
+
+        self.assertEqual(transport["open_mock"].call_count, 1)
+
+    def test_malformed_and_duplicate_redirects_are_rejected(self):
+        cases = [
+            (self.redirect("http://[::1"), remote_image.InvalidImageURL),
+            (
+                http_response(302, {"Location": ["/one.png", "/two.png"]}),
+                remote_image.ImageDownloadError,
+            ),
+        ]
+        for response, exception in cases:
+            with self.subTest(exception=exception), scripted_async_transport(
+                [response], queued_resolver([PUBLIC_V4])
+            ) as transport, self.assertRaises(exception):
+                fetch("http://public.test/start.png")
+            self.assertTrue(transport["writers"][0].closed)
+
+    def test_three_redirects_are_allowed_but_a_fourth_is_not_followed(self):
+        redirects = [self.redirect("/{}.png".format(index)) for index in range(4)]
+        resolver = queued_resolver(*([[PUBLIC_V4]] * 4))
+        with scripted_async_transport(redirects, resolver) as transport:
+            with self.assertRaises(remote_image.ImageDownloadError):
+                fetch("http://public.test/start.png")
+        self.assertEqual(transport["open_mock"].call_count, 4)
+
+        allowed = redirects[:3] + [self.image_response()]
+        with scripted_async_transport(
+            allowed, queued_resolver(*([[PUBLIC_V4]] * 4))
+        ):
+            self.assertEqual(fetch("http://public.test/start.png").size, (2, 3))
+
+
+class AsyncBodyLimitTests(RemoteImageTestCase):
+    @classmethod
+    def setUpClass(cls):
+        output = BytesIO()
+        Image.new("RGB", (2, 2), "red").save(output, format="PNG")
+        cls.png = output.getvalue()
+
+    def fetch_response(self, payload):
+        with scripted_async_transport([payload], queued_resolver([PUBLIC_V4])):
+            return fetch("http://public.test/image.png")
+
+    def test_chunked_body_is_reassembled(self):
+        middle = len(self.png) // 2
+        chunks = b"".join(
+            b"%x;ext=1\r\n%s\r\n" % (len(part), part)
+            for part in (self.png[:middle], self.png[middle:])
+        )
+        payload = http_response(
+            headers={"Content-Type": "image/png", "Transfer-Encoding": "chunked"},
+            body=chunks + b"0\r\nTrailer: yes\r\n\r\n",
+        )
+
+        self.assertEqual(self.fetch_response(payload).getpixel((0, 0)), (255, 0, 0))
+
+    def test_disallowed_mime_and_encoding_are_rejected(self):
+        for headers in (
+            {"Content-Type": "text/html"},
+            {"Content-Type": "image/png", "Content-Encoding": "gzip"},
+        ):
+            with self.subTest(headers=headers), self.assertRaises(
+                remote_image.InvalidImageData
+            ):
+                self.fetch_response(http_response(headers=headers, body=self.png))
+
+    def test_content_length_and_streamed_byte_caps(self):
+        with patch("remote_image.MAX_DOWNLOAD_BYTES", 5):
+            for payload in (
+                http_response(
+                    headers={"Content-Type": "image/png", "Content-Length": "6"},
+                    body=b"123456",
+                ),
+                http_response(headers={"Content-Type": "image/png"}, body=b"123456"),
+                http_response(
+                    headers={
+                        "Content-Type": "image/png",
+                        "Transfer-Encoding": "chunked",
+                    },
+                    body=b"6\r\n123456\r\n0\r\n\r\n",
+                ),
+            ):
+                with self.subTest(payload=payload), self.assertRaises(
+                    remote_image.ImageTooLarge
+                ):
+                    self.fetch_response(payload)
+
+    def test_incomplete_conflicting_and_invalid_responses_are_rejected(self):
+        for payload in (
+            http_response(
+                headers={"Content-Type": "image/png", "Content-Length": "50"},
+                body=b"123",
+            ),
+            http_response(
+                headers={
+                    "Content-Type": "image/png",
+                    "Content-Length": "3",
+                    "Transfer-Encoding": "chunked",
+                },
+                body=b"3\r\n123\r\n0\r\n\r\n",
+            ),
+            http_response(
+                headers={"Content-Type": "image/png", "Transfer-Encoding": "chunked"},
+                body=b"zz\r\n",
+            ),
+            http_response(404, reason="Not Found"),
+            b"SPDY/9 200 OK\r\n\r\n",
+            b"HTTP/1.1 200 OK\r\nContent-Type: image/png",
+        ):
+            with self.subTest(payload=payload), self.assertRaises(
+                remote_image.ImageDownloadError
+            ):
+                self.fetch_response(payload)
+
+    def test_oversized_response_head_is_rejected(self):
+        payload = http_response(
+            headers={"X-Padding": "a" * (remote_image.MAX_RESPONSE_HEAD_BYTES + 1)}
+        )
+        with self.assertRaises(remote_image.ImageDownloadError):
+            self.fetch_response(payload)
+
+    def test_hard_deadline_stops_a_silent_server(self):
+        with patch("remote_image.TOTAL_TIMEOUT_SECONDS", 0.2), self.assertRaises(
+            remote_image.ImageDownloadError
+        ):
+            self.fetch_response(None)
+
+    def test_decoded_image_limits_are_enforced(self):
+        payload = http_response(headers={"Content-Type": "image/png"}, body=self.png)
+        with patch("remote_image.MAX_IMAGE_PIXELS", 3), self.assertRaises(
+            remote_image.ImageTooLarge
+        ):
+            self.fetch_response(payload)
+
+
+class AsyncConcurrencyLimitTests(RemoteImageTestCase):
+    def test_global_and_per_host_limits_bound_concurrent_downloads(self):
+        active = {"all": 0, "max_all": 0}
+        per_host = {}
+
+        async def download(target, _deadline, _cached=None):
+            host = per_host.setdefault(target.hostname, {"now": 0, "max": 0})
+            active["all"] += 1
+            host["now"] += 1
+            active["max_all"] = max(active["max_all"], active["all"])
+            host["max"] = max(host["max"], host["now"])
+            await asyncio.sleep(0.01)
+            active["all"] -= 1
+            host["now"] -= 1
+            raise remote_image.ImageDownloadError("done")
+
+        async def run_all():
+            urls = ["http://a.test/{}.png".format(index) for index in range(6)] + [
+                "http://b.test/{}.png".format(index) for index in range(6)
+            ]
+            return await asyncio.gather(
+                *(remote_image.fetch_image_from_url_async(url) for url in urls),
+                return_exceptions=True,
+            )
+
+        with patch("remote_image.ASYNC_MAX_CONCURRENT_FETCHES", 3), patch(
+            "remote_image.ASYNC_MAX_CONCURRENT_PER_HOST", 2
+        ), patch("remote_image._download_once_async", side_effect=download):
+            results = asyncio.run(run_all())
+
+        self.assertEqual(len(results), 12)
+        self.assertTrue(
+            all(
+                isinstance(result, remote_image.ImageDownloadError)
+                for result in results
+            )
+        )
+        self.assertEqual(active["max_all"], 3)
+        self.assertEqual(max(host["max"] for host in per_host.values()), 2)
+
+    def test_waiting_for_a_slot_counts_against_the_deadline(self):
+        async def run():
+            semaphore = asyncio.Semaphore(0)
+            deadline = remote_image.time.monotonic() + 0.05
+            with self.assertRaises(remote_image.ImageDownloadError):
+                async with remote_image._acquire_within(semaphore, deadline):
+                    self.fail("the semaphore has no free slot")
+            semaphore.release()
+            async with remote_image._acquire_within(semaphore, deadline + 1):
+                self.assertTrue(semaphore.locked())
+            self.assertFalse(semaphore.locked())
+
+        asyncio.run(run())
+
+
+class AsyncConnectionPinningTests(RemoteImageTestCase):
+    def test_connects_to_validated_peer_and_rejects_a_mismatch(self):
+        async def run():
+            server = await asyncio.start_server(
+                lambda _reader, writer: writer.close(), "127.0.0.1", 0
+            )
+            port = server.sockets[0].getsockname()[1]
+            endpoint = remote_image._Endpoint(
+                socket.AF_INET,
+                socket.SOCK_STREAM,
+                socket.IPPROTO_TCP,
+                ("127.0.0.1", port),
+                "127.0.0.1",
+            )
+            target = remote_image._Target(
+                "http", "public.test", port, "public.test", "/", "http://public.test/"
+            )
+            deadline = remote_image.time.monotonic() + 5
+            try:
+                _reader, writer = await remote_image._open_connection_async(
+                    target, (endpoint,), deadline
+                )
+                peer = writer.get_extra_info("peername")
+                writer.close()
+                with self.assertRaises(remote_image.UnsafeImageURL):
+                    await remote_image._open_connection_async(
+                        target._replace(port=port + 1), (endpoint,), deadline
+                    )
+            finally:
+                server.close()
+                await server.wait_closed()
+            return peer
+
+        self.assertEqual(asyncio.run(run())[0], "127.0.0.1")
+
+    def test_unreachable_endpoints_are_normalized(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        listener.close()
+        endpoint = remote_image._Endpoint(
+            socket.AF_INET,
+            socket.SOCK_STREAM,
+            socket.IPPROTO_TCP,
+            ("127.0.0.1", port),
+            "127.0.0.1",
+        )
+        target = remote_image._Target(
+            "http", "public.test", port, "public.test", "/", "http://public.test/"
+        )
+
+        with self.assertRaises(remote_image.ImageDownloadError):
+            asyncio.run(
+                remote_image._open_connection_async(
+                    target, (endpoint,), remote_image.time.monotonic() + 5
+                )
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
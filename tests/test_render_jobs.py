@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import threading
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from pipeline import EditSettings, render_final
+import render_jobs
+from test_remote_image import wait_until
+
+
+SETTINGS = EditSettings(False, True, None, 30, (120, 80, 150, 200))
+
+
+class RenderQueueTests(unittest.TestCase):
+    def setUp(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        self.image = Image.fromarray(
+            np.random.default_rng(0).integers(0, 256, (30, 40, 3), dtype=np.uint8)
+        )
+        self.queue = render_jobs.RenderQueue(executor, debounce=0)
+        self.addCleanup(self.queue.cancel)
+
+    def test_renders_the_settings_and_encodes_them_as_png(self):
+        rendered = self.queue.request("key", self.image, SETTINGS).result(5)
+
+        expected = np.asarray(render_final(self.image, SETTINGS))
+        np.testing.assert_array_equal(np.asarray(rendered.image), expected)
+        with Image.open(BytesIO(rendered.png)) as exported:
+            np.testing.assert_array_equal(np.asarray(exported), expected)
+
+    def test_repeated_requests_share_one_job(self):
+        job = self.queue.request("key", self.image, SETTINGS)
+
+        self.assertIs(self.queue.request("key", self.image, SETTINGS), job)
+        job.result(5)
+        self.assertIs(self.queue.request("key", self.image, SETTINGS), job)
+
+    def test_superseded_jobs_are_cancelled_before_they_start(self):
+        queue = render_jobs.RenderQueue(debounce=60)
+        self.addCleanup(queue.cancel)
+        outcomes = metrics.REGISTRY.counter(
+            "imageworkdesk_renders_total", "", ["outcome"]
+        )
+        before = outcomes.value(outcome="cancelled")
+
+        with patch("render_jobs.render_steps") as render_steps:
+            first = queue.request("first", self.image, SETTINGS)
+            second = queue.request("second", self.image, SETTINGS)
+
+            self.assertTrue(first.cancelled)
+            with self.assertRaises(render_jobs.RenderCancelled):
+                first.result(0)
+            self.assertFalse(second.done())
+            queue.cancel()
+        render_steps.assert_not_called()
+        self.assertEqual(outcomes.value(outcome="cancelled"), before + 2)
+
+    def test_running_jobs_stop_at_their_next_step(self):
+        started, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        steps = []
+
+        def render_steps(image, settings):
+            started.set()
+            release.wait(5)
+            for step in range(3):
+                steps.append(step)
+                yield image
+
+        with patch("render_jobs.render_steps", render_steps):
+            job = self.queue.request("first", self.image, SETTINGS)
+            started.wait(5)
+            newer = self.queue.request("second", self.image, SETTINGS)
+            release.set()
+            with self.assertRaises(render_jobs.RenderCancelled):
+                job.result(5)
+            newer.result(5)
+
+        self.assertEqual(steps, [0, 0, 1, 2])
+
+    def test_discarded_queues_cancel_their_job(self):
+        queue = render_jobs.RenderQueue(debounce=60)
+        job = queue.request("key", self.image, SETTINGS)
+
+        del queue
+        wait_until(job.done)
+        self.assertTrue(job.cancelled)
+
+
+if __name__ == "__main__":
+    unittest.main()
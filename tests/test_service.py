@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+from io import BytesIO
+import json
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import numpy as np
+from PIL import Image
+
+from batch import BatchRecipe
+from pipeline import EditSettings, render_final
+from remote_image import UnsafeImageURL
+import service
+from test_remote_image import (
+    PUBLIC_V4,
+    RemoteImageTestCase,
+    StallingResponse,
+    png_bytes,
+    queued_resolver,
+    random_image,
+    scripted_transport,
+    wait_until,
+)
+
+
+class ParseQueryTests(unittest.TestCase):
+    def test_an_empty_query_leaves_the_image_unchanged(self):
+        self.assertEqual(
+            service.parse_query(""),
+            service.ProcessRequest(
+                BatchRecipe(EditSettings(False, False, None)),
+                None,
+                service.DEFAULT_TIMEOUT_SECONDS,
+            ),
+        )
+
+    def test_parameters_map_to_a_recipe(self):
+        request = service.parse_query(
+            "mirror=1&tone=bw&rotate=270&contrast=150&crop=0.1,0,0.9,0.5"
+            "&url=https%3A%2F%2Fexample.com%2Fa.png&timeout=2.5"
+        )
+
+        self.assertEqual(
+            request.recipe,
+            BatchRecipe(
+                EditSettings(False, True, "Black & White", 270, (100, 100, 150, 100)),
+                (0.1, 0.0, 0.9, 0.5),
+            ),
+        )
+        self.assertEqual(request.url, "https://example.com/a.png")
+        self.assertEqual(request.timeout, 2.5)
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in (
+            "colour=1",
+            "mirror=yes",
+            "mirror=1&mirror=0",
+            "tone=sepia",
+            "rotate=-1",
+            "sharpness=1001",
+            "crop=0.5,0,0.4,1",
+            "crop=0,0,1",
+            "timeout=0",
+            "timeout=1e9",
+            "timeout=nan",
+            "novalue",
+        ):
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                service.parse_query(query)
+
+
+class JobQueueTests(unittest.TestCase):
+    def test_jobs_past_their_deadline_are_not_run(self):
+        jobs = service.JobQueue(workers=1, max_queue=1)
+        self.addCleanup(jobs.shutdown)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        function = Mock()
+
+        jobs.submit(lambda job: release.wait(5), time.monotonic() + 5)
+        wait_until(lambda: jobs.stats().busy == 1)
+        expired = jobs.submit(function, time.monotonic() + 0.05)
+        with self.assertRaises(service.ServiceSaturated):
+            jobs.submit(function, time.monotonic() + 5)
+        with self.assertRaises(service.DeadlineExceeded):
+            expired.result()
+        release.set()
+
+        wait_until(lambda: jobs.stats().busy == 0)
+        function.assert_not_called()
+
+
+class ProcessingServiceTests(unittest.TestCase):
+    def setUp(self):
+        self.service = service.ProcessingService(service.JobQueue(1, 1))
+        self.addCleanup(self.service.close)
+        self.image = random_image((60, 40))
+
+    def post(self, query, body=b"", content_type="image/png"):
+        connection = http.client.HTTPConnection(
+            self.service.host, self.service.port, timeout=10
+        )
+        self.addCleanup(connection.close)
+        connection.request(
+            "POST", "/process?" + query, body, {"Content-Type": content_type}
+        )
+        response = connection.getresponse()
+        return response, response.read()
+
+    def blocked_renders(self):
+        started, release = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+
+        def render_steps(image, settings):
+            started.set()
+            release.wait(5)
+            yield image
+            yield image
+
+        active = patch("service.render_steps", render_steps)
+        active.start()
+        self.addCleanup(active.stop)
+        return started, release
+
+    def test_uploads_are_edited_and_streamed_back_as_png(self):
+        response, body = self.post(
+            "tone=grayscale&rotate=90&contrast=150&crop=0,0,0.5,1",
+            png_bytes(self.image),
+        )
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Transfer-Encoding"), "chunked")
+        expected = render_final(
+            self.image.crop((0, 0, 30, 40)),
+            EditSettings(False, False, "Grayscale", 90, (100, 100, 150, 100)),
+        )
+        with Image.open(BytesIO(body)) as rendered:
+            np.testing.assert_array_equal(np.asarray(rendered), np.asarray(expected))
+
+    def test_urls_are_fetched_with_the_remote_image_limits(self):
+        with patch(
+            "service.fetch_image_from_url", return_value=self.image
+        ) as fetch:
+            response, _body = self.post("mirror=1&url=https%3A%2F%2Fexample.com%2Fa")
+            fetch.side_effect = UnsafeImageURL("Private address.")
+            rejected, error = self.post("url=http%3A%2F%2F10.0.0.1%2F")
+
+        self.assertEqual(response.status, 200)
+        fetch.assert_any_call("https://example.com/a")
+        self.assertEqual(rejected.status, 400)
+        self.assertEqual(json.loads(error), {"error": "Private address."})
+
+    def test_invalid_requests_are_rejected(self):
+        for query, body, status in (
+            ("rotate=400", png_bytes(self.image), 400),
+            ("", b"", 400),
+            ("url=https%3A%2F%2Fexample.com%2F", b"image", 400),
+            ("", b"not an image", 422),
+        ):
+            with self.subTest(query=query, body=body[:8]):
+                response, _body = self.post(query, body)
+                self.assertEqual(response.status, status)
+
+    def test_requests_beyond_the_queue_are_refused_with_429(self):
+        started, release = self.blocked_renders()
+        data = png_bytes(self.image)
+        with ThreadPoolExecutor(max_workers=2) as clients:
+            running = clients.submit(self.post, "", data)
+            started.wait(5)
+            queued = clients.submit(self.post, "", data)
+            wait_until(lambda: self.service.jobs.stats().queued == 1)
+
+            refused, _body = self.post("", data)
+            release.set()
+
+            self.assertEqual(refused.status, 429)
+            self.assertEqual(refused.getheader("Retry-After"), "1")
+            self.assertEqual(running.result()[0].status, 200)
+            self.assertEqual(queued.result()[0].status, 200)
+
+    def test_requests_past_their_deadline_get_504(self):
+        started, release = self.blocked_renders()
+
+        response, body = self.post("timeout=0.2", png_bytes(self.image))
+
+        self.assertEqual(response.status, 504)
+        self.assertIn("deadline", json.loads(body)["error"])
+        self.assertTrue(started.is_set())
+        release.set()
+        wait_until(lambda: self.service.jobs.stats().busy == 0)
+
+    def test_stalled_urls_get_504_and_free_their_worker(self):
+        RemoteImageTestCase.setUp(self)
+        response = StallingResponse({"Content-Type": "image/png"}, [b"\x89PNG"])
+        # Connect before the transport patch replaces the fetch's networking.
+        connection = http.client.HTTPConnection(
+            self.service.host, self.service.port, timeout=10
+        )
+        self.addCleanup(connection.close)
+        connection.connect()
+
+        with scripted_transport(
+            [response], queued_resolver([PUBLIC_V4])
+        ) as transport:
+            response.sockets = transport["sockets"]
+            connection.request(
+                "POST", "/process?timeout=0.3&url=http%3A%2F%2Fpublic.test%2Fslow.png"
+            )
+            timed_out = connection.getresponse()
+            body = timed_out.read()
+            wait_until(lambda: self.service.jobs.stats().busy == 0, timeout=2)
+
+        self.assertEqual(timed_out.status, 504)
+        self.assertIn("deadline", json.loads(body)["error"])
+        self.assertTrue(response.sockets[0].shut_down.is_set())
+
+    def test_health_reports_the_queue(self):
+        connection = http.client.HTTPConnection(self.service.host, self.service.port)
+        self.addCleanup(connection.close)
+        connection.request("GET", "/healthz")
+
+        self.assertEqual(
+            json.loads(connection.getresponse().read()),
+            {"workers": 1, "busy": 0, "queued": 0, "max_queue": 1},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()